@@ -0,0 +1,336 @@
+'''
+Tracking and statistics for many videos (e.g. all clips of a tournament) by a pool of processes
+'''
+
+import argparse
+import csv
+import multiprocessing
+import os
+import time
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import constants
+from profiler import StageProfiler
+
+
+VIDEO_EXTENSIONS = ['.avi', '.mp4', '.wmv', '.mkv', '.mov']
+STATISTICS = ['heatmap', 'trajectories', 'combats']
+# Files saved by statistics, they are checked to skip statistics, which are up to date
+STATISTICS_FILES = {'heatmap': 'heatmap.png', 'trajectories': 'trajectories.png', 'combats': 'combats_matrix.png'}
+
+_worker = {} # state of worker process: GPU, device and the detector loaded once for all videos of worker
+
+
+def collect_videos(source):
+    '''
+    Collect videos from directory or from manifest (text file with a path to video on each line)
+    :param source: directory or manifest
+    :return: list of paths to videos
+    :raise ValueError: videos have the same name (results of videos are named by names of videos without folders
+    and extensions, so they would overwrite each other)
+    '''
+    if os.path.isdir(source):
+        videos = sorted(os.path.join(source, name) for name in os.listdir(source)
+                        if os.path.splitext(name)[1].lower() in VIDEO_EXTENSIONS)
+    else:
+        videos = []
+        with open(source) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    # Relative paths are counted from the folder of manifest
+                    videos.append(os.path.join(os.path.dirname(os.path.abspath(source)), line))
+    names = defaultdict(list)
+    for video in videos:
+        names[os.path.splitext(os.path.basename(video))[0]].append(video)
+    duplicates = ['{}: {}'.format(name, ', '.join(paths)) for name, paths in names.items() if len(paths) > 1]
+    if duplicates:
+        raise ValueError('Videos have the same names, please rename them:\n'+'\n'.join(duplicates))
+    return videos
+
+
+def is_up_to_date(output, source):
+    return os.path.isfile(output) and os.path.getmtime(output) >= os.path.getmtime(source)
+
+
+def plan_clip(video, statistics, render_video, force):
+    '''
+    Find steps of processing of the video, which results are missing or outdated
+    :return: flag of tracking and list of statistics to calculate
+    '''
+    name = os.path.splitext(os.path.basename(video))[0]
+    markup = os.path.join(constants.RESULTS_FOLDER, name+'.txt')
+    checkpoint = os.path.join(constants.RESULTS_FOLDER, name+'.ckpt') # tracking was interrupted
+    marked_video = os.path.join(constants.RESULTS_FOLDER, name+'.avi')
+    track = force or os.path.isfile(checkpoint) or not is_up_to_date(markup, video) or \
+        (render_video and not is_up_to_date(marked_video, video))
+    statdir = os.path.join(constants.STATISTICS_FOLDER, name)
+    stats = [stat for stat in statistics
+             if track or not is_up_to_date(os.path.join(statdir, STATISTICS_FILES[stat]), markup)]
+    return track, stats
+
+
+def available_memory():
+    '''
+    :return: available physical memory in bytes (None if it is unknown)
+    '''
+    try:
+        return os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_AVPHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def plan_workers(n_clips, device, gpus, workers_per_gpu, threads):
+    '''
+    Choose number of worker processes by CPU cores, available memory and GPUs
+    '''
+    workers = max(1, (os.cpu_count() or 1)//threads)
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, max(1, int(memory//(constants.BATCH_WORKER_MEMORY_GB*2**30))))
+    if device == 'cuda':
+        workers = min(workers, len(gpus)*workers_per_gpu)
+    return max(1, min(workers, n_clips))
+
+
+def init_worker(gpus, device, threads):
+    '''
+    Initialize worker process: take GPU and limit threads of torch
+    '''
+    import torch
+    gpu = gpus.get()
+    if device == 'cuda':
+        os.environ['CUDA_VISIBLE_DEVICES'] = str(gpu)
+    torch.set_num_threads(threads)
+    _worker.update(gpu=gpu, device=device, model=None)
+
+
+def process_clip(video, track, statistics, render_video, profile=False):
+    '''
+    Track humans on the video and calculate statistics (launched in worker process)
+    :param profile: save report of profiling of stages into results/<video name>.profile.json and .prom
+    :return: dictionary with status and timings of steps
+    '''
+    from mottracker import MOTTracker
+    from motionheatmap import MotionHeatmap
+    from motiontrajectories import MotionTrajectories
+    from combatscounter import CombatsCounter
+    from markupstore import MarkupStore
+    name = os.path.splitext(os.path.basename(video))[0]
+    markup = os.path.join(constants.RESULTS_FOLDER, name+'.txt')
+    statdir = os.path.join(constants.STATISTICS_FOLDER, name)
+    profiler = StageProfiler(name, enabled=profile)
+    result = {'video': video, 'status': 'done', 'error': ''}
+    start = time.perf_counter()
+    try:
+        if track:
+            if _worker['model'] is None: # detector is loaded once for all videos of worker
+                from detector import build_model, tracker_options
+                _worker['model'] = build_model(tracker_options(), _worker['device'])
+            step = time.perf_counter()
+            tracker = MOTTracker(video, _worker['gpu'], device=_worker['device'], model=_worker['model'],
+                                 render_video=render_video, resume=True, profiler=profiler, online_statistics=True)
+            if not tracker.trackVideo():
+                raise RuntimeError('Tracking failed, it can be resumed by the next launch')
+            result['tracking'] = time.perf_counter()-step
+            # Statistics saved by tracker (e.g. heatmap) are not calculated again
+            statistics = [stat for stat in statistics
+                          if not is_up_to_date(os.path.join(statdir, STATISTICS_FILES[stat]), markup)]
+        if statistics:
+            with profiler.stage('markup_loading'):
+                store = MarkupStore(markup) # markup is loaded once for all statistics
+        steps = {'heatmap': lambda: MotionHeatmap(markup_file=store, out_dir=statdir,
+                                                  profiler=profiler).buildHeatmap(),
+                 'trajectories': lambda: MotionTrajectories(markup_file=store, out_dir=statdir,
+                                                            profiler=profiler).calculateTraceStatistics(),
+                 'combats': lambda: CombatsCounter(markup_file=store, out_dir=statdir,
+                                                   profiler=profiler).calculateCombatsStatistics()}
+        for stat in statistics:
+            step = time.perf_counter()
+            steps[stat]()
+            result[stat] = time.perf_counter()-step
+    except Exception as e:
+        result['status'], result['error'] = 'failed', str(e)
+        print(traceback.format_exc())
+    result['total'] = time.perf_counter()-start
+    if profile:
+        profiler.save(os.path.join(constants.RESULTS_FOLDER, name))
+    return result
+
+
+class BatchTracker:
+    '''
+    Implement processing of many videos by a pool of processes
+    '''
+
+    def __init__(self, videos, statistics=STATISTICS, device='cuda', gpus=None, workers_per_gpu=1,
+                 threads=constants.BATCH_WORKER_THREADS, render_video=True, force=False, summary_file=None,
+                 profile=False):
+        '''
+        Constructor
+        :param videos: list of videos
+        :param statistics: statistics to calculate for each video
+        :param device: device to launch the detector ('cuda' or 'cpu')
+        :param gpus: list of GPU numbers, processes are distributed over them (None - constants.GPU_NUMBER)
+        :param workers_per_gpu: maximum number of processes using one GPU
+        :param threads: number of threads of torch in each process
+        :param render_video: save marked videos
+        :param force: process videos again even if their results are up to date
+        :param summary_file: CSV file for timings of videos (None - batch_summary.csv in folder of statistics)
+        :param profile: save reports of profiling of stages for each video
+        '''
+        self.__videos = videos
+        self.__statistics = statistics
+        self.__device = device
+        self.__gpus = gpus or [constants.GPU_NUMBER]
+        self.__workerspergpu = workers_per_gpu
+        self.__threads = max(1, threads)
+        self.__rendervideo = render_video
+        self.__force = force
+        self.__summaryfile = summary_file or os.path.join(constants.STATISTICS_FOLDER, 'batch_summary.csv')
+        self.__profile = profile
+
+
+    def run(self):
+        '''
+        Process all videos and save summary
+        :return: list of dictionaries with status and timings of videos
+        '''
+        os.makedirs(constants.RESULTS_FOLDER, exist_ok=True)
+        os.makedirs(constants.STATISTICS_FOLDER, exist_ok=True)
+        results, tasks = [], []
+        for video in self.__videos:
+            track, stats = self.__planClip(video)
+            if track or stats:
+                tasks.append((video, track, stats))
+            else:
+                results.append({'video': video, 'status': 'up to date', 'error': '', 'total': 0.0})
+        print('Videos: {}, up to date: {}'.format(len(self.__videos), len(results)))
+        if tasks:
+            workers = plan_workers(len(tasks), self.__device, self.__gpus, self.__workerspergpu, self.__threads)
+            print('Processes: {} ({} threads each)'.format(workers, self.__threads))
+            context = multiprocessing.get_context('spawn') # separate CUDA contexts
+            gpus = context.Queue()
+            for i in range(workers):
+                gpus.put(self.__gpus[i % len(self.__gpus)])
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                     initargs=(gpus, self.__device, self.__threads)) as pool:
+                jobs = {pool.submit(process_clip, video, track, stats, self.__rendervideo, self.__profile): video
+                        for video, track, stats in tasks}
+                for job in as_completed(jobs):
+                    try:
+                        result = job.result()
+                    except BrokenProcessPool as e: # worker crashed, clips left in the pool are not processed
+                        result = {'video': jobs[job], 'status': 'failed', 'error': str(e) or 'worker crashed',
+                                  'total': 0.0}
+                    print('{video}: {status} ({total:.1f} s)'.format(**result))
+                    results.append(result)
+        self.__saveSummary(results)
+        return results
+
+
+    def __planClip(self, video):
+        return plan_clip(video, self.__statistics, self.__rendervideo, self.__force)
+
+
+    def __saveSummary(self, results):
+        '''
+        Save status and timings (in seconds) of steps of processing for each video
+        '''
+        columns = ['video', 'status', 'tracking']+STATISTICS+['total', 'error']
+        order = {video: i for i, video in enumerate(self.__videos)}
+        with open(self.__summaryfile, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, restval='')
+            writer.writeheader()
+            for result in sorted(results, key=lambda r: order[r['video']]):
+                writer.writerow({key: round(value, 3) if isinstance(value, float) else value
+                                 for key, value in result.items()})
+        print('Summary was saved to {}'.format(self.__summaryfile))
+
+
+def init_argparse():
+    '''
+    Initialize argparse
+    '''
+    parser = argparse.ArgumentParser(description='Tracking and statistics for many videos')
+    parser.add_argument(
+        '--input',
+        nargs='?',
+        help='Directory with videos or manifest (text file with a path to video on each line)',
+        required=True,
+        type=str)
+    parser.add_argument(
+        '--statistics',
+        nargs='*',
+        help='Statistics to calculate for each video',
+        choices=STATISTICS,
+        default=STATISTICS,
+        type=str)
+    parser.add_argument(
+        '--device',
+        nargs='?',
+        help='Device to launch the detector',
+        choices=constants.DEVICES,
+        default='cuda',
+        type=str)
+    parser.add_argument(
+        '--gpus',
+        nargs='+',
+        help='Numbers of GPU to distribute processes over them',
+        default=[constants.GPU_NUMBER],
+        type=int)
+    parser.add_argument(
+        '--workers_per_gpu',
+        nargs='?',
+        help='Maximum number of processes using one GPU',
+        default=1,
+        type=int)
+    parser.add_argument(
+        '--threads',
+        nargs='?',
+        help='Number of threads of each process',
+        default=constants.BATCH_WORKER_THREADS,
+        type=int)
+    parser.add_argument(
+        '--no_video',
+        help='Do not save marked videos',
+        action='store_true')
+    parser.add_argument(
+        '--force',
+        help='Process videos again even if their results are up to date',
+        action='store_true')
+    parser.add_argument(
+        '--summary',
+        nargs='?',
+        help='CSV file for timings of processing of videos',
+        default=None,
+        type=str)
+    parser.add_argument(
+        '--profile',
+        help='Save reports of profiling of stages into results/<video name>.profile.json and .prom',
+        action='store_true')
+    return parser
+
+
+def main():
+    parser = init_argparse()
+    # Extract arguments of script
+    args = parser.parse_args()
+    try:
+        videos = collect_videos(args.input)
+    except ValueError as e:
+        parser.error(str(e))
+    if not videos:
+        parser.error('No videos were found in {}'.format(args.input))
+    batch = BatchTracker(videos, statistics=args.statistics, device=args.device, gpus=args.gpus,
+                         workers_per_gpu=args.workers_per_gpu, threads=args.threads,
+                         render_video=not args.no_video, force=args.force, summary_file=args.summary,
+                         profile=args.profile)
+    batch.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,498 @@
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+import pandas as pd
+import torch
+
+import constants
+import operations
+from binarymarkup import BinaryMarkup, binary_markup_file, convert_markup
+from combatsengine import CombatsEngine
+from detector import build_model, load_detector, load_frames, tracker_options
+from models import Darknet
+from mottracker import MOTTracker
+from videodataloader import VideoDataLoader, frames_to_blob
+
+from utils.utils import non_max_suppression
+
+
+def synchronize(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize()
+
+
+def measure_detection(model, frames, batch_size, device):
+    '''
+    Measure throughput of detector
+    :param model: model of detector
+    :param frames: preprocessed frames
+    :param batch_size: number of frames passed through the detector by one forward pass
+    :param device: device of model
+    :return: number of frames processed per second
+    '''
+    with torch.no_grad():
+        model(frames_to_blob(frames[:1], device)) # warm up
+        synchronize(device)
+        start = time.perf_counter()
+        for i in range(0, len(frames), batch_size):
+            model(frames_to_blob(frames[i:i+batch_size], device))
+        synchronize(device)
+    return len(frames)/max(1e-5, time.perf_counter()-start)
+
+
+def print_report(title, header, rows):
+    '''
+    Print results of benchmark as a table
+    '''
+    print(title)
+    print('\t'.join(header))
+    for row in rows:
+        print('\t'.join(str(round(v, 3)) if isinstance(v, float) else str(v) for v in row))
+
+
+def detect(model, frames, opt, device):
+    '''
+    Get final detections (after thresholding of confidence and non-maximum suppression) for each frame
+    :return: list of detections (x1, y1, x2, y2, conf, cls, embedding) as numpy arrays
+    '''
+    detections = []
+    with torch.no_grad():
+        for img in frames:
+            pred = model(frames_to_blob([img], device))
+            pred = pred[pred[:, :, 4] > opt.conf_thres]
+            dets = np.zeros((0, 6+512), dtype=np.float32)
+            if len(pred) > 0:
+                dets = non_max_suppression(pred.unsqueeze(0), opt.conf_thres, opt.nms_thres)[0].cpu().numpy()
+            detections.append(dets)
+    return detections
+
+
+def box_iou(boxes1, boxes2):
+    '''
+    Calculate IoU of all pairs of boxes (x1, y1, x2, y2)
+    :return: matrix of IoU len(boxes1) x len(boxes2)
+    '''
+    tl = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    br = np.minimum(boxes1[:, None, 2:4], boxes2[None, :, 2:4])
+    inter = np.prod(np.clip(br-tl, 0, None), axis=2)
+    area1 = np.prod(boxes1[:, 2:4]-boxes1[:, :2], axis=1)
+    area2 = np.prod(boxes2[:, 2:4]-boxes2[:, :2], axis=1)
+    return inter/np.maximum(area1[:, None]+area2[None, :]-inter, 1e-9)
+
+
+def compare_detections(reference, detections, iou_threshold=0.5):
+    '''
+    Compare detections of model with the reference detections (greedy matching of boxes by IoU)
+    :return: recall, precision, mean IoU and mean cosine similarity of embeddings of matched boxes
+    '''
+    n_ref, n_det, ious, cosines = 0, 0, [], []
+    for ref, det in zip(reference, detections):
+        n_ref += len(ref)
+        n_det += len(det)
+        if len(ref) == 0 or len(det) == 0:
+            continue
+        iou = box_iou(ref[:, :4], det[:, :4])
+        while iou.size and iou.max() >= iou_threshold:
+            i, j = np.unravel_index(iou.argmax(), iou.shape)
+            ious.append(iou[i, j])
+            emb_ref, emb_det = ref[i, 6:], det[j, 6:]
+            cosines.append(np.dot(emb_ref, emb_det)/max(1e-9, np.linalg.norm(emb_ref)*np.linalg.norm(emb_det)))
+            iou[i, :], iou[:, j] = -1, -1
+    matched = len(ious)
+    return (matched/max(1, n_ref), matched/max(1, n_det), float(np.mean(ious)) if ious else 0.0,
+            float(np.mean(cosines)) if cosines else 0.0)
+
+
+def id_switches(reference, markup, iou_threshold=0.5):
+    '''
+    Count switches of ids of tracks against the reference markup (greedy matching of bboxes by IoU on each frame)
+    :return: number of id switches and share of matched bboxes of the reference markup
+    '''
+    coords = ['bb_y', 'bb_x', 'bb_h', 'bb_w'] # x, y of top left corner, width, height
+    frames = {frame_id: rows for frame_id, rows in markup.groupby('frame')}
+    last_ids, switches, matched = dict(), 0, 0
+    for frame_id, ref in reference.groupby('frame'):
+        if frame_id not in frames:
+            continue
+        rows = frames[frame_id]
+        ref_boxes, boxes = ref[coords].values.astype(float), rows[coords].values.astype(float)
+        ref_boxes[:, 2:] += ref_boxes[:, :2]
+        boxes[:, 2:] += boxes[:, :2]
+        iou = box_iou(ref_boxes, boxes)
+        ref_ids, ids = ref['id'].values, rows['id'].values
+        while iou.size and iou.max() >= iou_threshold:
+            i, j = np.unravel_index(iou.argmax(), iou.shape)
+            if ref_ids[i] in last_ids and last_ids[ref_ids[i]] != ids[j]:
+                switches += 1
+            last_ids[ref_ids[i]] = ids[j]
+            matched += 1
+            iou[i, :], iou[:, j] = -1, -1
+    return switches, matched/max(1, len(reference))
+
+
+def benchmark_batch_detection(video, n_frames, batch_sizes, device):
+    '''
+    Compare throughput of detector for different sizes of batch with the frame-by-frame detection
+    '''
+    frames = load_frames(video, n_frames)
+    model = build_model(tracker_options(), device)
+    base_fps = measure_detection(model, frames, 1, device) # frame-by-frame detection
+    rows = []
+    for batch_size in batch_sizes:
+        fps = measure_detection(model, frames, batch_size, device)
+        rows.append((batch_size, fps, fps/base_fps))
+    print_report('Batched detection on {} ({} frames)'.format(device, len(frames)), ['batch', 'fps', 'speedup'], rows)
+
+
+def benchmark_backends(video, n_frames, variants):
+    '''
+    Compare throughput and accuracy of variants of detector on CPU with the float model
+    '''
+    opt = tracker_options()
+    frames = load_frames(video, n_frames)
+    calibration = frames[:constants.CALIBRATION_FRAMES]
+    float_model = build_model(opt, 'cpu', 'float')
+    reference = detect(float_model, frames, opt, 'cpu')
+    base_fps = measure_detection(float_model, frames, 1, 'cpu')
+    rows = []
+    for variant in variants:
+        model = float_model if variant == 'float' else build_model(opt, 'cpu', variant, calibration)
+        fps = measure_detection(model, frames, 1, 'cpu')
+        recall, precision, mean_iou, cosine = compare_detections(reference, detect(model, frames, opt, 'cpu'))
+        rows.append((variant, fps, fps/base_fps, recall, precision, mean_iou, cosine))
+    print_report('Variants of detector on CPU ({} frames, {} threads)'.format(len(frames), torch.get_num_threads()),
+                 ['variant', 'fps', 'speedup', 'recall', 'precision', 'iou', 'emb_cos'], rows)
+
+
+def legacy_prepare_frame(img0, w, h):
+    '''
+    Preprocess frame for the detector as VideoDataLoader did before preprocessing by one resize:
+    resize for drawing, resize into padded frame, reversed channels, transposed float copy and division
+    :return: normalized padded frame C x H x W
+    '''
+    img0 = cv2.resize(img0, (w, h), interpolation=cv2.INTER_AREA)
+    width, height = constants.OUTPUT_FRAME_SIZE
+    ratio = min(float(height)/h, float(width)/w)
+    new_shape = (round(w*ratio), round(h*ratio))
+    dw, dh = (width-new_shape[0])/2, (height-new_shape[1])/2
+    img = cv2.resize(img0, new_shape, interpolation=cv2.INTER_AREA)
+    img = cv2.copyMakeBorder(img, round(dh-0.1), round(dh+0.1), round(dw-0.1), round(dw+0.1), cv2.BORDER_CONSTANT,
+                             value=(127.5, 127.5, 127.5))
+    img = img[:, :, ::-1].transpose(2, 0, 1)
+    img = np.ascontiguousarray(img, dtype=np.float32)
+    img /= 255.0
+    return img
+
+
+def benchmark_preprocessing(video, n_frames, device):
+    '''
+    Compare preprocessing of frames by one resize into padded frame and fused normalization with the former
+    preprocessing and check that inputs of the detector are identical
+    '''
+    dataloader = VideoDataLoader(video, constants.OUTPUT_FRAME_SIZE)
+    decoded = []
+    for _ in range(n_frames):
+        try:
+            decoded.append(dataloader.readFrame()[1])
+        except StopIteration:
+            break
+    start = time.perf_counter()
+    legacy = [torch.from_numpy(legacy_prepare_frame(img0, dataloader.w, dataloader.h)).to(device) for img0 in decoded]
+    synchronize(device)
+    legacy_time = time.perf_counter()-start
+    start = time.perf_counter()
+    blobs = [frames_to_blob([dataloader.prepareFrame(img0)[0]], device)[0] for img0 in decoded]
+    synchronize(device)
+    new_time = time.perf_counter()-start
+    identical = sum(int(torch.equal(a, b)) for a, b in zip(legacy, blobs))
+    max_diff = max(float((a-b).abs().max()) for a, b in zip(legacy, blobs)) if decoded else 0.0
+    rows = [('legacy', 1000*legacy_time/max(1, len(decoded)), 1.0, '-', '-'),
+            ('single resize', 1000*new_time/max(1, len(decoded)), legacy_time/max(1e-9, new_time),
+             '{}/{}'.format(identical, len(decoded)), max_diff)]
+    print_report('Preprocessing of frames on {} ({} frames)'.format(device, len(decoded)),
+                 ['preprocessing', 'ms/frame', 'speedup', 'identical', 'max_diff'], rows)
+
+
+def legacy_forward(model, x):
+    '''
+    Forward pass of Darknet for detection as it was before the compiled plan:
+    sources of layers are parsed on each pass and outputs of all layers are kept till the end
+    '''
+    img_size = (x.shape[-1], x.shape[-2])
+    layer_outputs, output = [], []
+    for module_def, module in zip(model.module_defs, model.module_list):
+        mtype = module_def['type']
+        if mtype in ['convolutional', 'upsample', 'maxpool']:
+            x = module(x)
+        elif mtype == 'route':
+            layer_i = [int(v) for v in module_def['layers'].split(',')]
+            if len(layer_i) == 1:
+                x = layer_outputs[layer_i[0]]
+            else:
+                x = torch.cat([layer_outputs[i] for i in layer_i], 1)
+        elif mtype == 'shortcut':
+            x = layer_outputs[-1]+layer_outputs[int(module_def['from'])]
+        elif mtype == 'yolo':
+            x = module[0](x, img_size)
+            output.append(x)
+        layer_outputs.append(x)
+    return torch.cat(output, 1)
+
+
+def benchmark_forward(video, n_frames, device):
+    '''
+    Compare forward pass of detector by the compiled plan with the former forward pass:
+    time per frame, peak memory (on GPU) and identity of predictions
+    '''
+    frames = load_frames(video, n_frames)
+    model = build_model(tracker_options(), device)
+    rows, reference = [], None
+    for name, forward in [('legacy', lambda x: legacy_forward(model, x)), ('plan', model)]:
+        preds = []
+        with torch.no_grad():
+            forward(frames_to_blob(frames[:1], device)) # warm up
+            if torch.device(device).type == 'cuda':
+                torch.cuda.reset_peak_memory_stats()
+            synchronize(device)
+            start = time.perf_counter()
+            for img in frames:
+                preds.append(forward(frames_to_blob([img], device)))
+            synchronize(device)
+            elapsed = time.perf_counter()-start
+        peak = torch.cuda.max_memory_allocated()/2**20 if torch.device(device).type == 'cuda' else '-'
+        if reference is None:
+            reference = preds
+        identical = sum(int(torch.equal(a, b)) for a, b in zip(reference, preds))
+        rows.append((name, 1000*elapsed/len(frames), peak, '{}/{}'.format(identical, len(frames))))
+    print_report('Forward pass of detector on {} ({} frames)'.format(device, len(frames)),
+                 ['forward', 'ms/frame', 'peak_mb', 'identical'], rows)
+
+
+def benchmark_startup(device, repeats):
+    '''
+    Compare startup of detector from the prepared model with creation of model and loading of original weights
+    '''
+    opt = tracker_options()
+    load_detector(opt) # prepared model is saved by the first loading
+
+    def load_original():
+        model = Darknet(opt.cfg, nID=14455)
+        model.load_state_dict(torch.load(opt.weights, map_location='cpu')['model'], strict=False)
+        return model
+
+    rows, reference = [], None
+    for name, load in [('original', load_original), ('prepared', lambda: load_detector(opt))]:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model = load().to(device).eval()
+        synchronize(device)
+        elapsed = (time.perf_counter()-start)/repeats
+        state = model.state_dict()
+        if reference is None:
+            reference = state
+        identical = all(torch.equal(reference[key], value) for key, value in state.items())
+        rows.append((name, elapsed, identical))
+        del model
+    print_report('Startup of detector on {} ({} loadings)'.format(device, repeats),
+                 ['model', 'seconds', 'identical'], rows)
+
+
+def benchmark_detection_stride(video, n_frames, strides, gpu, device):
+    '''
+    Compare speed of tracking with stride of detection against tracking with detection on every frame
+    and count id switches caused by propagation of tracks between detections
+    '''
+    configs = [(1, False)]+[(stride, False) for stride in strides if stride > 1]+[(max(strides), True)]
+    reference, base_fps, rows = None, None, []
+    for stride, adaptive in configs:
+        name = 'benchmark_stride{}{}'.format(stride, '_adaptive' if adaptive else '')
+        tracker = MOTTracker(video, gpu, device=device, checkpoint_interval=0, frame_range=(0, n_frames),
+                             output_name=name, render_video=False, detection_stride=stride, adaptive_stride=adaptive)
+        tracker.trackVideo()
+        statistics = tracker.trackingStatistics()
+        fps = statistics['frames']/max(1e-5, statistics['tracking_time'])
+        markup_file = os.path.join(constants.RESULTS_FOLDER, name+'.txt')
+        markup = operations.read_markup(markup_file)
+        os.remove(markup_file)
+        os.remove(binary_markup_file(markup_file))
+        if reference is None: # tracking with detection on every frame
+            reference, base_fps = markup, fps
+        switches, coverage = id_switches(reference, markup)
+        rows.append(('{}{}'.format(stride, ' (adaptive)' if adaptive else ''), fps, fps/base_fps,
+                     statistics['detected_frames']/max(1, statistics['frames']), switches, coverage))
+    print_report('Stride of detection on {} ({} frames)'.format(device, n_frames),
+                 ['stride', 'fps', 'speedup', 'detected', 'id_switches', 'coverage'], rows)
+
+
+def benchmark_markup_loading(markup_file, repeats):
+    '''
+    Compare loading of markup in binary format with parsing of text markup
+    '''
+    binary_file = binary_markup_file(markup_file)
+    if not os.path.isfile(binary_file) or os.path.getmtime(binary_file) < os.path.getmtime(markup_file):
+        convert_markup(markup_file)
+    loaders = [('text', lambda: pd.read_csv(markup_file, names=operations.MARKUP_COLUMNS+['propagated'])),
+               ('binary', lambda: operations.read_markup(binary_file, propagated=True)),
+               ('binary mapped', lambda: BinaryMarkup(binary_file))]
+    rows = []
+    for name, load in loaders:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            data = load()
+        elapsed = (time.perf_counter()-start)/repeats
+        memory = data.memory_usage(index=False).sum() if isinstance(data, pd.DataFrame) else 0 # mapped, not loaded
+        rows.append((name, elapsed, memory/2**20))
+    print_report('Loading of markup {} ({} rows, text {:.1f} MB, binary {:.1f} MB)'.format(
+        markup_file, len(data), os.path.getsize(markup_file)/2**20, os.path.getsize(binary_file)/2**20),
+        ['format', 'seconds', 'memory_mb'], rows)
+
+
+def synthetic_crowd(n_humans, n_frames, seed=0):
+    '''
+    Generate bboxes of humans walking randomly over the hall, area of hall grows with the number of humans
+    (20 humans per area of frame), some humans are missed on each frame
+    :return: list of (ids, bboxes) for each frame
+    '''
+    rng = np.random.default_rng(seed)
+    size = np.array(constants.OUTPUT_FRAME_SIZE, dtype=float)*np.sqrt(max(1.0, n_humans/20))
+    position, velocity = rng.uniform(0, 1, (n_humans, 2))*size, np.zeros((n_humans, 2))
+    frames = []
+    for _ in range(n_frames):
+        velocity = 0.95*velocity+rng.normal(0, 0.5, (n_humans, 2))
+        position = np.clip(position+velocity, 0, size)
+        detected = rng.random(n_humans) < 0.97
+        bboxes = np.column_stack([position, rng.normal(40, 2, n_humans), rng.normal(100, 4, n_humans)])
+        frames.append((np.arange(1, n_humans+1)[detected], bboxes[detected]))
+    return frames
+
+
+def benchmark_combats(crowd_sizes, n_frames):
+    '''
+    Compare detection of combats by checking all pairs of bboxes with checking of pairs found by sort and sweep
+    for different numbers of humans on frame
+    '''
+    rows = []
+    for n_humans in crowd_sizes:
+        frames = synthetic_crowd(n_humans, n_frames)
+        times, results = [], []
+        for sweep_min_bboxes in [np.inf, 0]: # all pairs, sort and sweep
+            engine = CombatsEngine(sweep_min_bboxes=sweep_min_bboxes)
+            start = time.perf_counter()
+            for frame_id, (ids, bboxes) in enumerate(frames):
+                engine.addFrame(frame_id, ids, bboxes)
+            times.append(time.perf_counter()-start)
+            results.append(engine.counts())
+        identical = all(np.array_equal(a, b) for a, b in zip(*results))
+        rows.append((n_humans, 1000*times[0]/n_frames, 1000*times[1]/n_frames, times[0]/max(1e-9, times[1]),
+                     int(results[1][1].sum()), identical))
+    print_report('Detection of combats ({} frames)'.format(n_frames),
+                 ['humans', 'pairs_ms', 'sweep_ms', 'speedup', 'combats', 'identical'], rows)
+
+
+def init_argparse():
+    '''
+    Initialize argparse
+    '''
+    parser = argparse.ArgumentParser(description='Benchmarks of tracking pipeline')
+    parser.add_argument(
+        '--task',
+        nargs='?',
+        help='Benchmark to run',
+        choices=['batch', 'backends', 'stride', 'preprocess', 'forward', 'startup', 'markup', 'combats'],
+        default='batch',
+        type=str)
+    parser.add_argument(
+        '--video',
+        nargs='?',
+        help='Video for benchmark',
+        default=None,
+        type=str)
+    parser.add_argument(
+        '--frames',
+        nargs='?',
+        help='Number of frames from the beginning of video to use',
+        default=64,
+        type=int)
+    parser.add_argument(
+        '--batch_sizes',
+        nargs='+',
+        help='Sizes of batch to compare',
+        default=[1, 2, 4, 8],
+        type=int)
+    parser.add_argument(
+        '--device',
+        nargs='?',
+        help='Device to launch the detector',
+        choices=constants.DEVICES,
+        default='cuda',
+        type=str)
+    parser.add_argument(
+        '--variants',
+        nargs='+',
+        help='Variants of detector to compare on CPU',
+        choices=constants.MODEL_VARIANTS,
+        default=constants.MODEL_VARIANTS,
+        type=str)
+    parser.add_argument(
+        '--strides',
+        nargs='+',
+        help='Strides of detection to compare with detection on every frame',
+        default=[2, 4, 8],
+        type=int)
+    parser.add_argument(
+        '--gpu',
+        nargs='?',
+        help='Number of GPU to implement tracking',
+        default=constants.GPU_NUMBER,
+        type=int)
+    parser.add_argument(
+        '--repeats',
+        nargs='?',
+        help='Number of loadings of detector or markup to measure startup',
+        default=5,
+        type=int)
+    parser.add_argument(
+        '--markup',
+        nargs='?',
+        help='Text markup file to compare its loading with binary format',
+        default=None,
+        type=str)
+    parser.add_argument(
+        '--crowd_sizes',
+        nargs='+',
+        help='Numbers of humans on frame to compare detection of combats',
+        default=[10, 25, 50, 100, 200],
+        type=int)
+    return parser
+
+
+def main():
+    parser = init_argparse()
+    # Extract arguments of script
+    args = parser.parse_args()
+    if args.video is None and args.task not in ['startup', 'markup', 'combats']:
+        parser.error('--video is required for benchmark {}'.format(args.task))
+    if args.markup is None and args.task == 'markup':
+        parser.error('--markup is required for benchmark markup')
+    if args.task == 'batch':
+        benchmark_batch_detection(args.video, args.frames, args.batch_sizes, args.device)
+    elif args.task == 'backends':
+        benchmark_backends(args.video, args.frames, args.variants)
+    elif args.task == 'stride':
+        benchmark_detection_stride(args.video, args.frames, args.strides, args.gpu, args.device)
+    elif args.task == 'preprocess':
+        benchmark_preprocessing(args.video, args.frames, args.device)
+    elif args.task == 'forward':
+        benchmark_forward(args.video, args.frames, args.device)
+    elif args.task == 'startup':
+        benchmark_startup(args.device, args.repeats)
+    elif args.task == 'markup':
+        benchmark_markup_loading(args.markup, args.repeats)
+    elif args.task == 'combats':
+        benchmark_combats(args.crowd_sizes, args.frames)
+
+
+if __name__ == '__main__':
+    main()
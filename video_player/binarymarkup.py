@@ -0,0 +1,259 @@
+'''
+Binary columnar format of markup, which is mapped into memory without parsing.
+File consists of header (with size and time of modification of the text markup, which it was built from) and sections aligned by constants.BINARY_MARKUP_ALIGNMENT bytes:
+columns of rows sorted by frames (frame, id, x, y, w, h, propagated), table of offsets of frames
+(rows of frame f are rows[frame_offsets[f-first_frame]:frame_offsets[f-first_frame+1]]) and index of tracks
+(rows of track track_ids[k] are track_rows[track_offsets[k]:track_offsets[k+1]] in order of frames)
+'''
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+import constants
+
+
+MAGIC = b'SPMARKUP'
+VERSION = 2
+# Columns of rows of markup (coordinates of the top left corner, width and height of bbox)
+COLUMNS = [('frame', '<i4'), ('id', '<i4'), ('x', '<f4'), ('y', '<f4'), ('w', '<f4'), ('h', '<f4'),
+           ('propagated', 'u1')]
+INDEXES = [('frame_offsets', '<i8'), ('track_ids', '<i4'), ('track_offsets', '<i8'), ('track_rows', '<i8')]
+SECTIONS = COLUMNS+INDEXES
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u4'), ('reserved', '<u4'), ('rows', '<u8'),
+                         ('first_frame', '<i8'), ('frames', '<u8'), ('tracks', '<u8'),
+                         ('source_size', '<u8'), ('source_mtime', '<i8'), ('offsets', '<u8', (len(SECTIONS),))])
+ROW_DTYPE = np.dtype(COLUMNS) # record of rows, which are appended during tracking before indexing
+
+
+def binary_markup_file(markup_file):
+    '''
+    :param markup_file: text markup file
+    :return: binary markup file next to it
+    '''
+    return os.path.splitext(markup_file)[0]+constants.BINARY_MARKUP_SUFFIX
+
+
+def source_signature(markup_file):
+    '''
+    :param markup_file: text markup file
+    :return: size and time of modification of file in nanoseconds
+    '''
+    stat = os.stat(markup_file)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def read_header(binary_file):
+    '''
+    :param binary_file: binary markup file
+    :return: header of file (None if it is not a binary markup of the current version)
+    '''
+    header = np.fromfile(binary_file, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header['magic'][0] != MAGIC or header['version'][0] != VERSION:
+        return None
+    return header[0]
+
+
+def find_binary_markup(markup_file):
+    '''
+    :param markup_file: text or binary markup file
+    :return: binary markup file, if it was built from the text markup in its current state, i.e. size and time
+    of modification of the text markup match the header of binary markup (None - text markup should be parsed)
+    '''
+    binary_file = binary_markup_file(markup_file)
+    if markup_file == binary_file:
+        return binary_file
+    if os.path.isfile(binary_file):
+        header = read_header(binary_file)
+        if header is not None and \
+                (int(header['source_size']), int(header['source_mtime'])) == source_signature(markup_file):
+            return binary_file
+    return None
+
+
+def frames_order(frames):
+    '''
+    :param frames: numbers of frames of rows
+    :return: order of rows sorted by frames (None if rows are already sorted)
+    '''
+    if len(frames) > 1 and np.any(frames[1:] < frames[:-1]):
+        return np.argsort(frames, kind='stable')
+    return None
+
+
+def build_indexes(frames, ids):
+    '''
+    Build indexes of frames and tracks for rows sorted by frames
+    :param frames: numbers of frames of rows
+    :param ids: ids of tracks of rows
+    :return: dictionary with the first frame, number of frames and sections of indexes (see INDEXES)
+    '''
+    first_frame = int(frames[0]) if len(frames) else 0
+    n_frames = int(frames[-1])-first_frame+1 if len(frames) else 0
+    track_rows = np.argsort(ids, kind='stable') # rows of each track stay sorted by frames
+    track_ids, track_starts = np.unique(ids[track_rows], return_index=True)
+    return {'first_frame': first_frame, 'frames': n_frames,
+            'frame_offsets': np.searchsorted(frames, np.arange(first_frame, first_frame+n_frames+1)),
+            'track_ids': track_ids, 'track_offsets': np.append(track_starts, len(ids)), 'track_rows': track_rows}
+
+
+def write_binary_markup(binary_file, rows, source_file=None):
+    '''
+    Sort rows by frames, build indexes of frames and tracks and save markup in binary format
+    :param binary_file: output file
+    :param rows: array of rows of markup with dtype ROW_DTYPE (it may be mapped from file)
+    :param source_file: text markup with the same rows (None - binary markup is not taken instead of text markup)
+    '''
+    order = frames_order(rows['frame'])
+    if order is not None:
+        rows = rows[order]
+    sections = build_indexes(rows['frame'], rows['id'])
+    sections.update({name: rows[name] for name, _ in COLUMNS})
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header['magic'], header['version'], header['rows'] = MAGIC, VERSION, len(rows)
+    header['first_frame'], header['frames'] = sections['first_frame'], sections['frames']
+    header['tracks'] = len(sections['track_ids'])
+    if source_file is not None:
+        header['source_size'], header['source_mtime'] = source_signature(source_file)
+    alignment, offset = constants.BINARY_MARKUP_ALIGNMENT, HEADER_DTYPE.itemsize
+    tmp_file = binary_file+'.tmp'
+    with open(tmp_file, 'wb') as f:
+        f.write(header.tobytes())
+        for i, (name, dtype) in enumerate(SECTIONS):
+            offset = -(-offset//alignment)*alignment
+            header['offsets'][0, i] = offset
+            f.seek(offset)
+            data = np.ascontiguousarray(sections[name], dtype=dtype)
+            data.tofile(f)
+            offset += data.nbytes
+        f.seek(0)
+        f.write(header.tobytes())
+    os.replace(tmp_file, binary_file)
+
+
+def convert_markup(markup_file, binary_file=None, chunk_size=constants.BINARY_MARKUP_CHUNK_ROWS):
+    '''
+    Convert text markup into binary format
+    :param markup_file: text markup file
+    :param binary_file: output file (None - file next to the markup)
+    :param chunk_size: number of rows parsed at once
+    :return: binary markup file
+    '''
+    binary_file = binary_file or binary_markup_file(markup_file)
+    rows_file = binary_file+'.rows'
+    with open(rows_file, 'wb') as f:
+        append_text_rows(markup_file, f, chunk_size)
+    index_rows_file(rows_file, binary_file, markup_file)
+    return binary_file
+
+
+def append_text_rows(markup_file, rows_file, chunk_size=constants.BINARY_MARKUP_CHUNK_ROWS):
+    '''
+    Parse text markup by chunks and append its rows into file of rows
+    :param markup_file: text markup file
+    :param rows_file: opened binary file of rows with dtype ROW_DTYPE
+    :param chunk_size: number of rows parsed at once
+    '''
+    if os.path.getsize(markup_file) == 0:
+        return
+    names = [name for name, _ in COLUMNS]
+    for chunk in pd.read_csv(markup_file, names=names, chunksize=chunk_size):
+        chunk['propagated'] = chunk['propagated'].fillna(0)
+        rows = np.empty(len(chunk), dtype=ROW_DTYPE)
+        for name in names:
+            rows[name] = chunk[name].values
+        rows.tofile(rows_file)
+
+
+def index_rows_file(rows_file, binary_file, source_file=None):
+    '''
+    Build binary markup from file of rows appended during tracking and remove that file
+    :param source_file: text markup with the same rows, which is not modified anymore
+    '''
+    if os.path.getsize(rows_file) > 0:
+        rows = np.memmap(rows_file, dtype=ROW_DTYPE, mode='r')
+    else:
+        rows = np.empty(0, dtype=ROW_DTYPE)
+    write_binary_markup(binary_file, rows, source_file)
+    del rows
+    os.remove(rows_file)
+
+
+class BinaryMarkup:
+    '''
+    Implement markup in binary format mapped into memory: columns, frames and tracks are read without copying,
+    pages of file are loaded only when they are accessed
+    '''
+
+    def __init__(self, binary_file):
+        '''
+        Constructor
+        :param binary_file: binary markup file
+        '''
+        header = read_header(binary_file)
+        if header is None:
+            raise ValueError('{} is not a binary markup of version {}'.format(binary_file, VERSION))
+        self.first_frame = int(header['first_frame'])
+        self.n_frames = int(header['frames'])
+        counts = {'frame_offsets': self.n_frames+1, 'track_ids': int(header['tracks']),
+                  'track_offsets': int(header['tracks'])+1}
+        for (name, dtype), offset in zip(SECTIONS, header['offsets']):
+            count = counts.get(name, int(header['rows']))
+            if count > 0:
+                section = np.memmap(binary_file, dtype=dtype, mode='r', offset=int(offset), shape=(count,))
+            else:
+                section = np.zeros(count, dtype=dtype)
+            setattr(self, name, section)
+
+
+    def __len__(self):
+        return len(self.frame)
+
+
+    def frameRows(self, frame_id):
+        '''
+        :param frame_id: number of frame
+        :return: slice of rows of the frame
+        '''
+        k = frame_id-self.first_frame
+        if k < 0 or k >= self.n_frames:
+            return slice(0, 0)
+        return slice(int(self.frame_offsets[k]), int(self.frame_offsets[k+1]))
+
+
+    def trackRows(self, track_id):
+        '''
+        :param track_id: id of track
+        :return: numbers of rows of the track in order of frames
+        '''
+        k = int(np.searchsorted(self.track_ids, track_id))
+        if k == len(self.track_ids) or self.track_ids[k] != track_id:
+            return np.zeros(0, dtype=np.int64)
+        return self.track_rows[self.track_offsets[k]:self.track_offsets[k+1]]
+
+
+def init_argparse():
+    '''
+    Initialize argparse
+    '''
+    parser = argparse.ArgumentParser(description='Convert text markup into binary format')
+    parser.add_argument(
+        '--markup',
+        nargs='+',
+        help='Text markup files',
+        required=True,
+        type=str)
+    return parser
+
+
+def main():
+    parser = init_argparse()
+    # Extract arguments of script
+    args = parser.parse_args()
+    for markup_file in args.markup:
+        print('{} -> {}'.format(markup_file, convert_markup(markup_file)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+import os
+import pickle
+
+from tracker.basetrack import BaseTrack
+
+
+class TrackingCheckpoint:
+    '''
+    Implement class of saving and restoring the state of tracking to resume it after a failure
+    '''
+
+    # Attributes of tracker, which are created anew by resuming. Removed tracks are not needed for association,
+    # but their list is never trimmed, so it would make checkpoints grow over the whole video
+    EXCLUDED_ATTRIBUTES = ['opt', 'model', 'removed_stracks']
+
+
+    def __init__(self, filename):
+        '''
+        Constructor
+        :param filename: file of checkpoint
+        '''
+        self.__filename = filename
+
+
+    def exists(self):
+        return os.path.isfile(self.__filename)
+
+
+    @staticmethod
+    def snapshot(tracker):
+        '''
+        Take the state of tracker (tracked and lost tracks, Kalman filter, counter of ids)
+        :param tracker: JDE Tracker
+        :return: serialized state of tracker
+        '''
+        state = {key: value for key, value in tracker.__dict__.items()
+                 if key not in TrackingCheckpoint.EXCLUDED_ATTRIBUTES}
+        return pickle.dumps({'tracker': state, 'track_count': BaseTrack._count})
+
+
+    @staticmethod
+    def restore(tracker, snapshot):
+        '''
+        Restore the state of tracker
+        :param tracker: JDE Tracker
+        :param snapshot: serialized state of tracker
+        '''
+        state = pickle.loads(snapshot)
+        tracker.__dict__.update(state['tracker'])
+        BaseTrack._count = state['track_count'] # new tracks continue numbering of ids
+
+
+    def save(self, frame_id, position, snapshot, markup_size, video_parts, stride=None):
+        '''
+        Save checkpoint
+        :param frame_id: number of the next frame for tracking
+        :param position: position of the next frame in video
+        :param snapshot: serialized state of tracker after processing of previous frame
+        :param markup_size: size of markup written by the moment of checkpoint
+        :param video_parts: list of (marked video, number of its first frame) written by the moment of checkpoint
+        :param stride: state of stride of detection {'stride': current stride, 'last_keyframe': the last frame passed
+        through the detector} (None - detection on every frame)
+        '''
+        state = {'frame_id': frame_id, 'position': position, 'snapshot': snapshot,
+                 'markup_size': markup_size, 'video_parts': video_parts, 'stride': stride}
+        tmp_filename = self.__filename+'.tmp'
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(state, f)
+        os.replace(tmp_filename, self.__filename) # checkpoint is never left half-written
+
+
+    def load(self):
+        '''
+        Load checkpoint
+        :return: dictionary with state of tracking
+        '''
+        with open(self.__filename, 'rb') as f:
+            return pickle.load(f)
+
+
+    def remove(self):
+        if self.exists():
+            os.remove(self.__filename)
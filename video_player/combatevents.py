@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+from markupstore import frames_to_time, time_to_frames
+
+
+EVENT_COLUMNS = ['id1', 'id2', 'start_frame', 'end_frame'] # end_frame - the last frame of intersection of bboxes
+
+
+class CombatEvents:
+    '''
+    Implement log of combats: pair of players (id1 < id2), the first and the last frames of intersection of their
+    bboxes. Combats are sorted by start, the running maximum of their ends bounds combats, which may overlap
+    a time window, and combats of each player are found by the index of players, so queries are answered
+    without scanning of markup or of the whole log
+    '''
+
+    def __init__(self, id1, id2, start_frames, end_frames, timestamps=None, frame_rate=None):
+        '''
+        Constructor
+        :param id1: lower ids of pairs
+        :param id2: higher ids of pairs
+        :param start_frames: the first frames of combats
+        :param end_frames: the last frames of intersection of bboxes of pairs
+        :param timestamps: timestamps of frames of video in milliseconds (e.g. VideoIndex.timestamps) to select
+        combats by time
+        :param frame_rate: FPS of video to select combats by time, if timestamps are not known
+        '''
+        order = np.lexsort((id2, id1, start_frames))
+        self.id1, self.id2 = np.asarray(id1, dtype=np.int64)[order], np.asarray(id2, dtype=np.int64)[order]
+        self.start_frames = np.asarray(start_frames, dtype=np.int64)[order]
+        self.end_frames = np.asarray(end_frames, dtype=np.int64)[order]
+        self.timestamps = timestamps
+        self.frame_rate = frame_rate
+        self.__maxends = np.maximum.accumulate(self.end_frames) if len(order) else self.end_frames
+        # Index of players: numbers of combats of each player in order of start
+        players = np.concatenate([self.id1, self.id2])
+        rows = np.tile(np.arange(len(order)), 2)
+        index = np.lexsort((rows, players))
+        self.__players, self.__playerrows = players[index], rows[index]
+
+
+    def __len__(self):
+        return len(self.start_frames)
+
+
+    def rows(self, start_frame=None, end_frame=None, human=None):
+        '''
+        :param start_frame: the first frame of window (None - from the start of video)
+        :param end_frame: frame to stop at (None - till the end of video)
+        :param human: id of player (None - combats of all players)
+        :return: numbers of combats overlapping the window in order of start
+        '''
+        if human is not None:
+            k1, k2 = np.searchsorted(self.__players, [human, human+1])
+            rows = self.__playerrows[k1:k2]
+        else:
+            # Combats started before the end of window, which may last till its start
+            k1 = np.searchsorted(self.__maxends, start_frame) if start_frame is not None else 0
+            k2 = np.searchsorted(self.start_frames, end_frame) if end_frame is not None else len(self)
+            rows = np.arange(k1, max(k1, k2))
+        overlap = np.ones(len(rows), dtype=bool)
+        if start_frame is not None:
+            overlap &= self.end_frames[rows] >= start_frame
+        if end_frame is not None:
+            overlap &= self.start_frames[rows] < end_frame
+        return rows[overlap]
+
+
+    def query(self, start_ms=None, end_ms=None, human=None, min_duration_ms=None):
+        '''
+        Find combats, e.g. all combats of player 7 between minute 10 and 20: query(600000, 1200000, human=7)
+        or combats longer than 2 seconds: query(min_duration_ms=2000)
+        :param start_ms: start of time window in milliseconds from the start of video
+        :param end_ms: end of time window (not included)
+        :param human: id of player (None - combats of all players)
+        :param min_duration_ms: minimum duration of combats
+        :return: dataframe with columns EVENT_COLUMNS, start_ms, end_ms and duration_ms of combats
+        '''
+        rows = self.rows(*self.__windowFrames(start_ms, end_ms), human=human)
+        events = self.table(rows, times=True if min_duration_ms is not None else None)
+        if min_duration_ms is not None:
+            events = events[events['duration_ms'] >= min_duration_ms].reset_index(drop=True)
+        return events
+
+
+    def pairCounts(self, start_ms=None, end_ms=None):
+        '''
+        :return: numbers of combats of pairs of players overlapping the time window {(id1, id2): number of combats}
+        '''
+        rows = self.rows(*self.__windowFrames(start_ms, end_ms))
+        pairs, counts = np.unique(np.stack([self.id1[rows], self.id2[rows]], axis=1), axis=0, return_counts=True)
+        return {(int(id1), int(id2)): int(count) for (id1, id2), count in zip(pairs, counts)}
+
+
+    def table(self, rows=slice(None), times=None):
+        '''
+        :param rows: numbers of combats
+        :param times: add times of combats in milliseconds (None - if timestamps or frame rate of video are known)
+        :return: dataframe with combats
+        '''
+        events = pd.DataFrame({'id1': self.id1[rows], 'id2': self.id2[rows], 'start_frame': self.start_frames[rows],
+                               'end_frame': self.end_frames[rows]})
+        events['duration'] = events['end_frame']-events['start_frame']+1 # frames
+        if times or (times is None and self.__hasTime()):
+            events['start_ms'] = frames_to_time(events['start_frame'].values, self.timestamps, self.frame_rate)
+            events['end_ms'] = frames_to_time(events['end_frame'].values+1, self.timestamps, self.frame_rate)
+            events['duration_ms'] = events['end_ms']-events['start_ms']
+        return events
+
+
+    def __windowFrames(self, start_ms, end_ms):
+        '''
+        :return: the first frame and frame to stop at of time window (None - window is not bounded)
+        '''
+        return [int(time_to_frames(ms, self.timestamps, self.frame_rate)) if ms is not None else None
+                for ms in [start_ms, end_ms]]
+
+
+    def __hasTime(self):
+        return self.timestamps is not None or bool(self.frame_rate)
+
+
+    def save(self, filename):
+        '''
+        Save log of combats into csv-file
+        '''
+        self.table().to_csv(filename, index=False)
+
+
+    @classmethod
+    def load(cls, filename, timestamps=None, frame_rate=None):
+        '''
+        Load log of combats from csv-file
+        '''
+        events = pd.read_csv(filename)
+        return cls(*[events[column].values for column in EVENT_COLUMNS], timestamps=timestamps, frame_rate=frame_rate)
@@ -1,114 +1,163 @@
 import argparse
 import os
 import numpy as np
-import pandas as pd
 import matplotlib.pyplot as plt
 import plotly.graph_objects as go
 from collections import defaultdict
+from matplotlib.figure import Figure
 from tqdm import tqdm
 
-import operations
+import constants
+from combatevents import CombatEvents
+from combatsengine import CombatsEngine, code_pairs, combats_matrix
+from markupstore import MarkupStore
+from profiler import StageProfiler
 
 
 plt.rcParams.update({'font.size': 7})
 
 
+def shown_ids(combats, ids):
+    '''
+    Choose humans to draw the matrix of combats: all humans or constants.COMBATS_MATRIX_MAX_IDS humans with
+    the most combats, if there are too many of them
+    :param combats: numbers of combats of pairs of humans {(id1, id2): number of combats}
+    :param ids: ids of all humans in order of their appearance
+    :return: ids of humans in order of their appearance
+    '''
+    if len(ids) <= constants.COMBATS_MATRIX_MAX_IDS:
+        return ids
+    totals = defaultdict(int)
+    for (id1, id2), count in combats.items():
+        totals[id1] += count
+        totals[id2] += count
+    top = set(sorted(totals, key=totals.get, reverse=True)[:constants.COMBATS_MATRIX_MAX_IDS])
+    return [human_id for human_id in ids if human_id in top]
+
+
+def draw_combats_matrix(combats, ids, out_dir):
+    '''
+    Visualize confusion matrix of combats as a heatmap and save it into combats_matrix.png.
+    Matrix is drawn without pyplot, so it may be saved by any thread (e.g. by the saver of online statistics)
+    :param combats: numbers of combats of pairs of humans {(id1, id2): number of combats}
+    :param ids: ids of all humans in order of their appearance
+    :param out_dir: directory for saving results
+    :return: heatmap to display
+    '''
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    shown = shown_ids(combats, ids)
+    matrix = combats_matrix(combats, shown)
+    # Adjustment of plot for saving
+    fig = Figure(figsize=(12, 9))
+    ax = fig.subplots()
+    fig.subplots_adjust(left=0.03, bottom=0.03, right=0.97, top=0.97)
+    im = ax.imshow(matrix)
+    ax.set_xticks(np.arange(len(shown)))
+    ax.set_yticks(np.arange(len(shown)))
+    ax.set_xticklabels(shown)
+    ax.set_yticklabels(shown)
+    ax.tick_params(top=True, bottom=True, left=True, right=True, labeltop=True, labelright=True)
+    colorbar = fig.colorbar(im, ax=ax)
+    colorbar.ax.set_ylabel('Number of combats', rotation=-90, va='bottom')
+    if len(shown) < len(ids):
+        ax.set_title('{} of {} players with the most combats'.format(len(shown), len(ids)))
+    for i, j in zip(*np.nonzero(matrix)): # only cells with combats are annotated
+        ax.text(j, i, matrix[i, j], ha='center', va='center', color='w')
+    fig.savefig(os.path.join(out_dir, 'combats_matrix.png')) # save combats matrix as a heatmap
+    # Adjust and return combats matrix as a heatmap to display
+    shown = ['id '+s for s in list(map(str, shown))]
+    return go.Heatmap(z=matrix, x=shown, y=shown, xgap=1, ygap=1, hoverongaps=False,
+                      hovertemplate='%{x}<br>%{y}<br>combat: %{z}<br>', name='', colorscale='Viridis')
+
+
 class CombatsCounter():
     '''
     Implement class to count combats between detected and tracked players
     '''
 
-    def __init__(self, markup_file, out_dir, human_number=None):
+    def __init__(self, markup_file, out_dir, human_number=None, profiler=None, events=None):
         '''
         Constructor
         :param markup_file: file with saved information about bboxes, ids of humans on each frame of video
+        or MarkupStore loaded once for all statistics
         :param out_dir: directory for saving results
         :param human_number: id of human to count combats with other players (None - count combats for each player)
+        :param profiler: StageProfiler to measure stages of calculation (None - stages are not measured)
+        :param events: log of combats of the video counted before (e.g. CombatEvents.load of combat_events.csv saved
+        by tracker with online statistics), combats are not counted again (None - combats are counted by markup)
         '''
-        self.__data = pd.read_csv(markup_file, names=['frame', 'id', 'bb_y', 'bb_x', 'bb_h', 'bb_w'])
-        self.__ids = list(self.__data['id'].unique())
-        self.__countframes = max(self.__data['frame'])
-        self.__countsids = len(self.__ids)
+        self.__profiler = profiler or StageProfiler(str(markup_file), enabled=False)
+        with self.__profiler.stage('markup_loading'):
+            self.__store = markup_file if isinstance(markup_file, MarkupStore) else MarkupStore(markup_file)
+        self.__ids = self.__store.trackIds()
+        self.__countframes = self.__store.last_frame
         self.__outdirectory = out_dir
         self.__human = human_number
+        self.__events = events # log of combats
+        # Numbers of combats of pairs of humans for the whole video, each combat of log is a started combat
+        self.__combats = events.pairCounts() if events is not None else None
+        self.__eventssaved = False # log of combats is saved into out_dir
 
 
-    def __buildCombatsMatrix(self):
+    def __countCombats(self):
         '''
-        Build confusion matrix of combats between humans
-        Element of confusion matrix [i, j] contains the number of combats between i and j humans
+        Count combats between humans: {(id1, id2): number of combats}, where id1 < id2
+        (combat starts on the frame, where bboxes of humans intersect, and they did not intersect before)
         '''
-        existing_combats = defaultdict(set) # combats, which were registered on previous frame
+        engine = CombatsEngine()
+        bboxes = self.__store.chunk(slice(None)).bboxes # contiguous columns bb_y, bb_x, bb_h, bb_w
         for frame_id in tqdm(range(1, self.__countframes+1)):
-            # Extract all detected bboxes on current frame
-            frame_bboxes = self.__data[self.__data['frame'] == frame_id][['id', 'bb_y', 'bb_x', 'bb_h', 'bb_w']]
-            n_bboxes = len(frame_bboxes) # count of detected bboxes
-            for i in range(n_bboxes-1):
-                for j in range(i+1, n_bboxes):
-                    id_i, id_j = int(frame_bboxes.iloc[i]['id']), int(frame_bboxes.iloc[j]['id'])
-                    if id_i != id_j:
-                        # Check if combat exists on current frame for i and j humans
-                        if operations.is_bbox_intersected(frame_bboxes.iloc[i], frame_bboxes.iloc[j]):
-                            if id_j not in existing_combats[id_i]: # combat was not registered earlier
-                                # Add a combat to matrix on symmetric places
-                                idx_i, idx_j = self.__ids.index(id_i), self.__ids.index(id_j)
-                                self.__combatsmatrix[idx_i, idx_j] += 1
-                                self.__combatsmatrix[idx_j, idx_i] += 1
-                            # Register what new combat between i and j humans start taking place since current frame
-                            existing_combats[id_i].add(id_j)
-                            existing_combats[id_j].add(id_i)
-                        else:
-                            # stop taking account combat between i and j humans if it takes place
-                            existing_combats[id_i].discard(id_j)
-                            existing_combats[id_j].discard(id_i)
-
-
-    def __buildHumanCombatsDictionary(self):
+            # Check all pairs of detected bboxes on current frame at once
+            rows = self.__store.frameSlice(frame_id)
+            engine.addFrame(frame_id, self.__store.ids[rows], bboxes[rows])
+        # Numbers of combats are kept only for pairs of humans, which had combats
+        codes, counts = engine.counts()
+        self.__combats = dict(zip(zip(*[v.tolist() for v in code_pairs(codes)]), counts.tolist()))
+        self.__events = CombatEvents(*engine.events(), timestamps=self.__store.timestamps,
+                                     frame_rate=self.__store.frame_rate)
+
+
+    def __buildHumanCombatsDictionary(self, combats):
         '''
         Form the dictionary with combats for certain human (parameter of class)
         {key: value, ...}, where key - id of human, value - number of combats, which certain human has
+        :param combats: numbers of combats of pairs of humans
+        '''
+        human_combats = dict()
+        for (id1, id2), count in combats.items():
+            if self.__human in (id1, id2):
+                human_combats[id2 if id1 == self.__human else id1] = count
+        # Humans in order of their appearance
+        order = {human_id: i for i, human_id in enumerate(self.__ids)}
+        self.__combatsdict = {human_id: human_combats[human_id] for human_id in sorted(human_combats, key=order.get)}
+
+
+    def combatsMatrix(self, ids):
+        '''
+        :param ids: ids of humans
+        :return: matrix of combats between humans, element [i, j] contains the number of combats
+        between ids[i] and ids[j] humans
         '''
-        self.__combatsdict = dict()
-        if self.__human in self.__ids: # check if id human was found out
-            for i, comb in enumerate(list(self.__combatsmatrix[self.__ids.index(self.__human)])):
-                if comb != 0:
-                    self.__combatsdict[self.__ids[i]] = self.__combatsmatrix[i, self.__ids.index(self.__human)]
+        return combats_matrix(self.__combats, ids)
 
 
-    def __drawCombatsMatrix(self):
+    def __drawCombatsMatrix(self, combats):
         '''
         Visualize confusion matrix of combats as a heatmap
+        :param combats: numbers of combats of pairs of humans
         '''
-        if not os.path.exists(self.__outdirectory):
-            os.makedirs(self.__outdirectory)
-        # Adjustment of plot for saving
-        fig, ax = plt.subplots(figsize=(12, 9))
-        plt.subplots_adjust(left=0.03, bottom=0.03, right=0.97, top=0.97)
-        im = ax.imshow(self.__combatsmatrix)
-        ax.set_xticks(np.arange(self.__countsids))
-        ax.set_yticks(np.arange(self.__countsids))
-        ax.set_xticklabels(self.__ids)
-        ax.set_yticklabels(self.__ids)
-        ax.tick_params(top=True, bottom=True, left=True, right=True, labeltop=True, labelright=True)
-        colorbar = ax.figure.colorbar(im, ax=ax)
-        colorbar.ax.set_ylabel('Number of combats', rotation=-90, va='bottom')
-        for i in range(len(self.__ids)):
-            for j in range(len(self.__ids)):
-                ax.text(j, i, self.__combatsmatrix[i, j], ha='center', va='center', color='w')
-        plt.savefig(os.path.join(self.__outdirectory, 'combats_matrix.png')) # save combats matrix as a heatmap
-        # Adjust and return combats matrix as a heatmap to display
-        ids = ['id '+s for s in list(map(str, self.__ids))]
-        return go.Heatmap(z=self.__combatsmatrix, x=ids, y=ids, xgap=1, ygap=1, hoverongaps=False,
-                          hovertemplate='%{x}<br>%{y}<br>combat: %{z}<br>', name='', colorscale='Viridis')
-
-
-    def __drawBarChartHumanCombats(self):
+        return draw_combats_matrix(combats, self.__ids, self.__outdirectory)
+
+
+    def __drawBarChartHumanCombats(self, combats):
         '''
         Visualize statistics about combats for certain human as a bar chart
+        :param combats: numbers of combats of pairs of humans
         '''
         if not os.path.exists(self.__outdirectory):
             os.makedirs(self.__outdirectory)
-        self.__buildHumanCombatsDictionary()
+        self.__buildHumanCombatsDictionary(combats)
         d = self.__combatsdict
         # Check if any combat for certain human takes place
         if len(d) != 0: # at least one combat takes place
@@ -131,23 +180,39 @@ class CombatsCounter():
             return go.Bar(x=[], y=[])
 
 
-    def calculateCombatsStatistics(self):
+    def combatEvents(self):
+        '''
+        :return: log of combats (CombatEvents), it is formed by calculateCombatsStatistics
+        '''
+        return self.__events
+
+
+    def calculateCombatsStatistics(self, time_window=None):
         '''
         Calculate statistics about combats and visualize it
+        :param time_window: (start, end) of time window in milliseconds to show combats, which took place within it
+        (None - combats of the whole video). Combats are counted once, statistics for other windows are taken
+        from the log of combats
         '''
         print('Calculate statistics about combats...')
         # Check if any player was detected on the video
         if len(self.__ids) == 0:
             print('No players were detected on the video...')
             return go.Figure()
-        else:
-            self.__combatsmatrix = np.zeros((len(self.__ids), len(self.__ids)), dtype=np.int)
-        self.__buildCombatsMatrix()
-        if self.__human is None:
-            plotly_object = self.__drawCombatsMatrix()
-        else:
-            self.__buildHumanCombatsDictionary()
-            plotly_object = self.__drawBarChartHumanCombats()
+        if self.__combats is None:
+            with self.__profiler.stage('combats_matrix', frames=self.__countframes):
+                self.__countCombats()
+        if not self.__eventssaved:
+            if not os.path.exists(self.__outdirectory):
+                os.makedirs(self.__outdirectory)
+            self.__events.save(os.path.join(self.__outdirectory, 'combat_events.csv'))
+            self.__eventssaved = True
+        combats = self.__combats if time_window is None else self.__events.pairCounts(*time_window)
+        with self.__profiler.stage('combats_drawing'):
+            if self.__human is None:
+                plotly_object = self.__drawCombatsMatrix(combats)
+            else:
+                plotly_object = self.__drawBarChartHumanCombats(combats)
         return plotly_object
 
 
@@ -0,0 +1,197 @@
+'''
+Vectorized detection of combats frame by frame. Pairs of tracks are coded by one integer (the lower id
+in high 32 bits and the higher id in low 32 bits), pairs in contact are kept as a sorted array of codes,
+so transitions of states of all pairs of frame are made by operations on arrays
+'''
+
+import numpy as np
+
+import constants
+import operations
+
+
+def pair_codes(ids1, ids2):
+    '''
+    :param ids1: ids of the first tracks of pairs
+    :param ids2: ids of the second tracks of pairs
+    :return: codes of unordered pairs of tracks
+    '''
+    ids1, ids2 = np.asarray(ids1, dtype=np.int64), np.asarray(ids2, dtype=np.int64)
+    return (np.minimum(ids1, ids2) << 32) | np.maximum(ids1, ids2)
+
+
+def code_pairs(codes):
+    '''
+    :param codes: codes of pairs
+    :return: arrays of the lower and the higher ids of pairs
+    '''
+    codes = np.asarray(codes, dtype=np.int64)
+    return codes >> 32, codes & 0xFFFFFFFF
+
+
+def combats_matrix(combats, ids):
+    '''
+    :param combats: numbers of combats of pairs of humans {(id1, id2): number of combats}
+    :param ids: ids of humans
+    :return: symmetric matrix of numbers of combats between humans
+    '''
+    index = {human_id: i for i, human_id in enumerate(ids)}
+    matrix = np.zeros((len(ids), len(ids)), dtype=np.int64)
+    for (id1, id2), count in combats.items():
+        if id1 in index and id2 in index:
+            matrix[index[id1], index[id2]] = matrix[index[id2], index[id1]] = count
+    return matrix
+
+
+def sweep_pairs(bboxes):
+    '''
+    Find pairs of bboxes, which overlap along both axes, by sort and sweep along the first axis
+    (only such bboxes may intersect by operations.is_bbox_intersected)
+    :param bboxes: array N x 4 with columns bb_y, bb_x, bb_h, bb_w
+    :return: arrays of numbers i < j of rows of pairs
+    '''
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    lower = np.minimum(bboxes[:, :2], bboxes[:, :2]+bboxes[:, 2:])
+    upper = np.maximum(bboxes[:, :2], bboxes[:, :2]+bboxes[:, 2:])
+    order = np.argsort(lower[:, 0], kind='stable')
+    # Each bbox is paired with the following bboxes in order of sweep, which start before its end
+    stops = np.searchsorted(lower[order, 0], upper[order, 0], side='left')
+    counts = np.maximum(stops-np.arange(len(order))-1, 0)
+    first = np.repeat(np.arange(len(order)), counts)
+    second = first+1+np.arange(counts.sum())-np.repeat(np.cumsum(counts)-counts, counts)
+    i, j = order[first], order[second]
+    overlap = np.all((lower[i] < upper[j]) & (lower[j] < upper[i]), axis=1)
+    i, j = i[overlap], j[overlap]
+    return np.minimum(i, j), np.maximum(i, j)
+
+
+class CombatsEngine:
+    '''
+    Implement detection of combats on frames in order of video. Bboxes of all pairs of tracks of frame are
+    checked (as by operations.is_bbox_intersected), a combat starts on the frame, where bboxes of pair intersect,
+    and they did not intersect by the previous check of the pair.
+    On crowded frames intersections are checked only for pairs found by sort and sweep, other pairs are known
+    not to intersect, so time grows nearly linearly with the number of humans on frame
+    '''
+
+    def __init__(self, sweep_min_bboxes=constants.COMBATS_SWEEP_MIN_BBOXES):
+        '''
+        Constructor
+        :param sweep_min_bboxes: minimum number of bboxes on frame to check only pairs found by sort and sweep
+        (all pairs are checked on frames with less bboxes)
+        '''
+        self.__sweepminbboxes = sweep_min_bboxes
+        self.active = np.zeros(0, dtype=np.int64) # sorted codes of pairs in contact
+        self.first_hits = dict() # code: (the first frame, where pair intersected, pair intersected by its
+                                 # first check on that frame)
+        self.__onsets = [] # codes of pairs of started combats
+        self.__contacts = dict() # code: [the first frame, the last frame] of intersections of pair in contact
+        self.__events = [] # finished combats (code, the first frame, the last frame of intersections)
+
+
+    def addFrame(self, frame_id, ids, bboxes):
+        '''
+        Check intersections of bboxes of frame and update states of pairs
+        :param frame_id: number of frame
+        :param ids: ids of tracks of bboxes
+        :param bboxes: array N x 4 with columns bb_y, bb_x, bb_h, bb_w
+        :return: codes of pairs, which combats started on the frame
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) < 2:
+            return np.zeros(0, dtype=np.int64)
+        if len(ids) >= self.__sweepminbboxes and len(np.unique(ids)) == len(ids):
+            return self.__addCrowdedFrame(frame_id, ids, bboxes)
+        # Pairs of rows in the order of checks of CombatsCounter, rows of the same track are not checked
+        i, j = np.triu_indices(len(ids), 1)
+        valid = ids[i] != ids[j]
+        i, j = i[valid], j[valid]
+        hits = operations.intersection_matrix(bboxes)[i, j]
+        return self.__updateStates(frame_id, pair_codes(ids[i], ids[j]), hits)
+
+
+    def __addCrowdedFrame(self, frame_id, ids, bboxes):
+        '''
+        Check only pairs found by sort and sweep (each track has one bbox on frame, so order of checks
+        does not matter), other pairs in contact are finished
+        '''
+        i, j = sweep_pairs(bboxes)
+        intersected = pair_codes(ids[i], ids[j])[operations.bboxes_intersected(bboxes[i], bboxes[j])]
+        first_ids, second_ids = code_pairs(self.active)
+        present = self.active[np.isin(first_ids, ids) & np.isin(second_ids, ids)]
+        finished = np.setdiff1d(present, intersected, assume_unique=True)
+        codes = np.concatenate([intersected, finished])
+        return self.__updateStates(frame_id, codes, np.arange(len(codes)) < len(intersected))
+
+
+    def __updateStates(self, frame_id, codes, hits):
+        '''
+        :param codes: codes of checked pairs in order of checks (pair is checked many times,
+        if a track has several bboxes on frame)
+        :param hits: results of checks
+        '''
+        if len(codes) == 0:
+            return codes
+        order = np.argsort(codes, kind='stable') # checks of each pair stay in order
+        codes, hits = codes[order], hits[order]
+        first = np.ones(len(codes), dtype=bool)
+        first[1:] = codes[1:] != codes[:-1]
+        last = np.append(first[1:], True)
+        previous = np.empty(len(codes), dtype=bool) # state of pair before each check
+        previous[1:] = hits[:-1]
+        previous[first] = np.isin(codes[first], self.active)
+        onsets = codes[hits & ~previous]
+        checked = codes[last]
+        self.active = np.union1d(np.setdiff1d(self.active, checked, assume_unique=True), checked[hits[last]])
+        if len(onsets):
+            self.__onsets.append(onsets)
+        self.__logContacts(frame_id, codes, hits, first, previous)
+        if hits.any():
+            starts = np.flatnonzero(first)
+            starts = starts[np.logical_or.reduceat(hits, starts)] # pairs intersected on the frame
+            for code, first_hit in zip(codes[starts].tolist(), hits[starts].tolist()):
+                if code not in self.first_hits:
+                    self.first_hits[code] = (frame_id, first_hit)
+        return onsets
+
+
+    def __logContacts(self, frame_id, codes, hits, first, previous):
+        '''
+        Register frames of intersections of pairs in contact and finish combats (only pairs intersected on the frame
+        or in contact before it are passed)
+        '''
+        starts = np.flatnonzero(first)
+        ends = np.append(starts[1:], len(codes))
+        logged = np.logical_or.reduceat(hits, starts) | previous[starts]
+        for code, start, end in zip(codes[starts[logged]].tolist(), starts[logged].tolist(), ends[logged].tolist()):
+            for hit in hits[start:end].tolist():
+                contact = self.__contacts.get(code)
+                if hit and contact is None: # combat starts
+                    self.__contacts[code] = [frame_id, frame_id]
+                elif hit:
+                    contact[1] = frame_id
+                elif contact is not None: # combat is finished
+                    self.__events.append((code, contact[0], contact[1]))
+                    del self.__contacts[code]
+
+
+    def events(self):
+        '''
+        :return: combats in order of their start: arrays of the lower and the higher ids of pairs, the first and
+        the last frames of intersections of bboxes (combats, which are not finished, last till their last intersection)
+        '''
+        events = self.__events+[(code, first, last) for code, (first, last) in self.__contacts.items()]
+        codes, first, last = [np.array(column, dtype=np.int64) for column in zip(*events)] if events else \
+            [np.zeros(0, dtype=np.int64)]*3
+        order = np.lexsort((codes, first))
+        return code_pairs(codes[order])+(first[order], last[order])
+
+
+    def counts(self):
+        '''
+        :return: codes of pairs and numbers of their combats
+        '''
+        if not self.__onsets:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        self.__onsets = [np.concatenate(self.__onsets)]
+        return np.unique(self.__onsets[0], return_counts=True)
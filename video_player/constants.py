@@ -23,4 +23,75 @@ IOU_THRESHOLD = 0.5
 CONFIDENCE_THRESHOLD = 0.5
 SUPPRESSION_THRESHOLD = 0.4
 MIN_BOX_AREA = 200
-TRACKING_BUFFER = 30
\ No newline at end of file
+TRACKING_BUFFER = 30
+DEVICES = ['cuda', 'cpu']
+MODEL_VARIANTS = ['float', 'int8', 'traced']
+CALIBRATION_FRAMES = 32 # number of frames to calibrate quantized model
+PREPARED_MODEL_SUFFIX = '.prepared.pt' # suffix of cached state dict of the whole model next to the weights
+STRIDE_MOTION_TOLERANCE = 0.1 # maximum shift of humans between detections by adaptive stride (share of bbox height)
+
+# Detection on regions of frame with foreground
+FOREGROUND_PIXEL_THRESHOLD = 0.1 # minimum difference of pixel with background (in range 0-1) to be foreground
+FOREGROUND_CELL_SHARE = 0.02 # minimum share of foreground pixels in cell to detect on it
+ROI_CELL_SIZE = 32 # size of cell of regions (maximum stride of the detector)
+ROI_MARGIN_CELLS = 1 # number of cells added around foreground
+ROI_MIN_CELLS = 4 # minimum size of region in cells
+ROI_MAX_SHARE = 0.6 # maximum share of frame area covered by regions, otherwise the whole frame is processed
+
+# Reading of video
+VIDEO_INDEX_SUFFIX = '.index.npz' # suffix of cached index of frames next to the video
+READER_MAX_FAILURES = 25 # maximum number of consecutive broken frames before reading is stopped
+INDEX_POLL_SECONDS = 0.2 # interval of checking of the index of video built in background by the player
+
+# Markup settings
+MARKUP_FLUSH_FRAMES = 100 # maximum number of frames buffered before writing into markup file
+MARKUP_FLUSH_SECONDS = 5.0 # maximum time between writings into markup file
+
+# Checkpoints of tracking
+CHECKPOINT_FRAMES = 1000 # number of frames between checkpoints
+
+# Tracking pipeline settings
+PIPELINE_QUEUE_SIZE = 8
+
+# Marked video settings
+VIDEO_WRITER_BACKENDS = ['ffmpeg', 'opencv']
+VIDEO_WRITER_BACKEND = 'ffmpeg'
+VIDEO_CODEC = 'mjpeg' # codec of ffmpeg
+VIDEO_QUALITY = 3 # quality of ffmpeg encoding (2-31, lower is better)
+VIDEO_FOURCC = 'MJPG' # codec of opencv
+
+# Local tracking service
+SERVICE_HOST = '127.0.0.1'
+SERVICE_PORT = 8765
+SERVICE_POLL_SECONDS = 1.0 # interval of checking of progress of jobs
+SERVICE_TIMEOUT = 10.0 # timeout of requests to the service
+
+# Tracking by parallel segments of video
+SEGMENT_WORKERS = 8
+SEGMENT_OVERLAP = 50 # number of frames shared by neighbouring segments
+STITCH_IOU_WEIGHT = 0.5 # weight of IoU of bboxes against similarity of embeddings by matching tracks
+STITCH_MIN_SCORE = 0.4 # minimum score of matching to join tracks
+
+# Batch processing of many videos
+BATCH_WORKER_THREADS = 4 # threads of torch in each process
+BATCH_WORKER_MEMORY_GB = 3.0 # memory expected by one process with the detector
+
+# Profiling of stages
+PROFILE_METRICS_PREFIX = 'sportai' # prefix of names of metrics in Prometheus format
+PROFILE_SAMPLING_RATE = 100 # samples per second of sampling profiler
+PROFILE_SAMPLING_TIMEOUT = 30.0 # time to wait for saving of flame graph (seconds)
+
+# Binary markup
+BINARY_MARKUP_SUFFIX = '.mkb' # binary markup is saved next to the text markup with this extension
+BINARY_MARKUP_ALIGNMENT = 64 # alignment of sections of binary markup (bytes)
+BINARY_MARKUP_CHUNK_ROWS = 1000000 # number of rows of text markup parsed at once by conversion
+
+# Statistics of long recordings
+MARKUP_CHUNK_ROWS = 1000000 # number of rows of markup in memory at once
+
+# Combats
+COMBATS_SWEEP_MIN_BBOXES = 64 # minimum number of bboxes on frame to check only pairs found by sort and sweep
+COMBATS_MATRIX_MAX_IDS = 50 # maximum number of players on the drawn matrix of combats (players with the most combats)
+
+# Online statistics
+ONLINE_STATISTICS_SAVE_FRAMES = 1500 # number of frames between savings of statistics calculated during tracking
@@ -0,0 +1,275 @@
+import argparse
+import os
+import pickle
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+import constants
+from profiler import StageProfiler
+from videodataloader import VideoDataLoader, frames_to_blob
+
+from models import Darknet
+from tracker.multitracker import JDETracker, STrack
+from utils.kalman_filter import KalmanFilter
+
+
+def tracker_options(**kwargs):
+    '''
+    Collect default parameters of JDE Tracker
+    :param kwargs: parameters to override
+    :return: argparse object with parameters
+    '''
+    opt = argparse.Namespace(cfg=constants.TRACKER_CONFIG, weights=constants.TRACKER_WEIGHTS,
+                             img_size=constants.OUTPUT_FRAME_SIZE, iou_thres=constants.IOU_THRESHOLD,
+                             conf_thres=constants.CONFIDENCE_THRESHOLD, nms_thres=constants.SUPPRESSION_THRESHOLD,
+                             track_buffer=constants.TRACKING_BUFFER)
+    for key, value in kwargs.items():
+        setattr(opt, key, value)
+    return opt
+
+
+class BatchDetector:
+    '''
+    Implement wrapper of JDE model, which runs detection for a batch of frames by one forward pass
+    and then gives out predictions to the tracker frame by frame in the same order
+    '''
+
+    def __init__(self, model, fixed_size=None, profiler=None):
+        '''
+        Constructor
+        :param model: model of detector (Darknet)
+        :param fixed_size: size of batch, which model accepts only (for traced model), smaller batches are padded
+        :param profiler: StageProfiler to measure forward passes (None - not measured)
+        '''
+        self.model = model
+        self.__fixedsize = fixed_size
+        self.__profiler = profiler or StageProfiler('detector', enabled=False)
+        self.__predictions = deque() # predictions of batch, which were not consumed by the tracker yet
+
+
+    def detectBatch(self, blob):
+        '''
+        Run detector for a batch of frames
+        :param blob: tensor of frames N x C x H x W
+        '''
+        n_frames = blob.shape[0]
+        if self.__fixedsize and n_frames < self.__fixedsize:
+            blob = torch.cat([blob, blob[-1:].expand(self.__fixedsize-n_frames, -1, -1, -1)])
+        with torch.no_grad():
+            pred = self.__forward(blob, n_frames)
+        self.__predictions.extend(pred[:n_frames].split(1, dim=0))
+
+
+    def __forward(self, blob, n_frames):
+        with self.__profiler.stage('forward', frames=n_frames):
+            pred = self.model(blob)
+            if self.__profiler.enabled and pred.is_cuda:
+                torch.cuda.synchronize() # GPU runs asynchronously, so its time is counted by the next stage otherwise
+        return pred
+
+
+    def pending(self):
+        '''
+        :return: number of predictions waiting for the tracker
+        '''
+        return len(self.__predictions)
+
+
+    def __call__(self, im_blob):
+        '''
+        Get prediction for the next frame (it is called by JDETracker.update)
+        :param im_blob: tensor of the frame 1 x C x H x W
+        :return: prediction of the frame
+        '''
+        if self.__predictions:
+            return self.__predictions.popleft()
+        return self.__forward(im_blob, im_blob.shape[0])
+
+
+class JDEDeviceTracker(JDETracker):
+    '''
+    Implement JDE Tracker with the detector prepared outside, so it can be launched on any device
+    (JDETracker always builds the float model on GPU)
+    '''
+
+    def __init__(self, opt, model, frame_rate=30):
+        '''
+        Constructor
+        :param opt: argparse object with parameters of tracker
+        :param model: model of detector
+        :param frame_rate: FPS of video
+        '''
+        self.opt = opt
+        self.model = model
+        self.tracked_stracks = []
+        self.lost_stracks = []
+        self.removed_stracks = []
+        self.frame_id = 0
+        self.det_thresh = opt.conf_thres
+        self.buffer_size = int(frame_rate/30.0*opt.track_buffer)
+        self.max_time_lost = self.buffer_size
+        self.kalman_filter = KalmanFilter()
+
+
+    def propagate(self):
+        '''
+        Move tracks by the motion model (Kalman filter) on the frame without detection
+        :return: activated tracks on the frame
+        '''
+        self.frame_id += 1
+        STrack.multi_predict(self.tracked_stracks+self.lost_stracks, self.kalman_filter)
+        return [t for t in self.tracked_stracks if t.is_activated]
+
+
+    def motion(self):
+        '''
+        Measure motion of tracks by their velocities in the motion model
+        :return: median speed of activated tracks in heights of their bboxes per frame (None if there are no tracks)
+        '''
+        speeds = [np.hypot(t.mean[4], t.mean[5])/max(1.0, t.mean[3]) for t in self.tracked_stracks if t.is_activated]
+        return float(np.median(speeds)) if speeds else None
+
+
+@contextmanager
+def skipped_init():
+    '''
+    Skip random initialization of parameters of created modules, when all of them are loaded afterwards
+    '''
+    names = ['uniform_', 'normal_', 'constant_', 'ones_', 'zeros_', 'kaiming_uniform_', 'kaiming_normal_',
+             'xavier_uniform_', 'xavier_normal_']
+    initializers = {name: getattr(nn.init, name) for name in names}
+    for name in names:
+        setattr(nn.init, name, lambda tensor, *args, **kwargs: tensor)
+    try:
+        yield
+    finally:
+        for name, initializer in initializers.items():
+            setattr(nn.init, name, initializer)
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def load_state(path):
+    '''
+    Load state dict, which is memory-mapped instead of reading into memory (if it is supported by torch)
+    '''
+    try:
+        return torch.load(path, map_location='cpu', mmap=True, weights_only=True)
+    except TypeError: # older torch
+        return torch.load(path, map_location='cpu')
+
+
+def load_detector(opt):
+    '''
+    Create the detector with loaded weights on CPU.
+    The first loading saves the prepared state dict of the whole model next to the weights, so the next loadings
+    skip random initialization of parameters and map the prepared state dict from file
+    :param opt: argparse object with parameters of tracker
+    :return: model of detector
+    '''
+    prepared_file = os.path.splitext(opt.weights)[0]+constants.PREPARED_MODEL_SUFFIX
+    signature = [file_signature(opt.cfg), file_signature(opt.weights)] # prepared model is rebuilt for changed files
+    if os.path.isfile(prepared_file):
+        try:
+            prepared = load_state(prepared_file)
+            if prepared['signature'] == signature:
+                with skipped_init():
+                    model = Darknet(opt.cfg, nID=14455)
+                try:
+                    model.load_state_dict(prepared['model'], assign=True) # parameters use mapped memory
+                except TypeError: # older torch
+                    model.load_state_dict(prepared['model'])
+                return model
+        except (OSError, RuntimeError, KeyError, pickle.UnpicklingError):
+            pass # broken prepared model is rebuilt
+    model = Darknet(opt.cfg, nID=14455)
+    model.load_state_dict(torch.load(opt.weights, map_location='cpu')['model'], strict=False)
+    try:
+        tmp_file = prepared_file+'.tmp'
+        # State of the whole model includes initialized parameters missing in weights
+        torch.save({'signature': signature, 'model': model.state_dict()}, tmp_file)
+        os.replace(tmp_file, prepared_file)
+    except OSError:
+        pass # prepared model is not cached, if folder of weights is not writable
+    return model
+
+
+def load_frames(video, count):
+    '''
+    Load preprocessed frames from the beginning of video
+    :param video: path to the video
+    :param count: maximum number of frames
+    :return: list of preprocessed frames for the detector (uint8 H x W x C)
+    '''
+    frames = []
+    for _, img, _ in VideoDataLoader(video, constants.OUTPUT_FRAME_SIZE):
+        frames.append(img)
+        if len(frames) >= count:
+            break
+    return frames
+
+
+def build_model(opt, device='cuda', variant='float', frames=None, batch_size=1):
+    '''
+    Build the detector of JDE Tracker
+    :param opt: argparse object with parameters of tracker
+    :param device: device to launch the detector ('cuda' or 'cpu')
+    :param variant: variant of model from constants.MODEL_VARIANTS
+    'float' - original model,
+    'int8' - model with statically quantized convolutional blocks (CPU only),
+    'traced' - model compiled by TorchScript
+    :param frames: preprocessed frames to calibrate quantized model or to trace model
+    :param batch_size: size of batch for tracing of model
+    :return: model of detector
+    '''
+    if variant not in constants.MODEL_VARIANTS:
+        raise ValueError('Not available variant of model! Please choose the right one: {}'.format(
+            constants.MODEL_VARIANTS))
+    if variant == 'int8' and torch.device(device).type != 'cpu':
+        raise ValueError('Quantized model can be launched only on CPU')
+    model = load_detector(opt)
+    model.to(device).eval()
+    if variant != 'traced': # traced model needs outputs of fixed size
+        model.set_conf_thres(opt.conf_thres)
+    if variant == 'int8':
+        model = quantize_model(model, frames)
+    elif variant == 'traced':
+        example = frames_to_blob([frames[0]]*batch_size, device)
+        with torch.no_grad():
+            model = torch.jit.freeze(torch.jit.trace(model, example, check_trace=False))
+    return model
+
+
+def quantize_model(model, frames):
+    '''
+    Quantize convolutional blocks of model with batch normalization into int8 (static quantization).
+    Convolutional layers of detection heads remain in float to keep precision of boxes and embeddings
+    :param model: float model on CPU
+    :param frames: preprocessed frames to calibrate ranges of activations
+    :return: quantized model
+    '''
+    qconfig = torch.quantization.get_default_qconfig('fbgemm')
+    for module_def, module in zip(model.module_defs, model.module_list):
+        if module_def['type'] == 'convolutional' and int(module_def['batch_normalize']):
+            conv = fuse_conv_bn_eval(module[0], module[1])
+            layers = [torch.quantization.QuantStub(), conv, torch.quantization.DeQuantStub()] + list(module[2:])
+            for name in list(module._modules.keys()):
+                delattr(module, name)
+            for i, layer in enumerate(layers):
+                module.add_module(str(i), layer)
+            module.qconfig = qconfig
+    torch.quantization.prepare(model, inplace=True)
+    # Calibrate ranges of activations
+    with torch.no_grad():
+        for img in frames:
+            model(frames_to_blob([img]))
+    torch.quantization.convert(model, inplace=True)
+    return model
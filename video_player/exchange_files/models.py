@@ -121,6 +121,7 @@ class YOLOLayer(nn.Module):
         self.nC = nC  # number of classes (80)
         self.nID = nID # number of identities
         self.img_size = 0
+        self.grids = dict() # (size of input, device): stride, grid_xy, anchor_vec, anchor_wh
         self.emb_dim = 512
         self.shift = [1, 3, 5]
 
@@ -132,18 +133,20 @@ class YOLOLayer(nn.Module):
         self.s_r = nn.Parameter(-4.85*torch.ones(1))  # -4.85
         self.s_id = nn.Parameter(-2.3*torch.ones(1))  # -2.3
         self.emb_scale = math.sqrt(2) * math.log(self.nID-1)
+        self.conf_thres = None  # threshold of the lean inference path (None - predictions of all cells are output)
         
 
     def forward(self, p_cat,  img_size, targets=None, classifier=None, test_emb=False):
         p, p_emb = p_cat[:, :24, ...], p_cat[:, 24:, ...]
         nB, nGh, nGw = p.shape[0], p.shape[-2], p.shape[-1]
 
-        if self.img_size != img_size:
+        key = (img_size, p.device)
+        if key not in self.grids: # grids are built once for each size of input (crops have sizes multiple of 32)
             create_grids(self, img_size, nGh, nGw)
-
-            if p.is_cuda:
-                self.grid_xy = self.grid_xy.cuda()
-                self.anchor_wh = self.anchor_wh.cuda()
+            self.grids[key] = (self.stride, self.grid_xy.to(p.device), self.anchor_vec.to(p.device),
+                               self.anchor_wh.to(p.device))
+        self.stride, self.grid_xy, self.anchor_vec, self.anchor_wh = self.grids[key]
+        self.img_size = img_size
 
         p = p.view(nB, self.nA, self.nC + 5, nGh, nGw).permute(0, 1, 3, 4, 2).contiguous()  # prediction
         
@@ -199,18 +202,44 @@ class YOLOLayer(nn.Module):
 
         else:
             p_conf = torch.softmax(p_conf, dim=1)[:,1,...].unsqueeze(-1)
+            if self.conf_thres is not None:
+                return self.select_predictions(p_box, p_conf[..., 0], p_emb)
             p_emb = F.normalize(p_emb.unsqueeze(1).repeat(1,self.nA,1,1,1).contiguous(), dim=-1)
             #p_emb_up = F.normalize(shift_tensor_vertically(p_emb, -self.shift[self.layer]), dim=-1)
             #p_emb_down = F.normalize(shift_tensor_vertically(p_emb, self.shift[self.layer]), dim=-1)
-            p_cls = torch.zeros(nB,self.nA,nGh,nGw,1).cuda()               # Temp
+            p_cls = torch.zeros(nB,self.nA,nGh,nGw,1, device=p.device)     # Temp
             p = torch.cat([p_box, p_conf, p_cls, p_emb], dim=-1)
             #p = torch.cat([p_box, p_conf, p_cls, p_emb, p_emb_up, p_emb_down], dim=-1)
-            p[..., :4] = decode_delta_map(p[..., :4], self.anchor_vec.to(p))
+            p[..., :4] = decode_boxes(p[..., :4], self.grid_xy, self.anchor_wh)  # grids are on the device of input
             p[..., :4] *= self.stride
 
             return p.view(nB, -1, p.shape[-1])
 
 
+    def select_predictions(self, p_box, p_conf, p_emb):
+        """
+        Lean inference path: confidence is thresholded first, boxes are decoded only for the kept cells
+        and their embeddings are gathered and normalized without replication over anchors.
+        Kept predictions go in the same order as in the full output.
+        Returns predictions nB x K x D, images with less than K predictions are padded by zero confidence
+        """
+        nB = p_box.shape[0]
+        b, a, gy, gx = (p_conf > self.conf_thres).nonzero(as_tuple=True)
+        delta, anchor_wh = p_box[b, a, gy, gx], self.anchor_vec.to(p_box)[a]
+        boxes = torch.stack([anchor_wh[:, 0] * delta[:, 0] + gx.float(),
+                             anchor_wh[:, 1] * delta[:, 1] + gy.float(),
+                             anchor_wh[:, 0] * torch.exp(delta[:, 2]),
+                             anchor_wh[:, 1] * torch.exp(delta[:, 3])], dim=1) * self.stride
+        p_cls = torch.zeros_like(boxes[:, :1])  # Temp
+        rows = torch.cat([boxes, p_conf[b, a, gy, gx].unsqueeze(1), p_cls, F.normalize(p_emb[b, gy, gx], dim=-1)], 1)
+        counts = torch.bincount(b, minlength=nB)
+        out = rows.new_zeros(nB, int(counts.max()) if len(b) else 0, rows.shape[1])
+        if len(b):
+            slots = torch.arange(len(b), device=b.device) - (torch.cumsum(counts, 0) - counts)[b]
+            out[b, slots] = rows
+        return out
+
+
 class Darknet(nn.Module):
     """YOLOv3 object detection model"""
 
@@ -229,6 +258,39 @@ class Darknet(nn.Module):
         self.emb_dim = 512
         self.classifier = nn.Linear(self.emb_dim, nID)
         self.test_emb=test_emb
+        self.compile_plan()
+
+
+    def set_conf_thres(self, conf_thres):
+        """
+        Switch YOLO layers to the lean inference path, which outputs only predictions above the threshold
+        """
+        for module_def, module in zip(self.module_defs, self.module_list):
+            if module_def['type'] == 'yolo':
+                module[0].conf_thres = conf_thres
+
+
+    def compile_plan(self):
+        """
+        Build the plan of forward pass once: sources of route and shortcut layers are resolved into
+        absolute indices and outputs of layers are kept only till their last consumer
+        """
+        plan, last_use = [], {}
+        for i, module_def in enumerate(self.module_defs):
+            mtype = module_def['type']
+            sources = []
+            if mtype == 'route':
+                sources = [l if l >= 0 else i + l for l in (int(s) for s in module_def['layers'].split(','))]
+            elif mtype == 'shortcut':
+                l = int(module_def['from'])
+                sources = [l if l >= 0 else i + l]  # the other addend is the output of the previous layer
+            for s in sources:
+                last_use[s] = i
+            plan.append((i, mtype, sources))
+        releases = defaultdict(list)
+        for s, i in last_use.items():
+            releases[i].append(s)
+        self.plan = [(i, mtype, sources, releases[i], i in last_use) for i, mtype, sources in plan]
 
 
     def forward(self, x, targets=None, targets_len=None):
@@ -236,23 +298,21 @@ class Darknet(nn.Module):
         for ln in self.loss_names:
             self.losses[ln] = 0
         is_training = (targets is not None) and (not self.test_emb)
-        #img_size = x.shape[-1]
-        layer_outputs = []
+        img_size = (x.shape[-1], x.shape[-2]) # detection accepts any size of input multiple of 32
+        layer_outputs = {}  # outputs of layers consumed by later route and shortcut layers
         output = []
 
-        for i, (module_def, module) in enumerate(zip(self.module_defs, self.module_list)):
-            mtype = module_def['type']
+        for i, mtype, sources, released, keep in self.plan:
+            module = self.module_list[i]
             if mtype in ['convolutional', 'upsample', 'maxpool']:
                 x = module(x)
             elif mtype == 'route':
-                layer_i = [int(x) for x in module_def['layers'].split(',')]
-                if len(layer_i) == 1:
-                    x = layer_outputs[layer_i[0]]
+                if len(sources) == 1:
+                    x = layer_outputs[sources[0]]
                 else:
-                    x = torch.cat([layer_outputs[i] for i in layer_i], 1)
+                    x = torch.cat([layer_outputs[s] for s in sources], 1)
             elif mtype == 'shortcut':
-                layer_i = int(module_def['from'])
-                x = layer_outputs[-1] + layer_outputs[layer_i]
+                x = x + layer_outputs[sources[0]]
             elif mtype == 'yolo':
                 if is_training:  # get loss
                     targets = [targets[i][:int(l)] for i,l in enumerate(targets_len)]
@@ -263,9 +323,12 @@ class Darknet(nn.Module):
                     targets = [targets[i][:int(l)] for i,l in enumerate(targets_len)]
                     x = module[0](x, self.img_size, targets, self.classifier, self.test_emb)
                 else:  # get detections
-                    x = module[0](x, self.img_size)
+                    x = module[0](x, img_size)
                 output.append(x)
-            layer_outputs.append(x)
+            for s in released:
+                del layer_outputs[s]
+            if keep:
+                layer_outputs[i] = x
 
         if is_training:
             self.losses['nT'] /= 3 
@@ -284,6 +347,16 @@ def shift_tensor_vertically(t, delta):
         res[:,:, -delta:, :, :] = t[:,:, :delta, :, :]
     return res 
 
+def decode_boxes(delta_map, grid_xy, anchor_wh):
+    """
+    Decode deltas nB x nA x nGh x nGw x 4 into boxes (x, y, w, h) in cells of grid, as decode_delta_map does,
+    but by the grids built on the device of input (decode_delta_map builds anchors on GPU only)
+    """
+    xy = anchor_wh * delta_map[..., :2] + grid_xy
+    wh = anchor_wh * torch.exp(delta_map[..., 2:])
+    return torch.cat([xy, wh], dim=-1)
+
+
 def create_grids(self, img_size, nGh, nGw):
     self.stride = img_size[0]/nGw
     assert self.stride == img_size[1] / nGh
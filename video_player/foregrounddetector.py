@@ -0,0 +1,117 @@
+import cv2
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+import constants
+
+
+def merge_rects(rects):
+    '''
+    Merge intersected rectangles into their bounding rectangles
+    :param rects: list of rectangles (x1, y1, x2, y2)
+    :return: list of not intersected rectangles
+    '''
+    rects = list(rects)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i+1, len(rects)):
+                a, b = rects[i], rects[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    rects[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    rects.pop(j)
+                    merged = True
+                    break
+            if merged:
+                break
+    return rects
+
+
+class ForegroundDetector:
+    '''
+    Implement wrapper of JDE model, which runs detection only on regions of frame with foreground.
+    Foreground is found by the difference of frame with the background of the court (fixed camera is expected),
+    predictions of regions are shifted back into coordinates of the whole frame
+    '''
+
+    def __init__(self, model, background):
+        '''
+        Constructor
+        :param model: model of detector (Darknet), which accepts frames of any size multiple of constants.ROI_CELL_SIZE
+        :param background: background of the court as the input of the detector 1 x C x H x W
+        '''
+        self.model = model
+        self.__background = background
+        self.__dims = None # size of predictions, which is known after the first forward pass
+        self.__processed, self.__total = 0, 0 # processed and total area of frames
+
+
+    def __findRegions(self, img):
+        '''
+        Find regions of frame with foreground
+        :param img: preprocessed frame 1 x C x H x W
+        :return: list of regions (x1, y1, x2, y2) in pixels aligned by cells of constants.ROI_CELL_SIZE
+        '''
+        cell, margin = constants.ROI_CELL_SIZE, constants.ROI_MARGIN_CELLS
+        if self.__background.device != img.device:
+            self.__background = self.__background.to(img.device)
+        mask = ((img-self.__background).abs().mean(dim=1, keepdim=True) > constants.FOREGROUND_PIXEL_THRESHOLD).float()
+        cells = F.avg_pool2d(mask, cell) > constants.FOREGROUND_CELL_SHARE
+        cells = F.max_pool2d(cells.float(), 2*margin+1, stride=1, padding=margin) # margins around humans
+        cells = cells[0, 0].cpu().numpy().astype(np.uint8)
+        n_rows, n_cols = cells.shape
+        n_labels, _, stats, _ = cv2.connectedComponentsWithStats(cells, connectivity=8)
+        rects = []
+        for x, y, w, h, _ in stats[1:n_labels]:
+            # Small regions are enlarged, because the detector needs some context around humans
+            dw, dh = max(0, constants.ROI_MIN_CELLS-w), max(0, constants.ROI_MIN_CELLS-h)
+            x1, y1 = max(0, x-dw//2), max(0, y-dh//2)
+            x2, y2 = min(n_cols, x1+max(w, constants.ROI_MIN_CELLS)), min(n_rows, y1+max(h, constants.ROI_MIN_CELLS))
+            rects.append((x1, y1, x2, y2))
+        return [tuple(v*cell for v in rect) for rect in merge_rects(rects)]
+
+
+    def __detectFrame(self, img):
+        '''
+        Run detector on regions of the frame with foreground
+        :param img: preprocessed frame 1 x C x H x W
+        :return: predictions for the whole frame 1 x N x D
+        '''
+        height, width = img.shape[-2:]
+        self.__total += height*width
+        regions = self.__findRegions(img)
+        area = sum((x2-x1)*(y2-y1) for x1, y1, x2, y2 in regions)
+        if self.__dims is None or area > constants.ROI_MAX_SHARE*height*width:
+            # Regions cover the most of frame, so the whole frame is cheaper to process
+            self.__processed += height*width
+            pred = self.model(img)
+            self.__dims = pred.shape[-1]
+            return pred
+        self.__processed += area
+        preds = [torch.zeros(1, 0, self.__dims, device=img.device)]
+        for x1, y1, x2, y2 in regions:
+            pred = self.model(img[:, :, y1:y2, x1:x2])
+            pred[..., 0] += x1 # centers of boxes
+            pred[..., 1] += y1
+            preds.append(pred)
+        return torch.cat(preds, dim=1)
+
+
+    def processedShare(self):
+        '''
+        :return: share of area of frames passed through the detector
+        '''
+        return self.__processed/max(1, self.__total)
+
+
+    def __call__(self, blob):
+        '''
+        Run detector for a batch of frames
+        :param blob: tensor of frames N x C x H x W
+        :return: predictions N x K x D, predictions of frames with less than K boxes are padded by zero confidence
+        '''
+        preds = [self.__detectFrame(blob[i:i+1]) for i in range(blob.shape[0])]
+        size = max(pred.shape[1] for pred in preds)
+        return torch.cat([F.pad(pred, (0, 0, 0, size-pred.shape[1])) for pred in preds])
@@ -1,6 +1,7 @@
 import numpy as np
 from matplotlib.colors import LinearSegmentedColormap
 from PIL import Image
+from scipy.signal import fftconvolve
 
 import constants
 
@@ -46,6 +47,24 @@ class Heatmapper:
             return None
 
 
+    def buildHeatmapFromDensity(self, density, background_img):
+        '''
+        Build a heatmap on background image according to numbers of points in pixels.
+        Each spot multiplies the heatmap by its transparency, so the heatmap is the exponent of convolution
+        of the density with logarithm of transparency of spot (it is equal to pasting of spots up to rounding)
+        :param density: numbers of points in pixels of background with margins of point_diameter on each side
+        (DensityAggregate.density)
+        :param background_img: background image
+        :return: heatmap on background image
+        '''
+        if background_img is None:
+            return None
+        width, height = background_img.size
+        heatmap = self.__makeHeatmapFromDensity(width, height, density)
+        heatmap = self.__imageToOpacity(heatmap, self.opacity)
+        return Image.alpha_composite(background_img.convert('RGBA'), heatmap)
+
+
     def __setColorMapFromImage(self, colormap_img):
         # Load colomap image
         img = Image.open(colormap_img)
@@ -65,13 +84,39 @@ class Heatmapper:
         :return: heatmap image
         '''
         heatmap = Image.new('L', (width, height), color=255) # empty heatmap
-        spot = Image.open(constants.SPOT_IMAGE).copy().resize((self.point_diameter, self.point_diameter),
-                                                              resample=Image.ANTIALIAS) # spot image to model a heatmap
-        spot = self.__imageToOpacity(spot, self.point_strength)
+        spot = self.__makeSpot()
         # Locate spots on a heatmap according to coordinates of points
         for x, y in points:
             x, y = int(x - self.point_diameter/2), int(y - self.point_diameter/2)
             heatmap.paste(spot, (x, y), spot)
         # Paint over using heatmap
         res = self.cmap(np.array(heatmap), bytes=True)
-        return Image.fromarray(res)
\ No newline at end of file
+        return Image.fromarray(res)
+
+
+    def __makeHeatmapFromDensity(self, width, height, density):
+        '''
+        Form a heatmap of fixed width and height for numbers of points in pixels
+        :param width: width of heatmap
+        :param height: height of heatmap
+        :param density: numbers of points in pixels with margins of point_diameter on each side
+        :return: heatmap image
+        '''
+        transparency = 1.0-np.array(self.__makeSpot().split()[3], dtype=np.float64)/255
+        # Spot of point p covers pixels from floor(p - point_diameter/2) (as by pasting except spots of odd
+        # diameter cut by the upper and the left borders)
+        shift = self.point_diameter+(self.point_diameter+1)//2
+        shade = fftconvolve(density.astype(np.float64), np.log(transparency))[shift:shift+height, shift:shift+width]
+        heatmap = np.clip(np.rint(255*np.exp(np.minimum(shade, 0))), 0, 255).astype(np.uint8)
+        # Paint over using heatmap
+        res = self.cmap(heatmap, bytes=True)
+        return Image.fromarray(res)
+
+
+    def __makeSpot(self):
+        '''
+        :return: spot image to model a heatmap
+        '''
+        spot = Image.open(constants.SPOT_IMAGE).copy().resize((self.point_diameter, self.point_diameter),
+                                                              resample=Image.ANTIALIAS)
+        return self.__imageToOpacity(spot, self.point_strength)
@@ -0,0 +1,335 @@
+'''
+Statistics of arbitrarily long recordings in constant memory. Markup is read by chunks of whole frames,
+each statistic is an aggregate, which is updated by chunks in order of frames: partial aggregate of a chunk
+is calculated independently and merged into the aggregate of previous chunks
+'''
+
+import argparse
+import json
+import os
+import numpy as np
+import pandas as pd
+from collections import defaultdict
+from PIL import Image
+
+import constants
+import operations
+from binarymarkup import BinaryMarkup, find_binary_markup
+from combatsengine import CombatsEngine, code_pairs, combats_matrix
+from heatmapper import Heatmapper
+from markupstore import MarkupChunk
+from traceplace import Traceplace
+
+
+def iter_markup_chunks(markup_file, chunk_rows=constants.MARKUP_CHUNK_ROWS):
+    '''
+    Iterate markup by chunks in order of frames, rows of a frame are never split between chunks
+    :param markup_file: text or binary markup file (text markup should be sorted by frames as it is saved by tracker)
+    :param chunk_rows: approximate number of rows in chunk (chunk is extended to the end of its last frame)
+    :return: generator of MarkupChunk
+    '''
+    binary_file = find_binary_markup(markup_file)
+    if binary_file is not None:
+        markup = BinaryMarkup(binary_file)
+        start = 0
+        while start < len(markup):
+            end = min(start+chunk_rows, len(markup))
+            end = int(markup.frame_offsets[np.searchsorted(markup.frame_offsets, end)]) # border of frames
+            yield MarkupChunk(np.array(markup.frame[start:end]), np.array(markup.id[start:end]),
+                              np.stack([markup.x[start:end], markup.y[start:end],
+                                        markup.w[start:end], markup.h[start:end]], axis=1))
+            start = end
+        return
+    if os.path.getsize(markup_file) == 0:
+        return
+    rest = None # rows of the last frame of chunk, which may be continued in the next chunk
+    for data in pd.read_csv(markup_file, names=operations.MARKUP_COLUMNS+['propagated'], chunksize=chunk_rows):
+        data = data[operations.MARKUP_COLUMNS]
+        if rest is not None:
+            data = pd.concat([rest, data])
+        last = data['frame'].values == data['frame'].values[-1]
+        rest = data[last]
+        if not np.all(last):
+            yield dataframe_chunk(data[~last])
+    if rest is not None:
+        yield dataframe_chunk(rest)
+
+
+def presence_runs(frames, ids):
+    '''
+    :param frames: numbers of frames of rows
+    :param ids: ids of tracks of rows
+    :return: dictionary {id: list of runs [first, last] of consecutive frames, where track is present}
+    '''
+    if len(ids) == 0:
+        return dict()
+    order = np.lexsort((frames, ids))
+    frames, ids = frames[order], ids[order]
+    starts = np.flatnonzero(np.concatenate([[True], (ids[1:] != ids[:-1]) | (frames[1:]-frames[:-1] > 1)]))
+    ends = np.append(starts[1:], len(ids))-1
+    runs = dict()
+    for human_id, first, last in zip(ids[starts].tolist(), frames[starts].tolist(), frames[ends].tolist()):
+        runs.setdefault(human_id, []).append([first, last])
+    return runs
+
+
+def dataframe_chunk(data):
+    '''
+    :param data: dataframe with columns operations.MARKUP_COLUMNS
+    :return: MarkupChunk with rows of dataframe
+    '''
+    return MarkupChunk(data['frame'].values, data['id'].values, data[operations.MARKUP_COLUMNS[2:]].values)
+
+
+class DensityAggregate:
+    '''
+    Implement numbers of points of bboxes in pixels of background, they are summed up by merging.
+    Heatmap is rendered from the density by Heatmapper.buildHeatmapFromDensity
+    '''
+
+    def __init__(self, width, height, marker_pos=Traceplace.LOWER_CENTER, margin=30):
+        '''
+        Constructor
+        :param width: width of background
+        :param height: height of background
+        :param marker_pos: marker of location of key points on bboxes
+        :param margin: margin of density on each side to keep points, which spots cover the background partially
+        (diameter of spot of heatmap)
+        '''
+        self.width, self.height, self.margin = width, height, margin
+        self.__markerpos = marker_pos
+        self.density = np.zeros((height+2*margin, width+2*margin), dtype=np.int64)
+
+
+    def update(self, chunk):
+        '''
+        :param chunk: MarkupChunk
+        '''
+        points = operations.get_points(chunk.bboxes, self.__markerpos)+self.margin
+        rows, cols = self.density.shape
+        inside = (points[:, 0] >= 0) & (points[:, 0] < cols) & (points[:, 1] >= 0) & (points[:, 1] < rows)
+        points = points[inside]
+        # Work is proportional to the number of points, so single frames are added as cheaply as chunks
+        np.add.at(self.density, (points[:, 1], points[:, 0]), 1)
+
+
+    def merge(self, other):
+        self.density += other.density
+
+
+class DistanceAggregate:
+    '''
+    Implement lengths of trajectories of tracks. Aggregate keeps the first and the last points of tracks,
+    so the step between chunks is added by merging
+    '''
+
+    def __init__(self, marker_pos=Traceplace.LOWER_CENTER):
+        '''
+        Constructor
+        :param marker_pos: marker of location of key points on bboxes
+        '''
+        self.__markerpos = marker_pos
+        self.distances = defaultdict(float) # id: covered distance in pixels
+        self.first_points = dict() # id: the first point of track
+        self.last_points = dict() # id: the last point of track
+
+
+    def update(self, chunk):
+        '''
+        :param chunk: MarkupChunk
+        '''
+        partial = DistanceAggregate(self.__markerpos)
+        partial.__addChunk(chunk)
+        self.merge(partial)
+
+
+    def __addChunk(self, chunk):
+        order = np.argsort(chunk.ids, kind='stable') # rows of each track stay in order of frames
+        ids = chunk.ids[order]
+        points = operations.get_points(chunk.bboxes, self.__markerpos)[order]
+        if len(ids) == 0:
+            return
+        same = ids[1:] == ids[:-1] # step between neighbouring rows of the same track
+        steps = np.where(same, np.hypot(*(points[1:]-points[:-1]).T), 0.0)
+        starts = np.flatnonzero(np.concatenate([[True], ~same]))
+        ends = np.append(starts[1:], len(ids))-1
+        tracks = np.cumsum(np.concatenate([[0], ~same]))
+        sums = np.bincount(tracks[1:], weights=steps, minlength=len(starts))
+        # Tracks in order of their first appearance in chunk
+        for k in np.argsort(order[starts], kind='stable'):
+            human_id = int(ids[starts[k]])
+            self.distances[human_id] = float(sums[k])
+            self.first_points[human_id] = tuple(int(v) for v in points[starts[k]])
+            self.last_points[human_id] = tuple(int(v) for v in points[ends[k]])
+
+
+    def merge(self, other):
+        '''
+        :param other: aggregate of the following frames
+        '''
+        for human_id, distance in other.distances.items():
+            if human_id in self.last_points:
+                distance += float(np.hypot(*np.subtract(other.first_points[human_id], self.last_points[human_id])))
+            else:
+                self.first_points[human_id] = other.first_points[human_id]
+            self.distances[human_id] += distance
+            self.last_points[human_id] = other.last_points[human_id]
+
+
+class CombatsAggregate:
+    '''
+    Implement numbers of combats between pairs of tracks (as in CombatsCounter: a combat starts on the frame,
+    where bboxes of pair intersect, and they did not intersect by the previous check of pair, pairs are checked
+    on frames, where both tracks are present). Aggregate keeps pairs in contact by their last check, pairs, which
+    intersect by their first check, and frames, where tracks are present, so a combat continued from
+    the previous chunk is not counted twice by merging
+    '''
+
+    def __init__(self, start_frame=1):
+        '''
+        Constructor
+        :param start_frame: the first frame to count combats (CombatsCounter starts from frame 1)
+        '''
+        self.__startframe = start_frame
+        self.counts = defaultdict(int) # (id1, id2), id1 < id2: number of combats
+        self.active = set() # pairs in contact by their last check
+        self.opened = set() # pairs, which intersect by their first check
+        self.presence = dict() # id: list of runs [first, last] of frames, where track is present
+
+
+    def update(self, chunk):
+        '''
+        :param chunk: MarkupChunk
+        '''
+        partial = CombatsAggregate(self.__startframe)
+        partial.__addChunk(chunk)
+        self.merge(partial)
+
+
+    def __addChunk(self, chunk):
+        counted = chunk.frames >= self.__startframe
+        frames, ids, bboxes = chunk.frames[counted], chunk.ids[counted], chunk.bboxes[counted]
+        engine = CombatsEngine()
+        borders = np.flatnonzero(frames[1:] != frames[:-1])+1
+        for start, end in zip(np.concatenate([[0], borders]), np.append(borders, len(frames))):
+            if end-start > 1:
+                engine.addFrame(int(frames[start]), ids[start:end], bboxes[start:end])
+        codes, counts = engine.counts()
+        self.counts.update(zip(zip(*[v.tolist() for v in code_pairs(codes)]), counts.tolist()))
+        self.active = set(zip(*[v.tolist() for v in code_pairs(engine.active)]))
+        self.presence = presence_runs(frames, ids)
+        for code, (frame_id, first_hit) in engine.first_hits.items():
+            pair = tuple(v.item() for v in code_pairs(code))
+            if first_hit and not self.__copresent(pair, before=frame_id):
+                self.opened.add(pair)
+
+
+    def __copresent(self, pair, before=None):
+        '''
+        :return: both tracks of pair are present on some frame (before the frame, if it is given)
+        '''
+        for first1, last1 in self.presence.get(pair[0], []):
+            for first2, last2 in self.presence.get(pair[1], []):
+                last = min(last1, last2) if before is None else min(last1, last2, before-1)
+                if max(first1, first2) <= last:
+                    return True
+        return False
+
+
+    def merge(self, other):
+        '''
+        :param other: aggregate of the following frames
+        '''
+        for pair, count in other.counts.items():
+            if pair in other.opened and pair in self.active: # combat is continued from previous frames
+                count -= 1
+            if count:
+                self.counts[pair] += count
+        self.opened |= {pair for pair in other.opened if not self.__copresent(pair)}
+        self.active = {pair for pair in self.active if not other.__copresent(pair)} | other.active
+        for human_id, runs in other.presence.items():
+            own = self.presence.setdefault(human_id, [])
+            if own and runs and own[-1][1]+1 >= runs[0][0]:
+                own[-1][1] = max(own[-1][1], runs[0][1])
+                runs = runs[1:]
+            own.extend([list(run) for run in runs])
+
+
+    def matrix(self, ids):
+        '''
+        :param ids: ids of tracks
+        :return: symmetric matrix of numbers of combats between tracks
+        '''
+        return combats_matrix(self.counts, ids)
+
+
+def aggregate_markup(markup_file, aggregates, chunk_rows=constants.MARKUP_CHUNK_ROWS):
+    '''
+    Update aggregates by all chunks of markup
+    :param markup_file: text or binary markup file
+    :param aggregates: list of aggregates (DensityAggregate, DistanceAggregate, CombatsAggregate)
+    :param chunk_rows: approximate number of rows in chunk
+    :return: number of rows of markup
+    '''
+    rows = 0
+    for chunk in iter_markup_chunks(markup_file, chunk_rows):
+        for aggregate in aggregates:
+            aggregate.update(chunk)
+        rows += len(chunk.frames)
+    return rows
+
+
+def init_argparse():
+    '''
+    Initialize argparse
+    '''
+    parser = argparse.ArgumentParser(description='Heatmap, covered distances and combats of long recordings '
+                                                 'by chunks of markup')
+    parser.add_argument(
+        '--markup',
+        nargs='?',
+        help='Markup file (text or binary)',
+        required=True,
+        type=str)
+    parser.add_argument(
+        '--out_dir',
+        nargs='?',
+        help='Output directory for saving files with calculated statistics',
+        required=True,
+        type=str)
+    parser.add_argument(
+        '--chunk_rows',
+        nargs='?',
+        help='Number of rows of markup in memory at once',
+        default=constants.MARKUP_CHUNK_ROWS,
+        type=int)
+    parser.add_argument(
+        '--traceplace',
+        nargs='?',
+        help='Place of marker on the bbox to build heatmap and measure distances',
+        default='lower_center',
+        type=str)
+    return parser
+
+
+def main():
+    parser = init_argparse()
+    # Extract arguments of script
+    args = parser.parse_args()
+    marker_pos = Traceplace[args.traceplace.upper()]
+    background = Image.open(constants.BACKGROUND_READY_IMAGE)
+    heatmapper = Heatmapper()
+    density = DensityAggregate(*background.size, marker_pos, heatmapper.point_diameter)
+    distances, combats = DistanceAggregate(marker_pos), CombatsAggregate()
+    rows = aggregate_markup(args.markup, [density, distances, combats], args.chunk_rows)
+    print('Rows of markup: {}'.format(rows))
+    os.makedirs(args.out_dir, exist_ok=True)
+    heatmapper.buildHeatmapFromDensity(density.density, background).save(os.path.join(args.out_dir, 'heatmap.png'))
+    with open(os.path.join(args.out_dir, 'covered_distances.json'), 'w') as f:
+        json.dump(distances.distances, f)
+    with open(os.path.join(args.out_dir, 'combats.json'), 'w') as f:
+        json.dump({'{}-{}'.format(*pair): count for pair, count in combats.counts.items()}, f)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+from collections import namedtuple
+
+import operations
+from binarymarkup import BinaryMarkup, build_indexes, find_binary_markup, frames_order
+
+# Rows of markup as arrays: frames, ids and bboxes N x 4 (columns bb_y, bb_x, bb_h, bb_w of markup)
+MarkupChunk = namedtuple('MarkupChunk', ['frames', 'ids', 'bboxes'])
+
+
+def time_to_frames(times_ms, timestamps=None, frame_rate=None):
+    '''
+    :param times_ms: times in milliseconds from the start of video
+    :param timestamps: timestamps of frames of video in milliseconds
+    :param frame_rate: FPS of video, if timestamps are not known
+    :return: numbers of the first frames at or after the times
+    '''
+    if timestamps is not None:
+        return np.searchsorted(timestamps, times_ms)
+    if frame_rate:
+        return np.ceil(np.asarray(times_ms, dtype=np.float64)*frame_rate/1000.0).astype(np.int64)
+    raise ValueError('Timestamps or frame rate of video are needed to select rows by time')
+
+
+def frames_to_time(frames, timestamps=None, frame_rate=None):
+    '''
+    :param frames: numbers of frames (frames after the end of video are extrapolated by duration of frame)
+    :param timestamps: timestamps of frames of video in milliseconds
+    :param frame_rate: FPS of video, if timestamps are not known
+    :return: times of frames in milliseconds from the start of video
+    '''
+    frames = np.asarray(frames, dtype=np.int64)
+    if timestamps is not None and len(timestamps) > 1:
+        last = np.clip(frames, 0, len(timestamps)-1)
+        return timestamps[last]+(frames-last)*float(np.median(np.diff(timestamps)))
+    if frame_rate:
+        return frames*1000.0/frame_rate
+    raise ValueError('Timestamps or frame rate of video are needed to find times of frames')
+
+
+class MarkupStore:
+    '''
+    Implement markup loaded once and shared by all statistics. Rows are sorted by frames, so rows of a frame
+    are a contiguous slice of columns, rows of a track are taken by the index of tracks.
+    Binary markup is mapped from file with its indexes, text markup is parsed and indexed in memory
+    '''
+
+    def __init__(self, markup_file, timestamps=None, frame_rate=None):
+        '''
+        Constructor
+        :param markup_file: text or binary markup file
+        :param timestamps: timestamps of frames of video in milliseconds (e.g. VideoIndex.timestamps) to select
+        rows by time
+        :param frame_rate: FPS of video to select rows by time, if timestamps are not known
+        '''
+        self.markup_file = markup_file
+        self.timestamps = timestamps
+        self.frame_rate = frame_rate
+        binary_file = find_binary_markup(markup_file)
+        if binary_file is not None:
+            markup = BinaryMarkup(binary_file)
+            columns = [markup.frame, markup.id, markup.x, markup.y, markup.w, markup.h, markup.propagated]
+            indexes = {'first_frame': markup.first_frame, 'frames': markup.n_frames}
+            indexes.update({name: getattr(markup, name)
+                            for name in ['frame_offsets', 'track_ids', 'track_offsets', 'track_rows']})
+        else:
+            data = operations.read_markup(markup_file, propagated=True)
+            columns = [data[name].values for name in operations.MARKUP_COLUMNS+['propagated']]
+            order = frames_order(columns[0])
+            if order is not None:
+                columns = [column[order] for column in columns]
+            indexes = build_indexes(columns[0], columns[1])
+        # Columns of rows: frames, ids, coordinates x, y of top left corner, width and height of bboxes
+        self.frames, self.ids, self.x, self.y, self.w, self.h, self.propagated = columns
+        self.first_frame, self.n_frames = indexes['first_frame'], indexes['frames']
+        self.__frameoffsets = indexes['frame_offsets']
+        self.__trackids = indexes['track_ids']
+        self.__trackoffsets = indexes['track_offsets']
+        self.__trackrows = indexes['track_rows']
+        self.__data = None
+
+
+    def __len__(self):
+        return len(self.frames)
+
+
+    @property
+    def last_frame(self):
+        return self.first_frame+self.n_frames-1
+
+
+    @property
+    def data(self):
+        '''
+        :return: dataframe with all rows of markup (it is built once)
+        '''
+        if self.__data is None:
+            self.__data = self.rows(slice(None))
+        return self.__data
+
+
+    def trackIds(self):
+        '''
+        :return: ids of tracks in order of their first appearance
+        '''
+        first_rows = self.__trackrows[self.__trackoffsets[:-1]]
+        return [int(track_id) for track_id in self.__trackids[np.argsort(first_rows, kind='stable')]]
+
+
+    def rows(self, index):
+        '''
+        :param index: slice or numbers of rows
+        :return: dataframe with rows of markup (columns operations.MARKUP_COLUMNS)
+        '''
+        columns = [self.frames, self.ids, self.x, self.y, self.w, self.h]
+        return pd.DataFrame(dict(zip(operations.MARKUP_COLUMNS, [column[index] for column in columns])))
+
+
+    def chunk(self, index):
+        '''
+        :param index: slice or numbers of rows
+        :return: MarkupChunk with rows of markup
+        '''
+        return MarkupChunk(np.asarray(self.frames[index]), np.asarray(self.ids[index]),
+                           np.stack([self.x[index], self.y[index], self.w[index], self.h[index]], axis=1))
+
+
+    def frameSlice(self, frame_id):
+        '''
+        :param frame_id: number of frame
+        :return: slice of rows of the frame
+        '''
+        k = frame_id-self.first_frame
+        if k < 0 or k >= self.n_frames:
+            return slice(0, 0)
+        return slice(int(self.__frameoffsets[k]), int(self.__frameoffsets[k+1]))
+
+
+    def framesSlice(self, start, end):
+        '''
+        :param start: the first frame
+        :param end: frame to stop at
+        :return: slice of rows of frames from start till end
+        '''
+        k1 = int(np.clip(start-self.first_frame, 0, self.n_frames))
+        k2 = int(np.clip(end-self.first_frame, k1, self.n_frames))
+        return slice(int(self.__frameoffsets[k1]), int(self.__frameoffsets[k2]))
+
+
+    def trackIndex(self, track_id):
+        '''
+        :param track_id: id of track
+        :return: numbers of rows of the track in order of frames
+        '''
+        k = int(np.searchsorted(self.__trackids, track_id))
+        if k == len(self.__trackids) or self.__trackids[k] != track_id:
+            return np.zeros(0, dtype=np.int64)
+        return self.__trackrows[self.__trackoffsets[k]:self.__trackoffsets[k+1]]
+
+
+    def timeSlice(self, start_ms, end_ms):
+        '''
+        :param start_ms: start of time range in milliseconds from the start of video
+        :param end_ms: end of time range (not included)
+        :return: slice of rows of frames within the time range
+        '''
+        start, end = time_to_frames([start_ms, end_ms], self.timestamps, self.frame_rate)
+        return self.framesSlice(int(start), int(end))
+
+
+    def frame(self, frame_id):
+        '''
+        :return: dataframe with rows of the frame
+        '''
+        return self.rows(self.frameSlice(frame_id))
+
+
+    def track(self, track_id):
+        '''
+        :return: dataframe with rows of the track in order of frames
+        '''
+        return self.rows(self.trackIndex(track_id))
+
+
+    def timeRange(self, start_ms, end_ms):
+        '''
+        :return: dataframe with rows of frames within the time range [start_ms, end_ms)
+        '''
+        return self.rows(self.timeSlice(start_ms, end_ms))
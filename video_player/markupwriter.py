@@ -0,0 +1,124 @@
+import os
+import time
+import numpy as np
+
+import constants
+from binarymarkup import ROW_DTYPE, append_text_rows, index_rows_file
+
+
+class MarkupWriter:
+    '''
+    Implement class of writing markup of tracked objects incrementally.
+    Rows are buffered and flushed into file periodically, so memory does not grow with the length of video
+    and the markup of processed frames survives a failure of tracking
+    '''
+
+    def __init__(self, markup_file, flush_frames=constants.MARKUP_FLUSH_FRAMES,
+                 flush_seconds=constants.MARKUP_FLUSH_SECONDS, offset=None, flag_propagated=False, binary_file=None):
+        '''
+        Constructor
+        :param markup_file: file to save information about bboxes, ids of humans on each frame of video
+        :param flush_frames: maximum number of frames, which rows are kept in buffer
+        :param flush_seconds: maximum time between flushes of buffer
+        :param offset: size of markup to keep in the existing file and continue writing after it
+        (None - write new file)
+        :param flag_propagated: add column with flags of bboxes propagated by motion model without detection
+        :param binary_file: file to save markup also in binary format by closing (None - only text markup is saved).
+        Rows are appended to <binary_file>.rows during writing and are indexed at the end
+        '''
+        if offset is None:
+            self.__file = open(markup_file, 'w')
+        else:
+            os.truncate(markup_file, offset) # drop rows written after the moment of offset
+            self.__file = open(markup_file, 'a')
+        self.__flushframes = flush_frames
+        self.__flushseconds = flush_seconds
+        self.__flagpropagated = flag_propagated
+        self.__binaryfile = binary_file
+        self.__rowsfile = None
+        if binary_file is not None:
+            self.__rowsfile = self.__openRows(markup_file, binary_file+'.rows', offset is not None)
+        self.__buffer = []
+        self.__records = [] # buffered rows for binary markup
+        self.__bufferedframes = 0
+        self.__lastflush = time.monotonic()
+
+
+    def write(self, frame_id, tlwhs, track_ids, propagated=False):
+        '''
+        Add tracked bboxes of the frame into markup
+        :param frame_id: number of frame
+        :param tlwhs: bboxes (top left corner, width, height)
+        :param track_ids: ids of tracked humans
+        :param propagated: bboxes were propagated by motion model without detection
+        '''
+        for tlwh, track_id in zip(tlwhs, track_ids):
+            if track_id < 0:
+                continue
+            x1, y1, w, h = tlwh
+            # frame_number, id_human, coordinates x, y of top left corner, width and height of bbox
+            row = '{frame},{id},{x1},{y1},{w},{h}'.format(frame=frame_id, id=track_id, x1=x1, y1=y1, w=w, h=h)
+            if self.__flagpropagated:
+                row += ',{:d}'.format(propagated)
+            self.__buffer.append(row+'\n')
+            if self.__rowsfile is not None:
+                self.__records.append((frame_id, track_id, x1, y1, w, h, propagated))
+        self.__bufferedframes += 1
+        if self.__bufferedframes >= self.__flushframes or time.monotonic()-self.__lastflush >= self.__flushseconds:
+            self.flush()
+
+
+    def flush(self):
+        '''
+        Write buffered rows into file
+        '''
+        self.__file.writelines(self.__buffer)
+        self.__file.flush()
+        self.__buffer = []
+        if self.__rowsfile is not None:
+            np.array(self.__records, dtype=ROW_DTYPE).tofile(self.__rowsfile)
+            self.__rowsfile.flush()
+            self.__records = []
+        self.__bufferedframes = 0
+        self.__lastflush = time.monotonic()
+
+
+    def size(self):
+        '''
+        Flush buffered rows
+        :return: size of written markup in bytes
+        '''
+        self.flush()
+        return self.__file.tell()
+
+
+    def close(self):
+        '''
+        Write the rest of rows and close file
+        '''
+        if self.__file.closed:
+            return
+        self.flush()
+        self.__file.close()
+        if self.__rowsfile is not None:
+            self.__rowsfile.close()
+            index_rows_file(self.__rowsfile.name, self.__binaryfile, self.__file.name)
+
+
+    @staticmethod
+    def __openRows(markup_file, rows_file, resumed):
+        '''
+        Open file of rows of binary markup
+        :param resumed: writing is continued, so rows of the truncated text markup are kept
+        '''
+        if not resumed:
+            return open(rows_file, 'wb')
+        with open(markup_file) as f:
+            n_rows = sum(1 for _ in f)
+        if os.path.isfile(rows_file) and os.path.getsize(rows_file) >= n_rows*ROW_DTYPE.itemsize:
+            os.truncate(rows_file, n_rows*ROW_DTYPE.itemsize)
+            return open(rows_file, 'ab')
+        # Rows were already indexed by closing after a failure, so they are restored from text markup
+        f = open(rows_file, 'wb')
+        append_text_rows(markup_file, f)
+        return f
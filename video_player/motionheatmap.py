@@ -1,11 +1,12 @@
 import argparse
 import os
-import pandas as pd
 from PIL import Image
 
 import constants
-import operations
 from heatmapper import Heatmapper
+from markupaggregates import DensityAggregate
+from markupstore import MarkupStore
+from profiler import StageProfiler
 from traceplace import Traceplace
 
 
@@ -14,30 +15,32 @@ class MotionHeatmap():
     Implement class of building heamap of motion for detected and tracked players
     '''
 
-    def __init__(self, markup_file, out_dir, human_number=None, marker_pos='lower_center'):
+    def __init__(self, markup_file, out_dir, human_number=None, marker_pos='lower_center', profiler=None):
         '''
         Constructor
         :param markup_file: file with saved information about bboxes, ids of humans on each frame of video
+        or MarkupStore loaded once for all statistics
         :param out_dir: directory for saving results
         :param human_number: id of human to count combats with other players (None - count combats for each player)
         :param marker_pos: marker of location of key points on bboxes to build a heatmap
+        :param profiler: StageProfiler to measure stages of building (None - stages are not measured)
         '''
-        self.__data = pd.read_csv(markup_file, names=['frame', 'id', 'bb_y', 'bb_x', 'bb_h', 'bb_w'])
+        self.__profiler = profiler or StageProfiler(str(markup_file), enabled=False)
+        with self.__profiler.stage('markup_loading'):
+            self.__store = markup_file if isinstance(markup_file, MarkupStore) else MarkupStore(markup_file)
         self.__outdirectory = out_dir
         self.__background = Image.open(constants.BACKGROUND_READY_IMAGE)
         self.__human = human_number
         self.__markerpos = Traceplace[str(marker_pos).upper()]
 
 
-    def __loadPoints(self):
+    def __loadDensity(self, heatmapper):
         '''
-        Load vertices of bounding boxes around objects
+        Count vertices of bounding boxes around objects in pixels of background
         '''
-        if self.__human is not None:
-            self.__points = [operations.get_point(row, self.__markerpos)
-                             for _, row in self.__data[self.__data['id'] == self.__human].iterrows()]
-        else:
-            self.__points = [operations.get_point(row, self.__markerpos) for _, row in self.__data.iterrows()]
+        index = self.__store.trackIndex(self.__human) if self.__human is not None else slice(None)
+        self.__density = DensityAggregate(*self.__background.size, self.__markerpos, heatmapper.point_diameter)
+        self.__density.update(self.__store.chunk(index))
 
 
     def buildHeatmap(self):
@@ -46,9 +49,11 @@ class MotionHeatmap():
         :return: heatmap of motion as an image
         '''
         print('Building the heatmap of motion...')
-        self.__loadPoints()
         heatmapper = Heatmapper()
-        heatmap_img = heatmapper.buildHeatmapOnImage(self.__points, self.__background)
+        with self.__profiler.stage('heatmap_points'):
+            self.__loadDensity(heatmapper)
+        with self.__profiler.stage('heatmap_drawing'):
+            heatmap_img = heatmapper.buildHeatmapFromDensity(self.__density.density, self.__background)
         if heatmap_img is not None:
             if not os.path.exists(self.__outdirectory):
                 os.makedirs(self.__outdirectory)
@@ -2,31 +2,83 @@ import argparse
 import cv2
 import json
 import os
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 import plotly.graph_objects as go
+from matplotlib.figure import Figure
 from PIL import Image
-from collections import defaultdict
-from scipy.spatial import distance
-from tqdm import tqdm
 
 import constants
 import operations
+from markupstore import MarkupStore
+from profiler import StageProfiler
 from traceplace import Traceplace
 
 
+def draw_trajectories(image, ids, points, last_points, distances):
+    '''
+    Draw steps of trajectories of humans and add their lengths. Rows may be passed by parts in order of frames
+    (e.g. frame by frame), the drawing and the lengths do not depend on the parts
+    :param image: background image to draw on (None - only lengths are counted)
+    :param ids: ids of humans of rows in order of frames
+    :param points: array N x 2 of points of bboxes of rows
+    :param last_points: dictionary {id: the last point of trajectory}, it is updated
+    :param distances: dictionary {id: covered distance in pixels}, it is updated
+    :return: image with trajectories
+    '''
+    for human_id, point in zip(np.asarray(ids).tolist(), map(tuple, np.asarray(points).tolist())):
+        human_id = int(human_id)
+        color = operations.get_color(human_id)
+        if human_id not in last_points:
+            if image is not None:
+                image = cv2.circle(image, point, radius=3, color=color, thickness=5)
+        else:
+            if image is not None:
+                image = cv2.line(image, point, last_points[human_id], color=color, thickness=2)
+            step = np.subtract(point, last_points[human_id])
+            distances[human_id] = distances.get(human_id, 0)+float(np.hypot(*step))
+        last_points[human_id] = point
+    return image
+
+
+def draw_distances_chart(distances, out_dir):
+    '''
+    Visualize lengths of trajectories as a bar chart and save it into covered_distances.png.
+    Chart is drawn without pyplot, so it may be saved by any thread (e.g. by the saver of online statistics)
+    :param distances: dictionary {id: covered distance in pixels}
+    :param out_dir: directory for saving results
+    :return: bar chart to display
+    '''
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    fig = Figure(figsize=(12, 9))
+    ax = fig.subplots()
+    fig.subplots_adjust(left=0.03, bottom=0.03, right=0.97, top=0.97)
+    ax.grid()
+    d = distances
+    ax.barh(np.arange(len(d)), list(d.values()), zorder=2)
+    ax.set_yticks(np.arange(len(d)))
+    ax.set_yticklabels(list(map(str, d.keys())))
+    ax.tick_params(labelsize=8)
+    ax.invert_yaxis()  # labels read top-to-bottom
+    ax.set_title('Covered distances by players', fontsize=8)
+    ax.set_xlabel('Pixels', fontsize=8)
+    fig.savefig(os.path.join(out_dir, 'covered_distances.png'))
+    return go.Bar(x=list(d.values()), y=list(map(str, d.keys())), orientation='h', name='',
+                  marker={'color': 'royalblue'})
+
+
 class MotionTrajectories:
 
-    def __init__(self, markup_file, out_dir, human_number=None, marker_pos='lower_center'):
-        self.__data = pd.read_csv(markup_file, names=['frame', 'id', 'bb_y', 'bb_x', 'bb_h', 'bb_w'])
+    def __init__(self, markup_file, out_dir, human_number=None, marker_pos='lower_center', profiler=None):
+        self.__profiler = profiler or StageProfiler(str(markup_file), enabled=False)
+        with self.__profiler.stage('markup_loading'):
+            store = markup_file if isinstance(markup_file, MarkupStore) else MarkupStore(markup_file)
         self.__human = human_number
-        if self.__human is not None:
-            self.__data = self.__data[self.__data['id'] == self.__human]
+        self.__data = store.chunk(store.trackIndex(self.__human) if self.__human is not None else slice(None))
         self.__outdirectory = out_dir
-        self.__background = np.asarray(Image.open(constants.BACKGROUND_READY_IMAGE))
+        self.__background = np.array(Image.open(constants.BACKGROUND_READY_IMAGE))
         self.__markerpos = Traceplace[str(marker_pos).upper()]
-        self.__distances = defaultdict(int)
+        self.__distances = dict()
 
 
     def calculateTraceStatistics(self):
@@ -34,8 +86,10 @@ class MotionTrajectories:
         Calculate statistics about trajectories of movement
         '''
         print('Calculate statistics about paths of movement...')
-        self.__drawTrajectories()
-        trajectories_imgnames = self.__saveResults()
+        with self.__profiler.stage('trajectories_drawing'):
+            self.__drawTrajectories()
+        with self.__profiler.stage('trajectories_saving'):
+            trajectories_imgnames = self.__saveResults()
         print('Success!')
         return trajectories_imgnames
 
@@ -44,40 +98,15 @@ class MotionTrajectories:
         '''
         Visualize trajectories of movement and calculate their lengths
         '''
-        prev_point = dict()
-        for _, row in tqdm(self.__data.iterrows()):
-            human_id = int(row['id'])
-            color = operations.get_color(human_id)
-            point = operations.get_point(row, self.__markerpos)
-            if int(human_id) not in prev_point.keys():
-                self.__background = cv2.circle(self.__background, point, radius=3, color=color, thickness=5)
-                prev_point[human_id] = point
-            else:
-                self.__background = cv2.line(self.__background, point, prev_point[human_id], color=color, thickness=2)
-                self.__distances[human_id] += distance.euclidean(point, prev_point[human_id])
-                prev_point[human_id] = point
+        points = operations.get_points(self.__data.bboxes, self.__markerpos)
+        self.__background = draw_trajectories(self.__background, self.__data.ids, points, dict(), self.__distances)
 
 
     def __drawBarChartDistances(self):
         '''
         Visualize lengths of trajectories as a bar chart
         '''
-        if not os.path.exists(self.__outdirectory):
-            os.makedirs(self.__outdirectory)
-        fig, ax = plt.subplots(figsize=(12, 9))
-        plt.rcParams.update({'font.size': 8})
-        plt.subplots_adjust(left=0.03, bottom=0.03, right=0.97, top=0.97)
-        plt.grid()
-        d = self.__distances
-        ax.barh(np.arange(len(d)), list(d.values()), zorder=2)
-        ax.set_yticks(np.arange(len(d)))
-        ax.set_yticklabels(list(map(str, d.keys())))
-        ax.invert_yaxis()  # labels read top-to-bottom
-        ax.set_title('Covered distances by players')
-        ax.set_xlabel('Pixels')
-        fig.savefig(os.path.join(self.__outdirectory, 'covered_distances.png'))
-        return go.Bar(x=list(d.values()), y=list(map(str, d.keys())), orientation='h', name='',
-                      marker={'color': 'royalblue'})
+        return draw_distances_chart(self.__distances, self.__outdirectory)
 
 
     def __saveResults(self):
@@ -5,18 +5,32 @@ from project Towards-Realtime-MOT (https://github.com/Zhongdao/Towards-Realtime-
 
 import os
 import logging
+import traceback
+from collections import defaultdict
 import argparse
 import cv2
-import torch
 import numpy as np
 
 import constants
 import operations
-from videodataloader import VideoDataLoader
+from binarymarkup import binary_markup_file
+from checkpoint import TrackingCheckpoint
+from detector import BatchDetector, JDEDeviceTracker, build_model, load_frames, tracker_options
+from foregrounddetector import ForegroundDetector
+from markupwriter import MarkupWriter
+from onlinestatistics import OnlineStatistics
+from profiler import SamplingProfiler, StageProfiler
+from trackingpipeline import TrackingPipeline
+from videodataloader import VideoDataLoader, frames_to_blob
+from videowriter import MarkedVideoWriter, join_videos
 
+from tracker.basetrack import BaseTrack
 from utils.log import logger
 from utils.timer import Timer
-from tracker.multitracker import JDETracker
+
+
+class TrackingCancelled(Exception):
+    pass
 
 
 class MOTTracker:
@@ -24,22 +38,82 @@ class MOTTracker:
     Shortened realization of Multi Object Tracker
     '''
 
-    def __init__(self, input_video, gpu_number):
+    def __init__(self, input_video, gpu_number, pipelined=False, queue_size=constants.PIPELINE_QUEUE_SIZE,
+                 batch_size=1, device='cuda', model_variant='float', save_frames=False,
+                 video_backend=constants.VIDEO_WRITER_BACKEND, resume=False,
+                 checkpoint_interval=constants.CHECKPOINT_FRAMES, frame_range=None, output_name=None,
+                 render_video=True, embedding_ranges=None, tracker_params=None, detection_stride=1,
+                 adaptive_stride=False, background=None, model=None, progress=None, cancel_event=None,
+                 profiler=None, online_statistics=False):
         '''
         Constructor
         :param input_video: video for tracking objects
         :param gpu_number: GPU number of videocard to launch algorithm of detection and tracking
+        :param pipelined: run decoding, preprocessing, tracking and rendering of frames in parallel threads
+        :param queue_size: maximum number of batches of frames waiting between stages of pipeline
+        :param batch_size: number of frames passed through the detector by one forward pass
+        :param device: device to launch the detector ('cuda' or 'cpu')
+        :param model_variant: variant of detector from constants.MODEL_VARIANTS
+        :param save_frames: save marked frames as images besides the marked video
+        :param video_backend: backend of writing the marked video ('ffmpeg' or 'opencv')
+        :param resume: continue tracking from the last checkpoint (if it exists)
+        :param checkpoint_interval: number of frames between checkpoints of tracking (0 - no checkpoints)
+        :param frame_range: (first frame, frame to stop at) to track only a part of video (None - whole video)
+        :param output_name: base name of files with results (None - name of video)
+        :param render_video: draw tracked objects and save the marked video
+        :param embedding_ranges: dictionary {name: (first frame, frame to stop at)} of ranges of frames, for which
+        mean embeddings of tracks are saved into <output_name>.emb.npz (None - embeddings are not saved)
+        :param tracker_params: argparse object with parameters of JDE Tracker (None - default parameters)
+        :param detection_stride: the detector is run every detection_stride frames, tracks are propagated by motion
+        model on frames between them
+        :param adaptive_stride: adapt stride of detection to motion of tracks (detection_stride is the maximum stride)
+        :param background: image of background of the court to run the detector only on regions with foreground
+        (None - the detector processes whole frames)
+        :param model: prepared detector from build_model to reuse it for many videos (None - the detector is built
+        for the video), it has to match device, model_variant and batch_size
+        :param progress: function progress(processed frames, total frames) called after each saved frame
+        :param cancel_event: threading.Event to stop tracking, when it is set
+        :param profiler: StageProfiler to measure stages of tracking (None - stages are not measured)
+        :param online_statistics: calculate heatmap, covered distances and combats frame by frame during tracking
+        and save them into the folder of statistics of video (also every constants.ONLINE_STATISTICS_SAVE_FRAMES
+        frames)
         '''
         os.makedirs(constants.RESULTS_FOLDER, exist_ok=True)
         self.__video = input_video
         self.__gpu = gpu_number
+        self.__pipelined = pipelined
+        self.__queuesize = queue_size
+        self.__batchsize = max(1, batch_size)
+        self.__device = device
+        self.__variant = model_variant
+        self.__saveframes = save_frames
+        self.__videobackend = video_backend
+        self.__resume = resume
+        self.__checkpointinterval = checkpoint_interval
+        self.__framerange = frame_range
+        self.__rendervideo = render_video
+        self.__embeddingranges = embedding_ranges or dict()
+        self.__trackerparams = tracker_params or tracker_options()
+        self.__maxstride = max(1, detection_stride)
+        self.__adaptivestride = adaptive_stride
+        self.__background = background
+        self.__model = model
+        self.__progress = progress
+        self.__cancelevent = cancel_event
+        self.__onlinestatistics = online_statistics
+        self.__statistics = None
         # Adjust names for saving information about tracking
-        basename = os.path.splitext(os.path.basename(self.__video))[0]
+        basename = output_name or os.path.splitext(os.path.basename(self.__video))[0]
         self.__markupfile = os.path.join(constants.RESULTS_FOLDER, str(basename)+'.txt')
         self.__markedvideo = os.path.join(constants.RESULTS_FOLDER, str(basename)+'.avi')
+        self.__checkpoint = TrackingCheckpoint(os.path.join(constants.RESULTS_FOLDER, str(basename)+'.ckpt'))
+        self.__embeddingsfile = os.path.join(constants.RESULTS_FOLDER, str(basename)+'.emb.npz')
         # directory for saving marked frames of video with tracking objects
         self.__framedir = os.path.join(constants.RESULTS_FOLDER, str(basename))
-        os.makedirs(self.__framedir, exist_ok=True)
+        self.__statdir = os.path.join(constants.STATISTICS_FOLDER, str(basename))
+        self.__profiler = profiler or StageProfiler(str(basename), enabled=False)
+        if self.__saveframes:
+            os.makedirs(self.__framedir, exist_ok=True)
 
 
     def __adjustTracker(self):
@@ -48,139 +122,398 @@ class MOTTracker:
         '''
         logger.setLevel(logging.INFO)
         logger.info('Loading video...')
-        self.__dataloader = VideoDataLoader(self.__video, constants.OUTPUT_FRAME_SIZE)
+        self.__dataloader = VideoDataLoader(self.__video, constants.OUTPUT_FRAME_SIZE, self.__profiler)
+        if self.__framerange is not None:
+            self.__dataloader.seek(*self.__framerange)
+            logger.info('Frames from {} to {}'.format(*self.__framerange))
         logger.info('Video was loaded!')
         self.__framerate = self.__dataloader.frame_rate
         logger.info('FPS: \t {}'.format(self.__framerate))
         logger.info('Frames: \t {}'.format(len(self.__dataloader)))
 
 
-    def __makeMarkedVideo(self):
-        '''
-        Assemble marked frames with tracking objects into one video
-        '''
-        logger.info('Making tracking video...')
-        cmd_str = 'ffmpeg -f image2 -i {}/%05d.jpg -c:v copy {}'.format(self.__framedir, self.__markedvideo)
-        os.system(cmd_str)
-        logger.info('Tracking video was made!')
-
-
     def __trackObjects(self):
         '''
         Implement tracking objects
         '''
         logger.info('Start tracking...')
+        finished = False
         try:
             self.__evalSeq()
+            finished = True
+        except TrackingCancelled:
+            logger.info('Tracking was cancelled')
         except Exception as e:
             logger.info(e)
+            logger.info(traceback.format_exc())
+        if not finished and self.__checkpoint.exists():
+            logger.info('Tracking can be continued from the last checkpoint by resuming')
         logger.info('Tracking finished!')
+        return finished
 
 
     def trackVideo(self):
         '''
         Track humans on video:
+        :return: True if all frames were tracked, False if tracking failed or was cancelled
         '''
         self.__adjustTracker()
-        self.__trackObjects()
-        self.__makeMarkedVideo()
+        return self.__trackObjects()
 
 
-    def __writeTrackingResults(self, results):
+    def __evalSeq(self):
         '''
-        Save results of tracked bboxes into file of markup
-        :param results: list, which contains information about frames, detected humans and vertices of bounding boxes
+        Track objects using JDE algorithm
         '''
-        with open(self.__markupfile, 'w') as f:
-            for frame_id, tlwhs, track_ids in results:
-                for tlwh, track_id in zip(tlwhs, track_ids):
-                    if track_id < 0:
-                        continue
-                    x1, y1, w, h = tlwh
-                    x2, y2 = x1 + w, y1 + h
-                    # frame_number, id_human, coordinates x, y of top left and bottom right corners of bbox
-                    line = '{frame},{id},{x1},{y1},{w},{h}\n'.format(frame=frame_id, id=track_id,
-                                                                     x1=x1, y1=y1, x2=x2, y2=y2, w=w, h=h)
-                    f.write(line)
-        logger.info('Results of tracking were saved to {}'.format(self.__markupfile))
+        if self.__device == 'cuda':
+            os.environ['CUDA_VISIBLE_DEVICES'] = str(self.__gpu)
+            logger.info('GPU id: \t {}'.format(self.__gpu))
+        logger.info('Model: \t {} on {}'.format(self.__variant, self.__device))
+        argument_parser = self.__trackerparams
+        frames = None
+        if self.__model is None and self.__variant in ['int8', 'traced']: # frames to calibrate or to trace model
+            frames = load_frames(self.__video, constants.CALIBRATION_FRAMES)
+        model = self.__model
+        if model is None:
+            with self.__profiler.stage('model_loading'):
+                model = build_model(argument_parser, self.__device, self.__variant, frames, self.__batchsize)
+        self.__foreground = None
+        if self.__background is not None:
+            if self.__variant == 'traced':
+                raise ValueError('Traced model accepts only whole frames, it cannot be used with background')
+            background = cv2.imread(self.__background)
+            if background is None:
+                raise ValueError('Cannot load background image {}'.format(self.__background))
+            background = frames_to_blob([self.__dataloader.prepareFrame(background)[0]])
+            self.__foreground = ForegroundDetector(model, background)
+            model = self.__foreground
+            logger.info('Detection on foreground by background {}'.format(self.__background))
+        self.__tracker = JDEDeviceTracker(argument_parser, model, frame_rate=self.__framerate)
+        self.__detector = BatchDetector(self.__tracker.model,
+                                        self.__batchsize if self.__variant == 'traced' else None, self.__profiler)
+        self.__tracker.model = self.__detector # tracker takes predictions of batch from the detector
+        self.__timer = Timer()
+        self.__embeddings = {name: defaultdict(list) for name in self.__embeddingranges}
+        self.__stride = self.__maxstride
+        self.__lastkeyframe = None # number of the last frame passed through the detector
+        self.__lastdetected = None # the last keyframe, which was tracked (keyframes of batch are chosen in advance)
+        self.__trackedframes, self.__detectedframes = 0, 0
+        start_frame = self.__framerange[0] if self.__framerange is not None else 0
+        self.__firstframe = start_frame
+        self.__totalframes = len(self.__dataloader)-start_frame
+        if self.__framerange is not None:
+            self.__totalframes = min(len(self.__dataloader), self.__framerange[1])-start_frame
+        markup_offset = None
+        self.__videoparts = [(self.__markedvideo, 0)] # parts of marked video and numbers of their first frames
+        if self.__resume and self.__checkpoint.exists():
+            start_frame, markup_offset = self.__restoreCheckpoint()
+        else:
+            self.__checkpoint.remove() # checkpoint of previous tracking does not match new results
+            # Counter of ids is global for process, ids of each video start from 1 as in a separate launch
+            BaseTrack._count = 0
+        # Results of tracking and marked frames are saved as soon as frames are processed
+        self.__markupwriter = MarkupWriter(self.__markupfile, offset=markup_offset,
+                                           flag_propagated=self.__maxstride > 1,
+                                           binary_file=binary_markup_file(self.__markupfile))
+        if self.__onlinestatistics:
+            self.__statistics = OnlineStatistics(self.__statdir, timestamps=self.__dataloader.index.timestamps,
+                                                 frame_rate=self.__framerate)
+            if markup_offset is not None: # frames tracked before resuming are taken from the kept markup
+                with self.__profiler.stage('statistics_restoring'):
+                    self.__statistics.restore(self.__markupfile)
+        self.__videowriter = None
+        if self.__rendervideo:
+            self.__videowriter = MarkedVideoWriter(self.__videoparts[-1][0], self.__framerate, self.__videobackend)
+        try:
+            self.__processFrames(start_frame)
+        finally:
+            self.__markupwriter.close()
+            logger.info('Results of tracking were saved to {}'.format(self.__markupfile))
+            if self.__videowriter is not None:
+                self.__videowriter.close()
+        if self.__statistics is not None:
+            with self.__profiler.stage('statistics_saving'):
+                self.__statistics.save(finished=True)
+            logger.info('Statistics were saved to {}'.format(self.__statdir))
+        if self.__maxstride > 1:
+            logger.info('Detector was run on {} of {} frames'.format(self.__detectedframes, self.__trackedframes))
+        if self.__foreground is not None:
+            logger.info('Detector processed {:.1%} of area of frames'.format(self.__foreground.processedShare()))
+        if self.__rendervideo:
+            if len(self.__videoparts) > 1:
+                join_videos(self.__videoparts, self.__framerate, self.__markedvideo)
+            logger.info('Tracking video was saved to {}'.format(self.__markedvideo))
+        if self.__embeddingranges:
+            self.__saveEmbeddings()
+        self.__checkpoint.remove() # tracking is finished, there is nothing to resume
+        if self.__profiler.enabled:
+            self.__profiler.log()
 
 
-    def __collectArgumentParserParams(self):
+    def trackingStatistics(self):
         '''
-        Collect parameters for JDE Tracker as a collected argparse object
-        :return: argparse object with parameters
+        :return: dictionary with numbers of tracked frames, frames passed through the detector and time of tracking
         '''
-        parser.add_argument('--cfg', type=str, default=constants.TRACKER_CONFIG)
-        parser.add_argument('--weights', type=str, default=constants.TRACKER_WEIGHTS)
-        parser.add_argument('--img-size', type=int, default=constants.OUTPUT_FRAME_SIZE)
-        parser.add_argument('--iou-thres', type=float, default=constants.IOU_THRESHOLD)
-        parser.add_argument('--conf-thres', type=float, default=constants.CONFIDENCE_THRESHOLD)
-        parser.add_argument('--nms-thres', type=float, default=constants.SUPPRESSION_THRESHOLD)
-        parser.add_argument('--track-buffer', type=int, default=constants.TRACKING_BUFFER)
-        res = parser.parse_args()
-        return res
+        return {'frames': self.__trackedframes, 'detected_frames': self.__detectedframes,
+                'tracking_time': self.__timer.total_time}
 
 
-    def __evalSeq(self):
+    def onlineStatistics(self):
         '''
-        Track objects using JDE algorithm
+        :return: statistics calculated during tracking (OnlineStatistics), they may be taken while tracking is running
+        (None - online statistics are off or tracking is not started)
+        '''
+        return self.__statistics
+
+
+    def __isKeyframe(self, frame_id):
+        '''
+        Check if the frame should be passed through the detector
+        '''
+        if self.__lastkeyframe is not None and frame_id-self.__lastkeyframe < self.__stride:
+            return False
+        self.__lastkeyframe = frame_id
+        return True
+
+
+    def __adaptStride(self):
+        '''
+        Choose stride of detection, so tracks move not more than constants.STRIDE_MOTION_TOLERANCE of their heights
+        between detections
+        '''
+        motion = self.__tracker.motion()
+        if motion is None: # new humans are expected to appear
+            self.__stride = 1
+        elif motion > 0:
+            self.__stride = int(np.clip(constants.STRIDE_MOTION_TOLERANCE/motion, 1, self.__maxstride))
+        else:
+            self.__stride = self.__maxstride
+
+
+    def __collectEmbeddings(self, position, online_targets):
+        '''
+        Collect embeddings of tracks on the frame for ranges of frames, where they are needed
+        '''
+        for name, (start, end) in self.__embeddingranges.items():
+            if start <= position < end:
+                for t in online_targets:
+                    self.__embeddings[name][t.track_id].append(t.smooth_feat)
+
+
+    def __saveEmbeddings(self):
+        '''
+        Save mean embeddings of tracks for each range of frames
+        '''
+        arrays = dict()
+        for name, embeddings in self.__embeddings.items():
+            ids = sorted(embeddings.keys())
+            features = [np.mean(embeddings[track_id], axis=0) for track_id in ids]
+            arrays[name+'_ids'] = np.array(ids, dtype=np.int64)
+            arrays[name+'_features'] = np.array(features, dtype=np.float32).reshape(len(ids), -1)
+        np.savez(self.__embeddingsfile, **arrays)
+        logger.info('Embeddings of tracks were saved to {}'.format(self.__embeddingsfile))
+
+
+    def __restoreCheckpoint(self):
+        '''
+        Restore the state of tracking from the last checkpoint
+        :return: number of frame to continue tracking from and size of markup to keep
+        '''
+        state = self.__checkpoint.load()
+        TrackingCheckpoint.restore(self.__tracker, state['snapshot'])
+        self.__dataloader.seek(state['position'])
+        # Marked video is continued in a new part, parts are joined at the end of tracking
+        basename, ext = os.path.splitext(self.__markedvideo)
+        self.__videoparts = state['video_parts']+[('{}.part{}{}'.format(basename, len(state['video_parts']), ext),
+                                                   state['frame_id'])]
+        if state.get('stride') is not None: # keyframes continue as without interruption
+            self.__stride = state['stride']['stride']
+            self.__lastkeyframe = self.__lastdetected = state['stride']['last_keyframe']
+        logger.info('Tracking is resumed from frame {}'.format(state['frame_id']))
+        return state['frame_id'], state['markup_size']
+
+
+    def __saveCheckpoint(self, frame_id, checkpoint):
+        '''
+        Save checkpoint of tracking after the frame was tracked and its results were saved
+        :param frame_id: number of frame
+        :param checkpoint: position of the frame in video, serialized state of tracker and state of stride of detection
+        after the frame
+        '''
+        position, snapshot, stride = checkpoint
+        self.__checkpoint.save(frame_id+1, position+1, snapshot, self.__markupwriter.size(), self.__videoparts,
+                               stride)
+
+
+    def __processFrames(self, start_frame=0):
+        '''
+        Track objects and draw them on all frames of video
+        :param start_frame: number of the first frame
+        '''
+        if self.__pipelined:
+            pipeline = TrackingPipeline(self.__dataloader, self.__trackFrames, self.__renderFrame, self.__queuesize,
+                                        self.__batchsize, start_frame, self.__profiler)
+            pipeline.run()
+        else:
+            frame_id, frames = start_frame, []
+            for position, img, img0 in self.__dataloader:
+                frames.append((position, img, img0))
+                if len(frames) == self.__batchsize:
+                    self.__trackAndRender(frame_id, frames)
+                    frame_id += len(frames)
+                    frames = []
+            if frames:
+                self.__trackAndRender(frame_id, frames)
+
+
+    def __trackAndRender(self, frame_id, frames):
+        '''
+        Track objects on the batch of frames and draw them
+        '''
+        for i, result in enumerate(self.__trackFrames(frame_id, frames)):
+            self.__renderFrame(frame_id+i, frames[i][2], result)
+
+
+    def __trackFrames(self, frame_id, frames):
+        '''
+        Track objects on the batch of frames of video
+        :param frame_id: number of the first frame in batch
+        :param frames: list of (position of frame in video, preprocessed frame for the detector, frame for drawing)
+        :return: list of results of tracking for each frame
+        '''
+        if self.__cancelevent is not None and self.__cancelevent.is_set():
+            raise TrackingCancelled()
+        if (-frame_id) % 20 < len(frames): # batch contains a frame with a number multiple of 20
+            logger.info('Processing frame {} ({:.2f} fps)'.format(
+                frame_id, self.__batchsize/max(1e-5, self.__timer.average_time)))
+        # Run tracking
+        self.__timer.tic()
+        keyframes = [self.__isKeyframe(frame_id+i) for i in range(len(frames))]
+        blob = None
+        if any(keyframes):
+            with self.__profiler.stage('upload', frames=sum(keyframes)):
+                blob = frames_to_blob([img for (_, img, _), key in zip(frames, keyframes) if key], self.__device)
+            if self.__batchsize > 1:
+                self.__detector.detectBatch(blob) # detections of all keyframes by one forward pass
+        results, k = [], 0
+        for i, (position, _, img0) in enumerate(frames):
+            if keyframes[i]:
+                results.append(self.__trackFrame(frame_id+i, position, blob[k:k+1], img0))
+                k += 1
+            else:
+                results.append(self.__propagateFrame(frame_id+i, position))
+        self.__timer.toc()
+        return results
+
+
+    def __trackFrame(self, frame_id, position, blob, img0):
+        '''
+        Track objects on the frame of video
+        :param frame_id: number of frame
+        :param position: position of frame in video
+        :param blob: preprocessed frame for the detector as a tensor 1 x C x H x W
+        :param img0: frame for drawing
+        :return: position of frame in video, bboxes (top left corner, width, height), ids of tracked objects,
+        flag of propagated bboxes and state of tracker for checkpoint (None if checkpoint is not needed after the frame)
         '''
-        os.environ['CUDA_VISIBLE_DEVICES'] = str(self.__gpu)
-        logger.info('GPU id: \t {}'.format(self.__gpu))
-        argument_parser = self.__collectArgumentParserParams()
-        tracker = JDETracker(argument_parser, frame_rate=self.__framerate)
-        timer = Timer()
-        results = []
-        frame_id = 0
-        for path, img, img0 in self.__dataloader:
-            if frame_id % 20 == 0:
-                logger.info('Processing frame {} ({:.2f} fps)'.format(frame_id, 1./max(1e-5, timer.average_time)))
-            # Run tracking
-            timer.tic()
-            blob = torch.from_numpy(img).cuda().unsqueeze(0)
-            online_targets = tracker.update(blob, img0)
-            online_tlwhs, online_ids = [], []
-            for t in online_targets:
-                tlwh, tid = t.tlwh, t.track_id
-                if (tlwh[2]*tlwh[3] > constants.MIN_BOX_AREA) and (tlwh[2] / tlwh[3] <= 1.6):
-                    online_tlwhs.append(tlwh)
-                    online_ids.append(tid)
-            timer.toc()
-            # Save results
-            results.append((frame_id, online_tlwhs, online_ids))
-            online_img = self.__plotTracking(img0, online_tlwhs, online_ids, frame_id=frame_id)
-            cv2.imwrite(os.path.join(self.__framedir, '{:05d}.jpg'.format(frame_id)), online_img) # save marked frame
-            frame_id += 1
-        self.__writeTrackingResults(results)
-
-
-    def __plotTracking(self, img, tlwhs, obj_ids, frame_id=0, ids2=None):
-        '''
-        Plot tracked bboxes for the frame of video
-        :param img: frame of video
-        :return: frame with tracked bounding boxes
-        '''
-        img = np.ascontiguousarray(np.copy(img))
-        text_scale = max(1, img.shape[1]/1500.0)
-        text_thickness = 1 if text_scale > 1.1 else 1
-        line_thickness = max(1, int(img.shape[1]/500.0))
-        # Draw information about the number of frame and an amount of detected humans
-        cv2.putText(img, 'frame: {}   humans: {}'.format(frame_id, len(tlwhs)), (0, int(15*text_scale)),
-                    cv2.FONT_HERSHEY_PLAIN, text_scale, color=(0, 0, 255), thickness=2)
-        # Draw bboxes
-        for i, tlwh in enumerate(tlwhs):
-            x1, y1, w, h = tlwh
-            bbox = tuple(map(int, (x1, y1, x1+w, y1+h)))
-            obj_id = int(obj_ids[i])
-            id_text = '{}'.format(int(obj_id))
-            if ids2 is not None:
-                id_text = id_text + ', {}'.format(int(ids2[i]))
-            # Draw rectangle of bbox
-            cv2.rectangle(img, bbox[0:2], bbox[2:4], color=operations.get_color(abs(obj_id)), thickness=line_thickness)
-            # Draw id of detected human
-            cv2.putText(img, id_text, (bbox[0], bbox[1]+30), cv2.FONT_HERSHEY_PLAIN, text_scale,
-                        color=(0, 0, 255), thickness=text_thickness)
-        return img
+        with self.__profiler.stage('association', frames=1): # forward pass of single frame is measured apart
+            online_targets = self.__tracker.update(blob, img0)
+        self.__detectedframes += 1
+        self.__lastdetected = frame_id
+        if self.__adaptivestride:
+            self.__adaptStride()
+        return self.__collectResults(frame_id, position, online_targets, False)
+
+
+    def __propagateFrame(self, frame_id, position):
+        '''
+        Move tracked objects by motion model on the frame of video without detection
+        :return: results of tracking as in __trackFrame
+        '''
+        with self.__profiler.stage('propagation', frames=1):
+            online_targets = self.__tracker.propagate()
+        return self.__collectResults(frame_id, position, online_targets, True)
+
+
+    def __collectResults(self, frame_id, position, online_targets, propagated):
+        '''
+        Filter tracked objects on the frame and take the state of tracker for checkpoint
+        :return: results of tracking as in __trackFrame
+        '''
+        self.__trackedframes += 1
+        online_tlwhs, online_ids = [], []
+        for t in online_targets:
+            tlwh, tid = t.tlwh, t.track_id
+            if (tlwh[2]*tlwh[3] > constants.MIN_BOX_AREA) and (tlwh[2] / tlwh[3] <= 1.6):
+                online_tlwhs.append(tlwh)
+                online_ids.append(tid)
+        if self.__embeddingranges:
+            self.__collectEmbeddings(position, [t for t in online_targets if t.track_id in online_ids])
+        checkpoint = None
+        if self.__checkpointinterval > 0 and (frame_id+1) % self.__checkpointinterval == 0:
+            # State is taken right now, but saved after the frame is rendered
+            checkpoint = (position, TrackingCheckpoint.snapshot(self.__tracker),
+                          {'stride': self.__stride, 'last_keyframe': self.__lastdetected})
+        return position, online_tlwhs, online_ids, propagated, checkpoint
+
+
+    def __renderFrame(self, frame_id, img0, result):
+        '''
+        Save results of tracking for the frame of video, draw tracked objects on it and save it.
+        Markup is numbered by positions of frames in video, so it is aligned with timestamps of video
+        even if broken frames were skipped
+        '''
+        position, online_tlwhs, online_ids, propagated, checkpoint = result
+        with self.__profiler.stage('markup', frames=1):
+            self.__markupwriter.write(position, online_tlwhs, online_ids, propagated)
+        if self.__statistics is not None:
+            with self.__profiler.stage('statistics', frames=1):
+                self.__statistics.addFrame(position, online_tlwhs, online_ids)
+            if (frame_id+1) % constants.ONLINE_STATISTICS_SAVE_FRAMES == 0:
+                with self.__profiler.stage('statistics_saving'):
+                    self.__statistics.save()
+        if self.__rendervideo:
+            with self.__profiler.stage('drawing', frames=1):
+                online_img = plot_tracking(img0, online_tlwhs, online_ids, frame_id=position)
+            with self.__profiler.stage('encoding', frames=1):
+                self.__videowriter.write(online_img)
+            if self.__saveframes:
+                with self.__profiler.stage('jpeg', frames=1):
+                    cv2.imwrite(os.path.join(self.__framedir, '{:05d}.jpg'.format(position)), online_img) # save frame
+        if checkpoint is not None:
+            with self.__profiler.stage('checkpoint'):
+                self.__saveCheckpoint(frame_id, checkpoint)
+        if self.__progress is not None:
+            self.__progress(position+1-self.__firstframe, self.__totalframes)
+
+
+def plot_tracking(img, tlwhs, obj_ids, frame_id=0, ids2=None):
+    '''
+    Plot tracked bboxes for the frame of video
+    :param img: frame of video
+    :return: frame with tracked bounding boxes
+    '''
+    img = np.ascontiguousarray(np.copy(img))
+    text_scale = max(1, img.shape[1]/1500.0)
+    text_thickness = 1 if text_scale > 1.1 else 1
+    line_thickness = max(1, int(img.shape[1]/500.0))
+    # Draw information about the number of frame and an amount of detected humans
+    cv2.putText(img, 'frame: {}   humans: {}'.format(frame_id, len(tlwhs)), (0, int(15*text_scale)),
+                cv2.FONT_HERSHEY_PLAIN, text_scale, color=(0, 0, 255), thickness=2)
+    # Draw bboxes
+    for i, tlwh in enumerate(tlwhs):
+        x1, y1, w, h = tlwh
+        bbox = tuple(map(int, (x1, y1, x1+w, y1+h)))
+        obj_id = int(obj_ids[i])
+        id_text = '{}'.format(int(obj_id))
+        if ids2 is not None:
+            id_text = id_text + ', {}'.format(int(ids2[i]))
+        # Draw rectangle of bbox
+        cv2.rectangle(img, bbox[0:2], bbox[2:4], color=operations.get_color(abs(obj_id)), thickness=line_thickness)
+        # Draw id of detected human
+        cv2.putText(img, id_text, (bbox[0], bbox[1]+30), cv2.FONT_HERSHEY_PLAIN, text_scale,
+                    color=(0, 0, 255), thickness=text_thickness)
+    return img
 
 
 def init_argparse():
@@ -200,6 +533,93 @@ def init_argparse():
         help='Number of GPU to implement tracking',
         default=constants.GPU_NUMBER,
         type=int)
+    parser.add_argument(
+        '--pipeline',
+        help='Run decoding, preprocessing, tracking and rendering of frames in parallel threads',
+        action='store_true')
+    parser.add_argument(
+        '--queue_size',
+        nargs='?',
+        help='Maximum number of frames waiting between stages of pipeline',
+        default=constants.PIPELINE_QUEUE_SIZE,
+        type=int)
+    parser.add_argument(
+        '--batch_size',
+        nargs='?',
+        help='Number of frames passed through the detector by one forward pass',
+        default=1,
+        type=int)
+    parser.add_argument(
+        '--device',
+        nargs='?',
+        help='Device to launch the detector',
+        choices=constants.DEVICES,
+        default='cuda',
+        type=str)
+    parser.add_argument(
+        '--model_variant',
+        nargs='?',
+        help='Variant of the detector: float, static int8 quantized (CPU only), traced by TorchScript',
+        choices=constants.MODEL_VARIANTS,
+        default='float',
+        type=str)
+    parser.add_argument(
+        '--save_frames',
+        help='Save marked frames as images besides the marked video',
+        action='store_true')
+    parser.add_argument(
+        '--video_backend',
+        nargs='?',
+        help='Backend of writing the marked video',
+        choices=constants.VIDEO_WRITER_BACKENDS,
+        default=constants.VIDEO_WRITER_BACKEND,
+        type=str)
+    parser.add_argument(
+        '--resume',
+        help='Continue tracking from the last checkpoint',
+        action='store_true')
+    parser.add_argument(
+        '--checkpoint_interval',
+        nargs='?',
+        help='Number of frames between checkpoints of tracking (0 - no checkpoints)',
+        default=constants.CHECKPOINT_FRAMES,
+        type=int)
+    parser.add_argument(
+        '--detection_stride',
+        nargs='?',
+        help='Run the detector every detection_stride frames, tracks are propagated by motion model between them',
+        default=1,
+        type=int)
+    parser.add_argument(
+        '--adaptive_stride',
+        help='Adapt stride of detection to motion of humans (--detection_stride is the maximum stride)',
+        action='store_true')
+    parser.add_argument(
+        '--background',
+        nargs='?',
+        help='Image of background of the court (from background_extraction.py) to detect only on foreground',
+        default=None,
+        type=str)
+    parser.add_argument(
+        '--online_statistics',
+        help='Calculate heatmap, covered distances and combats during tracking into statistics/<video name>',
+        action='store_true')
+    parser.add_argument(
+        '--profile',
+        help='Measure stages of tracking and save report into results/<video name>.profile.json and .prom',
+        action='store_true')
+    parser.add_argument(
+        '--sampling_profile',
+        help='Record the flame graph of tracking by py-spy into results/<video name>.profile.svg',
+        action='store_true')
+    # Parameters of JDE Tracker
+    parser.add_argument('--cfg', type=str, default=constants.TRACKER_CONFIG)
+    parser.add_argument('--weights', type=str, default=constants.TRACKER_WEIGHTS)
+    parser.add_argument('--img-size', type=int, default=constants.OUTPUT_FRAME_SIZE)
+    parser.add_argument('--iou-thres', type=float, default=constants.IOU_THRESHOLD)
+    parser.add_argument('--conf-thres', type=float, default=constants.CONFIDENCE_THRESHOLD)
+    parser.add_argument('--nms-thres', type=float, default=constants.SUPPRESSION_THRESHOLD)
+    parser.add_argument('--track-buffer', type=int, default=constants.TRACKING_BUFFER)
     return parser
 
 
@@ -207,6 +627,22 @@ if __name__ == '__main__':
     parser = init_argparse()
     # Extract arguments of script
     args = parser.parse_args()
+    basename = os.path.join(constants.RESULTS_FOLDER, os.path.splitext(os.path.basename(args.input_video))[0])
+    profiler = StageProfiler(os.path.basename(basename), enabled=args.profile)
     # Launch tracker
-    jde = MOTTracker(args.input_video, args.gpu)
-    jde.trackVideo()
\ No newline at end of file
+    jde = MOTTracker(args.input_video, args.gpu, pipelined=args.pipeline, queue_size=args.queue_size,
+                     batch_size=args.batch_size, device=args.device, model_variant=args.model_variant,
+                     save_frames=args.save_frames, video_backend=args.video_backend, resume=args.resume,
+                     checkpoint_interval=args.checkpoint_interval, detection_stride=args.detection_stride,
+                     adaptive_stride=args.adaptive_stride, background=args.background,
+                     tracker_params=tracker_options(cfg=args.cfg, weights=args.weights, img_size=args.img_size,
+                                                    iou_thres=args.iou_thres, conf_thres=args.conf_thres,
+                                                    nms_thres=args.nms_thres, track_buffer=args.track_buffer),
+                     profiler=profiler, online_statistics=args.online_statistics)
+    if args.sampling_profile:
+        with SamplingProfiler(basename+'.profile.svg'):
+            jde.trackVideo()
+    else:
+        jde.trackVideo()
+    if args.profile:
+        logger.info('Profile was saved to {} and {}'.format(*profiler.save(basename)))
\ No newline at end of file
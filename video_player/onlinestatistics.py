@@ -0,0 +1,256 @@
+'''
+Statistics calculated online by tracker. Results of each tracked frame update the density of points, trajectories,
+covered distances and states of pairs of players, so work per frame is proportional to the number of its bboxes.
+Statistics are ready as soon as tracking is finished and can be saved at any moment of long or live runs
+without the second pass over markup. Saving does not stall tracking: the state is copied and files are written
+by a background thread. They are saved as the same files as statistics calculated by markup,
+so batchtracking.py and the dialog of statistics take them instead of calculating them again
+'''
+
+import json
+import os
+import threading
+import numpy as np
+from PIL import Image
+
+import constants
+import operations
+from combatevents import CombatEvents
+from combatscounter import draw_combats_matrix
+from combatsengine import CombatsEngine, code_pairs
+from heatmapper import Heatmapper
+from markupaggregates import DensityAggregate, iter_markup_chunks
+from markupstore import MarkupChunk
+from motiontrajectories import draw_distances_chart, draw_trajectories
+from traceplace import Traceplace
+
+
+# Files of statistics of all humans saved by OnlineStatistics (heatmap and trajectories need a background image)
+ONLINE_STATISTICS_FILES = ['heatmap.png', 'trajectories.png', 'covered_distances.png', 'covered_distances.json',
+                           'combats_matrix.png', 'combats.json', 'combat_events.csv']
+ONLINE_STATISTICS_STATE = 'online_statistics.json' # the last added frame and flag of finished tracking
+
+
+def statistics_folder(markup_file):
+    '''
+    :return: folder of statistics of video with the markup, where tracker saves online statistics
+    '''
+    return os.path.join(constants.STATISTICS_FOLDER, os.path.splitext(os.path.basename(markup_file))[0])
+
+
+def saved_statistics(markup_file):
+    '''
+    :param markup_file: text markup file
+    :return: folder with online statistics of the whole markup (None if tracking is not finished, statistics are
+    missing or older than markup)
+    '''
+    folder = statistics_folder(markup_file)
+    state_file = os.path.join(folder, ONLINE_STATISTICS_STATE)
+    if not os.path.isfile(state_file) or os.path.getmtime(state_file) < os.path.getmtime(markup_file):
+        return None
+    with open(state_file) as f:
+        if not json.load(f).get('finished'):
+            return None
+    if not all(os.path.isfile(os.path.join(folder, name)) for name in ONLINE_STATISTICS_FILES):
+        return None
+    return folder
+
+
+class OnlineStatistics:
+    '''
+    Implement heatmap, covered distances and combats updated frame by frame in order of video.
+    Frames are added by the thread of tracking, statistics may be saved or taken by other threads at the same time.
+    Files are written by one saver thread, only the latest requested state is saved, if saving takes longer
+    than the interval between requests
+    '''
+
+    def __init__(self, out_dir, marker_pos=Traceplace.LOWER_CENTER, frame_size=constants.OUTPUT_FRAME_SIZE,
+                 start_frame=1, timestamps=None, frame_rate=None):
+        '''
+        Constructor
+        :param out_dir: directory for saving results
+        :param marker_pos: marker of location of key points on bboxes to build heatmap and measure distances
+        :param frame_size: (width, height) of frames of markup, if there is no background image
+        :param start_frame: the first frame to count combats (CombatsCounter starts from frame 1)
+        :param timestamps: timestamps of frames of video in milliseconds for the log of combats
+        :param frame_rate: FPS of video for the log of combats, if timestamps are not known
+        '''
+        self.__outdirectory = out_dir
+        self.__heatmapper = Heatmapper()
+        self.__background = None
+        self.__trajectories = None # trajectories are drawn on background frame by frame
+        if os.path.isfile(constants.BACKGROUND_READY_IMAGE):
+            self.__background = Image.open(constants.BACKGROUND_READY_IMAGE)
+            self.__trajectories = np.array(self.__background)
+        width, height = self.__background.size if self.__background is not None else frame_size
+        self.__markerpos = marker_pos
+        self.__density = DensityAggregate(width, height, marker_pos, self.__heatmapper.point_diameter)
+        self.__lastpoints = dict() # id: the last point of trajectory (ids go in order of their appearance)
+        self.__distances = dict() # id: covered distance in pixels
+        self.__engine = CombatsEngine()
+        self.__startframe = start_frame
+        self.__timestamps = timestamps
+        self.__framerate = frame_rate
+        self.__lock = threading.Lock()
+        self.last_frame = None # the last added frame
+        self.__savelock = threading.Lock()
+        self.__pending = None # state waiting for the saver thread
+        self.__saver = None # saver thread (None - nothing to save)
+        self.__saveerror = None # error of the last saving
+
+
+    def addFrame(self, frame_id, tlwhs, track_ids):
+        '''
+        Add results of tracking of the frame
+        :param frame_id: number of frame (as in markup)
+        :param tlwhs: bboxes (top left corner, width, height)
+        :param track_ids: ids of tracked humans (bboxes with negative ids are skipped as by MarkupWriter)
+        '''
+        ids = np.asarray(track_ids, dtype=np.int64).reshape(-1)
+        bboxes = np.asarray(tlwhs, dtype=np.float64).reshape(-1, 4)
+        valid = ids >= 0
+        self.update(MarkupChunk(np.full(int(valid.sum()), frame_id, dtype=np.int64), ids[valid], bboxes[valid]),
+                    frame_id)
+
+
+    def update(self, chunk, last_frame=None):
+        '''
+        Add rows of frames following the added ones (e.g. markup saved before tracking was resumed)
+        :param chunk: MarkupChunk with rows sorted by frames
+        :param last_frame: the last frame of chunk (None - frame of the last row)
+        '''
+        frames = chunk.frames
+        borders = np.flatnonzero(frames[1:] != frames[:-1])+1
+        with self.__lock:
+            self.__density.update(chunk)
+            self.__trajectories = draw_trajectories(self.__trajectories, chunk.ids,
+                                                    operations.get_points(chunk.bboxes, self.__markerpos),
+                                                    self.__lastpoints, self.__distances)
+            for start, end in zip(np.concatenate([[0], borders]), np.append(borders, len(frames))):
+                if end-start > 1 and frames[start] >= self.__startframe:
+                    self.__engine.addFrame(int(frames[start]), chunk.ids[start:end], chunk.bboxes[start:end])
+            if last_frame is None and len(frames):
+                last_frame = int(frames[-1])
+            if last_frame is not None:
+                self.last_frame = last_frame
+
+
+    def restore(self, markup_file):
+        '''
+        Add all rows of markup file (tracking is resumed after them)
+        '''
+        for chunk in iter_markup_chunks(markup_file):
+            self.update(chunk)
+
+
+    def density(self):
+        '''
+        :return: numbers of points in pixels of background with margins (DensityAggregate.density)
+        '''
+        with self.__lock:
+            return self.__density.density.copy()
+
+
+    def distances(self):
+        '''
+        :return: covered distances of humans in pixels {id: distance}
+        '''
+        with self.__lock:
+            return dict(self.__distances)
+
+
+    def combats(self):
+        '''
+        :return: numbers of combats of pairs of humans {(id1, id2): number of combats}
+        '''
+        with self.__lock:
+            codes, counts = self.__engine.counts()
+        return dict(zip(zip(*[v.tolist() for v in code_pairs(codes)]), counts.tolist()))
+
+
+    def combatEvents(self):
+        '''
+        :return: log of combats (CombatEvents), combats in progress last till their last intersection
+        '''
+        with self.__lock:
+            events = self.__engine.events()
+        return CombatEvents(*events, timestamps=self.__timestamps, frame_rate=self.__framerate)
+
+
+    def save(self, finished=False):
+        '''
+        Save statistics of all humans into the directory of results as MotionHeatmap, MotionTrajectories and
+        CombatsCounter do (heatmap and trajectories - if there is a background image), and also covered distances
+        and combats as json-files. State of statistics is taken at once, files are written by the saver thread
+        :param finished: all frames were added (statistics of unfinished tracking are not taken instead of
+        statistics calculated by markup), saving is waited for
+        '''
+        with self.__lock:
+            state = {'density': self.__density.density.copy(), 'ids': list(self.__lastpoints),
+                     'trajectories': self.__trajectories.copy() if self.__trajectories is not None else None,
+                     'distances': dict(self.__distances), 'last_frame': self.last_frame, 'finished': finished}
+            codes, counts = self.__engine.counts()
+            events = self.__engine.events()
+        state['combats'] = dict(zip(zip(*[v.tolist() for v in code_pairs(codes)]), counts.tolist()))
+        state['events'] = CombatEvents(*events, timestamps=self.__timestamps, frame_rate=self.__framerate)
+        with self.__savelock:
+            self.__pending = state # previous state, which is not saved yet, is replaced
+            if self.__saver is None:
+                self.__saver = threading.Thread(target=self.__saveStates, daemon=True)
+                self.__saver.start()
+        if finished:
+            self.wait()
+
+
+    def wait(self):
+        '''
+        Wait till requested states are saved
+        :raise: error of saving
+        '''
+        with self.__savelock:
+            saver = self.__saver
+        if saver is not None:
+            saver.join()
+        with self.__savelock:
+            error, self.__saveerror = self.__saveerror, None
+        if error is not None:
+            raise error
+
+
+    def __saveStates(self):
+        '''
+        Save requested states till there is nothing to save (launched in the saver thread)
+        '''
+        while True:
+            with self.__savelock:
+                state, self.__pending = self.__pending, None
+                if state is None:
+                    self.__saver = None
+                    return
+            try:
+                self.__write(state)
+                error = None
+            except Exception as e: # error is raised by waiting for saving
+                error = e
+            with self.__savelock:
+                self.__saveerror = error
+
+
+    def __write(self, state):
+        '''
+        Write files of the state of statistics
+        '''
+        os.makedirs(self.__outdirectory, exist_ok=True)
+        if self.__background is not None:
+            heatmap = self.__heatmapper.buildHeatmapFromDensity(state['density'], self.__background)
+            heatmap.save(os.path.join(self.__outdirectory, 'heatmap.png'))
+            Image.fromarray(state['trajectories']).save(os.path.join(self.__outdirectory, 'trajectories.png'))
+        draw_distances_chart(state['distances'], self.__outdirectory)
+        with open(os.path.join(self.__outdirectory, 'covered_distances.json'), 'w') as f:
+            json.dump(state['distances'], f)
+        draw_combats_matrix(state['combats'], state['ids'], self.__outdirectory)
+        with open(os.path.join(self.__outdirectory, 'combats.json'), 'w') as f:
+            json.dump({'{}-{}'.format(*pair): count for pair, count in state['combats'].items()}, f)
+        state['events'].save(os.path.join(self.__outdirectory, 'combat_events.csv'))
+        with open(os.path.join(self.__outdirectory, ONLINE_STATISTICS_STATE), 'w') as f:
+            json.dump({'last_frame': state['last_frame'], 'finished': state['finished']}, f)
@@ -1,6 +1,40 @@
+import os
+import numpy as np
+import pandas as pd
+
+from binarymarkup import BinaryMarkup, find_binary_markup
 from traceplace import Traceplace
 
 
+# Columns of markup: frame, id, coordinates x, y of top left corner, width and height of bbox
+MARKUP_COLUMNS = ['frame', 'id', 'bb_y', 'bb_x', 'bb_h', 'bb_w']
+
+
+def read_markup(markup_file, propagated=False):
+    '''
+    Read markup of tracked humans. Binary markup next to the text file is loaded instead of parsing of text,
+    if it was built from the text file in its current state (see find_binary_markup)
+    :param markup_file: file with rows of bboxes (the optional last column flags bboxes propagated without detection)
+    or binary markup file
+    :param propagated: keep column 'propagated' with flags of bboxes (0 for markup without flags)
+    :return: dataframe with markup
+    '''
+    names = MARKUP_COLUMNS+['propagated']
+    binary_file = find_binary_markup(markup_file)
+    if binary_file is not None:
+        markup = BinaryMarkup(binary_file)
+        data = pd.DataFrame(dict(zip(names, [markup.frame, markup.id, markup.x, markup.y, markup.w, markup.h,
+                                             markup.propagated])))
+    elif os.path.getsize(markup_file) == 0:
+        data = pd.DataFrame(columns=names)
+    else:
+        data = pd.read_csv(markup_file, names=names)
+    if not propagated:
+        return data[MARKUP_COLUMNS]
+    data['propagated'] = data['propagated'].fillna(0).astype(int)
+    return data
+
+
 def time_string(ms):
     '''
     Milliseconds -> string, MM:SS (minutes:seconds)
@@ -52,6 +86,58 @@ def get_point(row_dataframe, marker_pos):
                 int((row_dataframe['bb_x'] + row_dataframe['bb_w']) / 2.0))
 
 
+def get_points(bboxes, marker_pos):
+    '''
+    Get points of many bboxes according to marker (vectorized get_point)
+    :param bboxes: array N x 4 with columns bb_y, bb_x, bb_h, bb_w
+    :param marker_pos: marker (strategy of point choice on bbox)
+    :return: array N x 2 of points of bboxes
+    '''
+    bb_y, bb_x, bb_h, bb_w = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4).T
+    if marker_pos in [Traceplace.LOWER_LEFT, Traceplace.UPPER_LEFT]:
+        x = bb_y
+    elif marker_pos in [Traceplace.LOWER_CENTER, Traceplace.UPPER_CENTER]:
+        x = bb_y + bb_h / 2.0
+    elif marker_pos in [Traceplace.LOWER_RIGHT, Traceplace.UPPER_RIGHT]:
+        x = bb_y + bb_h
+    else:
+        x = (bb_y + bb_h) / 2.0
+    if marker_pos in [Traceplace.LOWER_LEFT, Traceplace.LOWER_CENTER, Traceplace.LOWER_RIGHT]:
+        y = bb_x + bb_w
+    elif marker_pos in [Traceplace.UPPER_LEFT, Traceplace.UPPER_CENTER, Traceplace.UPPER_RIGHT]:
+        y = bb_x
+    else:
+        y = (bb_x + bb_w) / 2.0
+    return np.stack([x, y], axis=1).astype(np.int64) # truncation as by int()
+
+
+def bboxes_intersected(cur_bboxes, other_bboxes):
+    '''
+    Check intersections of pairs of bboxes (vectorized is_bbox_intersected)
+    :param cur_bboxes: array ... x 4 with columns bb_y, bb_x, bb_h, bb_w
+    :param other_bboxes: array of bboxes broadcastable with cur_bboxes
+    :return: boolean array, element is equal to is_bbox_intersected(cur_bbox, other_bbox)
+    '''
+    cur, other = np.asarray(cur_bboxes, dtype=np.float64), np.asarray(other_bboxes, dtype=np.float64)
+
+    def inside(k): # start or end of other bboxes within bounds of current ones along coordinate k
+        start, end = cur[..., k], cur[..., k] + cur[..., k+2]
+        values = [other[..., k], other[..., k] + other[..., k+2]]
+        return ((values[0] > start) & (values[0] < end)) | ((values[1] > start) & (values[1] < end))
+
+    return inside(0) & inside(1)
+
+
+def intersection_matrix(bboxes):
+    '''
+    Check intersections of all pairs of bboxes (vectorized is_bbox_intersected)
+    :param bboxes: array N x 4 with columns bb_y, bb_x, bb_h, bb_w
+    :return: boolean matrix N x N, element [i, j] is equal to is_bbox_intersected(bboxes[i], bboxes[j])
+    '''
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    return bboxes_intersected(bboxes[:, None, :], bboxes[None, :, :])
+
+
 def is_bbox_intersected(cur_bbox, other_bbox):
     '''
     Check if bboxes are intersect
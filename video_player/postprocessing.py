@@ -1,11 +1,13 @@
 import argparse
 import cv2
 import os
+import shutil
 import numpy as np
-import pandas as pd
 from tqdm import tqdm
 from collections import defaultdict
 
+from markupstore import MarkupStore
+
 
 def get_color(idx):
     idx = idx*3
@@ -62,23 +64,25 @@ def main():
     parser = init_argparse()
     # Extract arguments of script
     args = parser.parse_args()
-    df = pd.read_csv(args.markup, names=['frame', 'id', 'bb_y', 'bb_x', 'bb_h', 'bb_w'])
+    store = MarkupStore(args.markup)
     n_files = len(os.listdir(args.frames_folder))
     last_appearance = defaultdict(int)
     for frame_id in tqdm(range(1, n_files)):
-        ids = list(df[df['frame'] == frame_id]['id'].values)
+        frame_rows = store.frame(frame_id)
+        ids = list(frame_rows['id'].values)
         if frame_id > 1:
             for id in ids:
                 if (frame_id - last_appearance[id] > 1) and (frame_id - last_appearance[id] < args.kernel_size):
-                    bboxes = df[(df['frame'] == last_appearance[id]) & (df['id'] != id)][['id', 'bb_y', 'bb_x', 'bb_h', 'bb_w']]
-                    prev_bb = df[(df['frame'] == last_appearance[id]) & (df['id'] == id)][['bb_y', 'bb_x', 'bb_h', 'bb_w']]
+                    last_rows = store.frame(last_appearance[id])
+                    bboxes = last_rows[last_rows['id'] != id][['id', 'bb_y', 'bb_x', 'bb_h', 'bb_w']]
+                    prev_bb = last_rows[last_rows['id'] == id][['bb_y', 'bb_x', 'bb_h', 'bb_w']]
                     flag = False
                     for bb in bboxes.iterrows():
                         if flag:
                             break
                         flag = is_bboxes_intersected(bb[1], prev_bb)
                     if not flag:
-                        cur_bb = df[(df['frame'] == frame_id) & (df['id'] == id)]
+                        cur_bb = frame_rows[frame_rows['id'] == id]
                         delta_y = cur_bb['bb_y'].values[0] - prev_bb['bb_y'].values[0]
                         delta_x = cur_bb['bb_x'].values[0] - prev_bb['bb_x'].values[0]
                         delta_h = cur_bb['bb_h'].values[0] - prev_bb['bb_h'].values[0]
@@ -101,7 +105,9 @@ def main():
         else:
             for id in ids:
                 last_appearance[id] = frame_id
-    df.to_csv('postprocessing.txt', sep=',', index=False, header=False)
+    # Gaps are filled only on frames, rows of markup are saved as they are (with flags of propagated bboxes,
+    # original values and order), the store keeps them in float32 sorted by frames
+    shutil.copyfile(args.markup, 'postprocessing.txt')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,247 @@
+import contextlib
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+import constants
+
+from utils.log import logger
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+def peak_rss():
+    '''
+    :return: peak resident memory of the process in bytes (None if it cannot be measured)
+    '''
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == 'darwin' else rss*1024 # kilobytes on Linux
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset
+    except (ImportError, AttributeError):
+        return None
+
+
+class StageStats:
+    '''
+    Implement statistics of one stage of processing
+    '''
+
+    def __init__(self, name):
+        '''
+        Constructor
+        :param name: name of stage
+        '''
+        self.name = name
+        self.calls = 0
+        self.frames = 0 # number of processed frames (0 for stages without frames)
+        self.wall_time = 0.0 # own time of stage without nested stages (seconds)
+        self.cpu_time = 0.0 # own CPU time of thread in stage without nested stages (seconds)
+
+
+    def toDict(self):
+        return {'calls': self.calls, 'frames': self.frames, 'wall_time': self.wall_time, 'cpu_time': self.cpu_time,
+                'fps': self.frames/self.wall_time if self.frames and self.wall_time > 0 else None}
+
+
+class StageProfiler:
+    '''
+    Implement profiler of stages of processing (decoding, forward pass, drawing, statistics, ...).
+    Time of nested stages is excluded from the enclosing stage, so stages sum up to the time of processing.
+    Stages may be run by many threads, CPU time is measured for the thread of stage
+    '''
+
+    def __init__(self, name, enabled=True):
+        '''
+        Constructor
+        :param name: name of run (e.g. name of video)
+        :param enabled: measure stages (disabled profiler does nothing)
+        '''
+        self.name = name
+        self.enabled = enabled
+        self.__stages = dict()
+        self.__gauges = dict() # name: [last, max, sum, count]
+        self.__lock = threading.Lock()
+        self.__local = threading.local() # stack of running stages of thread
+        self.__start = (time.perf_counter(), time.process_time())
+
+
+    def stage(self, name, frames=0):
+        '''
+        Measure the stage: with profiler.stage('decode', frames=1): ...
+        :param name: name of stage
+        :param frames: number of frames processed by the stage
+        '''
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self.__measure(name, frames)
+
+
+    @contextlib.contextmanager
+    def __measure(self, name, frames):
+        if not hasattr(self.__local, 'stack'):
+            self.__local.stack = []
+        stack = self.__local.stack
+        stack.append([0.0, 0.0]) # time of nested stages
+        start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            elapsed, cpu_elapsed = time.perf_counter()-start, time.thread_time()-cpu_start
+            nested, cpu_nested = stack.pop()
+            if stack:
+                stack[-1][0] += elapsed
+                stack[-1][1] += cpu_elapsed
+            with self.__lock:
+                stats = self.__stages.setdefault(name, StageStats(name))
+                stats.calls += 1
+                stats.frames += frames
+                stats.wall_time += elapsed-nested
+                stats.cpu_time += cpu_elapsed-cpu_nested
+
+
+    def gauge(self, name, value):
+        '''
+        Register the current value of measured quantity (e.g. depth of queue)
+        '''
+        if not self.enabled:
+            return
+        with self.__lock:
+            gauge = self.__gauges.setdefault(name, [value, value, 0, 0])
+            gauge[0], gauge[1] = value, max(gauge[1], value)
+            gauge[2] += value
+            gauge[3] += 1
+
+
+    def report(self):
+        '''
+        :return: dictionary with time of run, peak memory, statistics of stages and gauges
+        '''
+        wall_start, cpu_start = self.__start
+        with self.__lock:
+            stages = {name: stats.toDict() for name, stats in self.__stages.items()}
+            gauges = {name: {'last': last, 'max': maximum, 'avg': total/max(1, count)}
+                      for name, (last, maximum, total, count) in self.__gauges.items()}
+        return {'run': self.name, 'wall_time': time.perf_counter()-wall_start,
+                'cpu_time': time.process_time()-cpu_start, 'peak_rss': peak_rss(), 'stages': stages, 'gauges': gauges}
+
+
+    def log(self):
+        '''
+        Log statistics of stages
+        '''
+        report = self.report()
+        for name, stats in report['stages'].items():
+            logger.info('{}: {} calls, wall {:.2f} s, cpu {:.2f} s{}'.format(
+                name, stats['calls'], stats['wall_time'], stats['cpu_time'],
+                ', {:.2f} fps'.format(stats['fps']) if stats['fps'] else ''))
+        if report['peak_rss'] is not None:
+            logger.info('Peak memory: {:.0f} MB'.format(report['peak_rss']/2**20))
+
+
+    def save(self, basename):
+        '''
+        Save report into <basename>.profile.json and metrics in text format of Prometheus into <basename>.prom
+        :return: names of saved files
+        '''
+        report = self.report()
+        json_file, prom_file = basename+'.profile.json', basename+'.prom'
+        with open(json_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        with open(prom_file, 'w') as f:
+            f.write(self.__prometheusText(report))
+        return json_file, prom_file
+
+
+    @staticmethod
+    def __prometheusText(report):
+        prefix = constants.PROFILE_METRICS_PREFIX
+        run = report['run'].replace('\\', '\\\\').replace('"', '\\"')
+        lines = []
+
+        def metric(name, kind, description, values):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, description))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, kind))
+            for labels, value in values:
+                labels = ','.join(['run="{}"'.format(run)]+['{}="{}"'.format(k, v) for k, v in labels])
+                lines.append('{}_{}{{{}}} {}'.format(prefix, name, labels, value))
+
+        stages = report['stages'].items()
+        metric('run_wall_seconds', 'gauge', 'Wall time of run', [((), report['wall_time'])])
+        metric('run_cpu_seconds', 'gauge', 'CPU time of process during run', [((), report['cpu_time'])])
+        if report['peak_rss'] is not None:
+            metric('peak_rss_bytes', 'gauge', 'Peak resident memory of process', [((), report['peak_rss'])])
+        metric('stage_wall_seconds', 'counter', 'Own wall time of stage',
+               [((('stage', name),), stats['wall_time']) for name, stats in stages])
+        metric('stage_cpu_seconds', 'counter', 'Own CPU time of stage',
+               [((('stage', name),), stats['cpu_time']) for name, stats in stages])
+        metric('stage_calls_total', 'counter', 'Number of calls of stage',
+               [((('stage', name),), stats['calls']) for name, stats in stages])
+        metric('stage_frames_total', 'counter', 'Number of frames processed by stage',
+               [((('stage', name),), stats['frames']) for name, stats in stages if stats['frames']])
+        metric('stage_fps', 'gauge', 'Throughput of stage in frames per second',
+               [((('stage', name),), stats['fps']) for name, stats in stages if stats['fps']])
+        for stat, description in [('max', 'Maximum'), ('avg', 'Average')]:
+            metric('gauge_'+stat, 'gauge', description+' value of measured quantity (e.g. depth of queue)',
+                   [((('name', name),), gauge[stat]) for name, gauge in report['gauges'].items()])
+        return '\n'.join(lines)+'\n'
+
+
+class SamplingProfiler:
+    '''
+    Implement hook of sampling profiler py-spy (https://github.com/benfred/py-spy), which records
+    the flame graph of all threads of the process. It is optional: nothing is recorded if py-spy is not installed
+    '''
+
+    def __init__(self, output, rate=constants.PROFILE_SAMPLING_RATE):
+        '''
+        Constructor
+        :param output: file to save the flame graph (svg)
+        :param rate: number of samples per second
+        '''
+        self.__output = output
+        self.__rate = rate
+        self.__process = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+    def start(self):
+        executable = shutil.which('py-spy')
+        if executable is None:
+            logger.info('py-spy is not installed, sampling profiling is skipped')
+            return
+        self.__process = subprocess.Popen([executable, 'record', '--pid', str(os.getpid()), '--rate',
+                                           str(self.__rate), '--threads', '--output', self.__output])
+
+
+    def stop(self):
+        '''
+        Stop sampling, py-spy saves the flame graph on interruption
+        '''
+        if self.__process is None:
+            return
+        try:
+            self.__process.send_signal(signal.CTRL_C_EVENT if os.name == 'nt' else signal.SIGINT)
+            self.__process.wait(timeout=constants.PROFILE_SAMPLING_TIMEOUT)
+            logger.info('Flame graph was saved to {}'.format(self.__output))
+        except subprocess.TimeoutExpired:
+            self.__process.kill()
+        self.__process = None
@@ -0,0 +1,311 @@
+'''
+Tracking of long videos by overlapping segments in parallel processes with stitching of ids of tracks
+'''
+
+import argparse
+import math
+import multiprocessing
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy.optimize import linear_sum_assignment
+
+import constants
+from binarymarkup import binary_markup_file, convert_markup
+from operations import read_markup
+from videodataloader import VideoDataLoader
+from videowriter import MarkedVideoWriter
+
+from utils.log import logger
+
+
+def split_segments(n_frames, n_segments, overlap):
+    '''
+    Split frames of video into overlapping segments
+    :param n_frames: number of frames in video
+    :param n_segments: number of segments
+    :param overlap: number of frames shared by neighbouring segments
+    :return: list of (first frame, frame to stop at) of segments
+    '''
+    length = int(math.ceil(n_frames/float(n_segments)))
+    segments = []
+    for start in range(0, n_frames, length):
+        segments.append((start, min(n_frames, start+length+overlap)))
+    if len(segments) > 1 and segments[-1][1]-segments[-1][0] <= overlap:
+        segments.pop() # the last segment is covered by overlap of the previous one
+        segments[-1] = (segments[-1][0], n_frames)
+    return segments
+
+
+def track_segment(video, name, frame_range, embedding_ranges, gpu, device, threads, tracker_kwargs):
+    '''
+    Track objects on the segment of video (launched in worker process)
+    :return: markup file and file of embeddings of segment
+    :raise RuntimeError: tracking of segment failed (its markup is not complete)
+    '''
+    import torch
+    from mottracker import MOTTracker
+    if device == 'cpu':
+        torch.set_num_threads(threads)
+    tracker = MOTTracker(video, gpu, device=device, frame_range=frame_range, output_name=name, render_video=False,
+                         embedding_ranges=embedding_ranges, **tracker_kwargs)
+    if not tracker.trackVideo():
+        raise RuntimeError('Tracking of segment {} failed'.format(name))
+    return (os.path.join(constants.RESULTS_FOLDER, name+'.txt'),
+            os.path.join(constants.RESULTS_FOLDER, name+'.emb.npz'))
+
+
+def tracks_iou(first, second):
+    '''
+    Calculate mean IoU of bboxes of two tracks over frames, where at least one of them exists
+    :param first: dataframe with bboxes of the first track indexed by frames
+    :param second: dataframe with bboxes of the second track indexed by frames
+    '''
+    common = first.index.intersection(second.index)
+    if len(common) == 0:
+        return 0.0
+    a, b = first.loc[common].values, second.loc[common].values # columns: x, y, w, h
+    x1, y1 = np.maximum(a[:, 0], b[:, 0]), np.maximum(a[:, 1], b[:, 1])
+    x2, y2 = np.minimum(a[:, 0]+a[:, 2], b[:, 0]+b[:, 2]), np.minimum(a[:, 1]+a[:, 3], b[:, 1]+b[:, 3])
+    inter = np.clip(x2-x1, 0, None)*np.clip(y2-y1, 0, None)
+    iou = inter/np.maximum(a[:, 2]*a[:, 3]+b[:, 2]*b[:, 3]-inter, 1e-9)
+    return float(iou.sum())/len(first.index.union(second.index))
+
+
+def match_tracks(prev_rows, next_rows, prev_embeddings, next_embeddings):
+    '''
+    Match tracks of two neighbouring segments on their overlap by bboxes and embeddings
+    :param prev_rows: markup of the previous segment on overlap
+    :param next_rows: markup of the next segment on overlap
+    :param prev_embeddings: dictionary {id: embedding} of tracks of the previous segment on overlap
+    :param next_embeddings: dictionary {id: embedding} of tracks of the next segment on overlap
+    :return: dictionary {id of the next segment: id of the previous segment}
+    '''
+    coords = ['bb_y', 'bb_x', 'bb_h', 'bb_w'] # x, y of top left corner, width, height
+    prev_tracks = {i: rows.set_index('frame')[coords] for i, rows in prev_rows.groupby('id')}
+    next_tracks = {i: rows.set_index('frame')[coords] for i, rows in next_rows.groupby('id')}
+    prev_ids, next_ids = list(prev_tracks.keys()), list(next_tracks.keys())
+    if not prev_ids or not next_ids:
+        return dict()
+    scores = np.zeros((len(next_ids), len(prev_ids)))
+    for i, next_id in enumerate(next_ids):
+        for j, prev_id in enumerate(prev_ids):
+            iou = tracks_iou(next_tracks[next_id], prev_tracks[prev_id])
+            if iou == 0.0:
+                continue
+            cosine = 0.0
+            if next_id in next_embeddings and prev_id in prev_embeddings:
+                u, v = next_embeddings[next_id], prev_embeddings[prev_id]
+                cosine = float(np.dot(u, v)/max(1e-9, np.linalg.norm(u)*np.linalg.norm(v)))
+            scores[i, j] = constants.STITCH_IOU_WEIGHT*iou+(1.0-constants.STITCH_IOU_WEIGHT)*cosine
+    rows, cols = linear_sum_assignment(-scores)
+    return {next_ids[i]: prev_ids[j] for i, j in zip(rows, cols) if scores[i, j] >= constants.STITCH_MIN_SCORE}
+
+
+def load_embeddings(embeddings_file, name):
+    data = np.load(embeddings_file)
+    return dict(zip(data[name+'_ids'].tolist(), data[name+'_features']))
+
+
+def stitch_segments(segments, markups, embeddings, output, flag_propagated=False):
+    '''
+    Join markups of segments into one markup with consistent ids of tracks.
+    Ids of the next segment are matched with ids of the previous one on their overlap, unmatched tracks get new ids.
+    Rows of overlap are taken from the previous segment till the middle of overlap and from the next one after it
+    :param segments: list of (first frame, frame to stop at) of segments
+    :param markups: markup files of segments
+    :param embeddings: files of embeddings of tracks of segments
+    :param output: joined markup file
+    :param flag_propagated: keep column with flags of bboxes propagated by motion model without detection
+    '''
+    next_id = 1
+    prev_rows, prev_mapping = None, None
+    with open(output, 'w') as f:
+        for k, ((start, end), markup_file) in enumerate(zip(segments, markups)):
+            rows = read_markup(markup_file, propagated=flag_propagated)
+            mapping = dict()
+            if prev_rows is not None:
+                overlap_start, overlap_end = start, segments[k-1][1]
+                matches = match_tracks(prev_rows[prev_rows['frame'] >= overlap_start],
+                                       rows[rows['frame'] < overlap_end],
+                                       load_embeddings(embeddings[k-1], 'tail'), load_embeddings(embeddings[k], 'head'))
+                mapping = {i: prev_mapping[j] for i, j in matches.items()}
+                logger.info('Segments {} and {}: {} tracks were stitched'.format(k-1, k, len(mapping)))
+            for track_id in sorted(rows['id'].unique()):
+                if track_id not in mapping:
+                    mapping[track_id] = next_id
+                    next_id += 1
+            # Cut overlaps in their middles
+            lower = (start+segments[k-1][1])//2 if k > 0 else start
+            upper = (segments[k+1][0]+end)//2 if k+1 < len(segments) else end
+            part = rows[(rows['frame'] >= lower) & (rows['frame'] < upper)].copy()
+            part['id'] = part['id'].map(mapping)
+            part.to_csv(f, header=False, index=False)
+            prev_rows, prev_mapping = rows, mapping
+
+
+def render_markup_video(video, markup_file, output, backend=constants.VIDEO_WRITER_BACKEND):
+    '''
+    Draw tracked objects from markup on frames of video and save the marked video
+    '''
+    from mottracker import plot_tracking
+    dataloader = VideoDataLoader(video, constants.OUTPUT_FRAME_SIZE)
+    writer = MarkedVideoWriter(output, dataloader.frame_rate, backend)
+    rows = read_markup(markup_file)
+    frames = {frame_id: frame_rows for frame_id, frame_rows in rows.groupby('frame')}
+    empty = rows.iloc[:0]
+    try:
+        while True:
+            try:
+                # Markup is numbered by positions of frames in video as by MOTTracker (broken frames are skipped)
+                frame_id, img0 = dataloader.readFrame()
+            except StopIteration:
+                break
+            frame_rows = frames.pop(frame_id, empty)
+            tlwhs = frame_rows[['bb_y', 'bb_x', 'bb_h', 'bb_w']].values
+            writer.write(plot_tracking(dataloader.resizeFrame(img0), tlwhs, frame_rows['id'].values,
+                                       frame_id=frame_id))
+    finally:
+        writer.close()
+
+
+class SegmentParallelTracker:
+    '''
+    Implement tracking of video split into overlapping segments, which are tracked by parallel processes
+    '''
+
+    def __init__(self, input_video, workers=constants.SEGMENT_WORKERS, overlap=constants.SEGMENT_OVERLAP,
+                 gpus=None, device='cuda', render_video=True, **tracker_kwargs):
+        '''
+        Constructor
+        :param input_video: video for tracking objects
+        :param workers: number of parallel processes (and segments)
+        :param overlap: number of frames shared by neighbouring segments to stitch tracks
+        :param gpus: list of GPU numbers, processes are distributed over them (None - constants.GPU_NUMBER)
+        :param device: device to launch the detector ('cuda' or 'cpu')
+        :param render_video: draw stitched tracks and save the marked video
+        :param tracker_kwargs: other parameters of MOTTracker
+        '''
+        os.makedirs(constants.RESULTS_FOLDER, exist_ok=True)
+        self.__video = input_video
+        self.__workers = max(1, workers)
+        self.__overlap = overlap
+        self.__gpus = gpus or [constants.GPU_NUMBER]
+        self.__device = device
+        self.__rendervideo = render_video
+        self.__trackerkwargs = tracker_kwargs
+        self.__basename = os.path.splitext(os.path.basename(self.__video))[0]
+        self.__markupfile = os.path.join(constants.RESULTS_FOLDER, self.__basename+'.txt')
+        self.__markedvideo = os.path.join(constants.RESULTS_FOLDER, self.__basename+'.avi')
+
+
+    def trackVideo(self):
+        '''
+        Track humans on video by segments and stitch results
+        :raise RuntimeError: tracking of some segments failed (markups of segments are not stitched)
+        '''
+        n_frames = len(VideoDataLoader(self.__video, constants.OUTPUT_FRAME_SIZE))
+        segments = split_segments(n_frames, self.__workers, self.__overlap)
+        logger.info('Video of {} frames is split into segments: {}'.format(n_frames, segments))
+        threads = max(1, multiprocessing.cpu_count()//len(segments))
+        jobs = []
+        # Processes are spawned to get separate CUDA contexts
+        with ProcessPoolExecutor(max_workers=len(segments), mp_context=multiprocessing.get_context('spawn')) as pool:
+            for k, (start, end) in enumerate(segments):
+                embedding_ranges = dict()
+                if k > 0:
+                    embedding_ranges['head'] = (start, segments[k-1][1])
+                if k+1 < len(segments):
+                    embedding_ranges['tail'] = (segments[k+1][0], end)
+                name = '{}.seg{}'.format(self.__basename, k)
+                jobs.append(pool.submit(track_segment, self.__video, name, (start, end), embedding_ranges,
+                                        self.__gpus[k % len(self.__gpus)], self.__device, threads,
+                                        self.__trackerkwargs))
+            results, failed = [], []
+            for k, job in enumerate(jobs):
+                try:
+                    results.append(job.result())
+                except Exception as e: # failure of tracking or crash of worker
+                    logger.error('Segment {} (frames {}-{}) failed: {}'.format(k, segments[k][0], segments[k][1], e))
+                    failed.append(k)
+        if failed:
+            raise RuntimeError('Tracking of segments {} failed, markups of segments are not stitched'.format(failed))
+        markups, embeddings = [r[0] for r in results], [r[1] for r in results]
+        # Segments flag propagated bboxes as MOTTracker does with stride of detection
+        stitch_segments(segments, markups, embeddings, self.__markupfile,
+                        flag_propagated=self.__trackerkwargs.get('detection_stride', 1) > 1)
+        convert_markup(self.__markupfile)
+        logger.info('Results of tracking were saved to {}'.format(self.__markupfile))
+        for filename in markups+embeddings+[binary_markup_file(markup) for markup in markups]:
+            os.remove(filename)
+        if self.__rendervideo:
+            render_markup_video(self.__video, self.__markupfile, self.__markedvideo)
+            logger.info('Tracking video was saved to {}'.format(self.__markedvideo))
+
+
+def init_argparse():
+    '''
+    Initialize argparse
+    '''
+    parser = argparse.ArgumentParser(description='Multiple Object Tracking by parallel segments of video')
+    parser.add_argument(
+        '--input_video',
+        nargs='?',
+        help='Video to track objects',
+        required=True,
+        type=str)
+    parser.add_argument(
+        '--workers',
+        nargs='?',
+        help='Number of parallel processes (and segments of video)',
+        default=constants.SEGMENT_WORKERS,
+        type=int)
+    parser.add_argument(
+        '--overlap',
+        nargs='?',
+        help='Number of frames shared by neighbouring segments to stitch tracks',
+        default=constants.SEGMENT_OVERLAP,
+        type=int)
+    parser.add_argument(
+        '--gpus',
+        nargs='+',
+        help='Numbers of GPU to distribute processes over them',
+        default=[constants.GPU_NUMBER],
+        type=int)
+    parser.add_argument(
+        '--device',
+        nargs='?',
+        help='Device to launch the detector',
+        choices=constants.DEVICES,
+        default='cuda',
+        type=str)
+    parser.add_argument(
+        '--detection_stride',
+        nargs='?',
+        help='Run the detector every detection_stride frames, tracks are propagated by motion model between them',
+        default=1,
+        type=int)
+    parser.add_argument(
+        '--adaptive_stride',
+        help='Adapt stride of detection to motion of humans (--detection_stride is the maximum stride)',
+        action='store_true')
+    parser.add_argument(
+        '--no_video',
+        help='Do not save the marked video',
+        action='store_true')
+    return parser
+
+
+def main():
+    parser = init_argparse()
+    # Extract arguments of script
+    args = parser.parse_args()
+    # Launch tracking by segments
+    tracker = SegmentParallelTracker(args.input_video, workers=args.workers, overlap=args.overlap, gpus=args.gpus,
+                                     device=args.device, render_video=not args.no_video, checkpoint_interval=0,
+                                     detection_stride=args.detection_stride, adaptive_stride=args.adaptive_stride)
+    tracker.trackVideo()
+
+
+if __name__ == '__main__':
+    main()
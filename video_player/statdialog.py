@@ -1,18 +1,23 @@
+import json
 import os
 import shutil
 import plotly.graph_objects as go
+from PIL import Image
 from PyQt5.QtWidgets import QDialog, QCheckBox, QVBoxLayout, QHBoxLayout, QRadioButton, QGroupBox, QSpinBox, QLabel, \
-    QLineEdit, QPushButton, QSplitter, QFileDialog, QSizePolicy
+    QLineEdit, QPushButton, QSplitter, QFileDialog, QSizePolicy, QTimeEdit
 from PyQt5.QtGui import QIcon, QRegExpValidator, QValidator
-from PyQt5.QtCore import Qt, QRegExp
+from PyQt5.QtCore import Qt, QRegExp, QTime
 from PyQt5.QtWidgets import QApplication
 
 import constants
+from combatevents import CombatEvents
 from combatscounter import CombatsCounter
 from emailsending import EMailSending
 from interactivestatwindow import InteractiveStatWindow
+from markupstore import MarkupStore
 from motionheatmap import MotionHeatmap
-from motiontrajectories import MotionTrajectories
+from motiontrajectories import MotionTrajectories, draw_distances_chart
+from onlinestatistics import saved_statistics, statistics_folder
 
 
 class StatDialog(QDialog):
@@ -20,14 +25,20 @@ class StatDialog(QDialog):
     Implement dialog window and its behaviour for calculation of statistics
     '''
 
-    def __init__(self, parent=None, markup=None):
+    def __init__(self, parent=None, markup=None, timestamps=None):
         '''
         Constructor
         :param markup: file with saved information about bboxes, ids of humans on each frame of video
+        :param timestamps: timestamps of frames of video in milliseconds to choose time window of combats
+        (None - time window is not available)
         '''
         super(StatDialog, self).__init__(parent)
 
         self.__markup = markup # markup file
+        self.__timestamps = timestamps
+        self.__store = None # markup loaded once for all statistics
+        self.__combatsCounter = None # combats are counted once, other time windows are taken from the log of combats
+        self.__prevwindow = None # time window of combats shown on previous step
         self.__dirname = '' # directory to store calculated statistics
 
         # Flags of display statistics into interactive window
@@ -94,6 +105,21 @@ class StatDialog(QDialog):
         self.allRadioButton.toggled.connect(self.allRadioButtonToggled)
         self.personRadioButton.toggled.connect(self.personRadioButtonToggled)
         self.allRadioButtonToggled()
+
+        # Create and adjust time window of combats
+        self.windowCheckBox = QCheckBox('Time window of combats', self)
+        self.windowCheckBox.toggled.connect(self.windowCheckBoxToggled)
+        self.startTimeEdit = QTimeEdit()
+        self.endTimeEdit = QTimeEdit()
+        for timeEdit in [self.startTimeEdit, self.endTimeEdit]:
+            timeEdit.setDisplayFormat('hh:mm:ss')
+        if self.__timestamps is not None and len(self.__timestamps) > 0:
+            self.endTimeEdit.setTime(QTime(0, 0).addMSecs(int(self.__timestamps[-1])+1000))
+        else:
+            self.windowCheckBox.setEnabled(False)
+            self.windowCheckBox.setToolTip('Timestamps of video are unknown')
+        self.windowCheckBoxToggled()
+
         # Radiobuttons for saving statistics or sending it as an e-mail
         self.localRadioButton = QRadioButton('Local saving')
         self.localRadioButton.setChecked(True)
@@ -126,6 +152,12 @@ class StatDialog(QDialog):
         optionsLayout.addWidget(self.allRadioButton)
         optionsLayout.addWidget(self.personRadioButton)
         optionsLayout.addWidget(self.humanSpinBox)
+        optionsLayout.addWidget(self.windowCheckBox)
+        windowLayout = QHBoxLayout()
+        windowLayout.addWidget(self.startTimeEdit)
+        windowLayout.addWidget(QLabel('-'))
+        windowLayout.addWidget(self.endTimeEdit)
+        optionsLayout.addLayout(windowLayout)
         optionsLayout.addStretch(1)
         optionsGroupBox.setLayout(optionsLayout)
         saveLayout = QHBoxLayout()
@@ -191,6 +223,20 @@ class StatDialog(QDialog):
         self.humanSpinBox.setToolTip('Choose the number of human')
 
 
+    def windowCheckBoxToggled(self):
+        self.startTimeEdit.setEnabled(self.windowCheckBox.isChecked())
+        self.endTimeEdit.setEnabled(self.windowCheckBox.isChecked())
+
+
+    def timeWindow(self):
+        '''
+        :return: (start, end) of chosen time window of combats in milliseconds (None - the whole video)
+        '''
+        if not self.windowCheckBox.isChecked():
+            return None
+        return self.startTimeEdit.time().msecsSinceStartOfDay(), self.endTimeEdit.time().msecsSinceStartOfDay()
+
+
     def localRadioButtonToggled(self):
         self.emailLineEdit.setStyleSheet('QLineEdit { background-color: #ffffff }')
 
@@ -274,9 +320,11 @@ class StatDialog(QDialog):
                     if self.__isFirstLaunchWindow:
                         # Create empty folder to store statistics
                         print('Create directory to store statistics...')
-                        if os.path.exists(statdir):
+                        # Statistics saved by tracker into the same folder are kept to be taken from it
+                        if os.path.exists(statdir) and \
+                                os.path.abspath(statdir) != os.path.abspath(statistics_folder(self.__markup)):
                             shutil.rmtree(statdir)
-                        os.makedirs(statdir)
+                        os.makedirs(statdir, exist_ok=True)
                         print('Done: \t {}'.format(statdir))
                     # Get id of human for whom it is needed to calculate statistics
                     if self.personRadioButton.isChecked():
@@ -286,10 +334,15 @@ class StatDialog(QDialog):
                     self.checkStatisticsRecount()
                     # Calculate statistics
                     QApplication.setOverrideCursor(Qt.WaitCursor) # start calculating
+                    if self.__store is None:
+                        self.__store = MarkupStore(self.__markup, timestamps=self.__timestamps)
+                    online = saved_statistics(self.__markup) # statistics calculated by tracker (None - not saved)
                     # Calculation of motion heatmap
                     if self.heatmapCheckBox.isChecked():
-                        if self.__recountHeatmap:
-                            mh = MotionHeatmap(markup_file=self.__markup, out_dir=statdir, human_number=self.__human)
+                        if self.__recountHeatmap and online is not None and self.__human is None:
+                            self.__heatmapImage = Image.open(self.__copySaved(online, 'heatmap.png', statdir))
+                        elif self.__recountHeatmap:
+                            mh = MotionHeatmap(markup_file=self.__store, out_dir=statdir, human_number=self.__human)
                             self.__heatmapImage = mh.buildHeatmap()
                         else:
                             if not self.__isFirstLaunchWindow and self.__prevHeatmapChecked:
@@ -300,8 +353,13 @@ class StatDialog(QDialog):
                         self.__prevHeatmapChecked = False
                     # Calculation of motion trajectories and covered distances
                     if self.pathsCheckBox.isChecked():
-                        if self.__recountPaths:
-                            mt = MotionTrajectories(markup_file=self.__markup, out_dir=statdir, human_number=self.__human)
+                        if self.__recountPaths and online is not None and self.__human is None:
+                            self.__copySaved(online, 'trajectories.png', statdir)
+                            with open(os.path.join(online, 'covered_distances.json')) as f:
+                                distances = {int(human_id): value for human_id, value in json.load(f).items()}
+                            self.__pathsBarChart = draw_distances_chart(distances, statdir)
+                        elif self.__recountPaths:
+                            mt = MotionTrajectories(markup_file=self.__store, out_dir=statdir, human_number=self.__human)
                             self.__pathsBarChart = mt.calculateTraceStatistics()
                             self.__humandist = mt.getDistance(self.__human)
                         else:
@@ -313,14 +371,23 @@ class StatDialog(QDialog):
                         self.__prevPathsChecked = False
                     # Calculation of combats between players
                     if self.combatsCheckBox.isChecked():
+                        window = self.timeWindow()
                         if self.__recountCombats:
-                            comb_acc = CombatsCounter(markup_file=self.__markup, out_dir=statdir, human_number=self.__human)
-                            self.__combatsData = comb_acc.calculateCombatsStatistics()
+                            events = None # combats are counted by markup
+                            if online is not None: # combats counted by tracker are taken from the log of combats
+                                events = CombatEvents.load(os.path.join(online, 'combat_events.csv'),
+                                                           timestamps=self.__timestamps)
+                            self.__combatsCounter = CombatsCounter(markup_file=self.__store, out_dir=statdir,
+                                                                   human_number=self.__human, events=events)
+                            self.__combatsData = self.__combatsCounter.calculateCombatsStatistics(window)
+                        elif window != self.__prevwindow: # combats of time window are taken from the log of combats
+                            self.__combatsData = self.__combatsCounter.calculateCombatsStatistics(window)
                         else:
                             if not self.__isFirstLaunchWindow and self.__prevCombatsChecked:
                                 print('Statistics about combats have already calculated!')
                         self.__showCombatsFlag = True
                         self.__prevCombatsChecked = True
+                        self.__prevwindow = window
                     else:
                         self.__prevCombatsChecked = False
                     # Sending calculated statistics as an e-mail
@@ -345,6 +412,17 @@ class StatDialog(QDialog):
                 self.errorLabel.setText('Cannot load the markup file')
 
 
+    def __copySaved(self, folder, filename, statdir):
+        '''
+        Copy file of statistics saved by tracker into the directory of statistics
+        :return: path to the file in the directory of statistics
+        '''
+        path = os.path.join(statdir, filename)
+        if os.path.abspath(folder) != os.path.abspath(statdir):
+            shutil.copy(os.path.join(folder, filename), path)
+        return path
+
+
     def showResults(self):
         self.errorLabel.setText('')
         distance_title = None
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Modules of the player are imported as by its scripts, which are launched from its folder
+VIDEO_PLAYER_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, VIDEO_PLAYER_FOLDER)
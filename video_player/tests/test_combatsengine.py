@@ -0,0 +1,115 @@
+'''
+Tests of vectorized detection of combats against the check of all pairs of bboxes by CombatsCounter
+'''
+
+from collections import Counter, defaultdict
+import numpy as np
+import pytest
+
+import constants
+import operations
+from combatsengine import CombatsEngine, code_pairs, combats_matrix, pair_codes
+
+
+def synthetic_crowd(n_humans, n_frames, seed=0):
+    '''
+    Generate bboxes of humans walking randomly over the hall (as benchmarks.synthetic_crowd), some humans are missed
+    and some have two bboxes on frames
+    :return: list of (ids, bboxes) for each frame
+    '''
+    rng = np.random.default_rng(seed)
+    size = np.array(constants.OUTPUT_FRAME_SIZE, dtype=float)*np.sqrt(max(1.0, n_humans/20))
+    position, velocity = rng.uniform(0, 1, (n_humans, 2))*size, np.zeros((n_humans, 2))
+    frames = []
+    for frame_id in range(n_frames):
+        velocity = 0.95*velocity+rng.normal(0, 0.5, (n_humans, 2))
+        position = np.clip(position+velocity, 0, size)
+        detected = rng.random(n_humans) < 0.97
+        ids = np.arange(1, n_humans+1)[detected]
+        bboxes = np.column_stack([position, rng.normal(40, 2, n_humans), rng.normal(100, 4, n_humans)])[detected]
+        if frame_id % 10 == 0: # the same track is found twice on frame
+            ids, bboxes = np.append(ids, ids[:2]), np.vstack([bboxes, bboxes[:2]+rng.normal(0, 20, (2, 4))])
+        frames.append((ids, bboxes))
+    return frames
+
+
+def count_pairs(frames):
+    '''
+    Count combats by checks of all pairs of rows of frames, as CombatsCounter before vectorization
+    :return: Counter {(the lower id, the higher id): number of combats}
+    '''
+    combats = Counter()
+    existing_combats = defaultdict(set)
+    for ids, bboxes in frames:
+        rows = [dict(zip(['bb_y', 'bb_x', 'bb_h', 'bb_w'], bbox)) for bbox in bboxes.tolist()]
+        for i in range(len(rows)-1):
+            for j in range(i+1, len(rows)):
+                id_i, id_j = int(ids[i]), int(ids[j])
+                if id_i != id_j:
+                    if operations.is_bbox_intersected(rows[i], rows[j]):
+                        if id_j not in existing_combats[id_i]:
+                            combats[min(id_i, id_j), max(id_i, id_j)] += 1
+                        existing_combats[id_i].add(id_j)
+                        existing_combats[id_j].add(id_i)
+                    else:
+                        existing_combats[id_i].discard(id_j)
+                        existing_combats[id_j].discard(id_i)
+    return combats
+
+
+def dense_matrix(frames, ids):
+    '''
+    Fill the dense matrix of combats pair by pair, as CombatsCounter before sparse counts
+    '''
+    matrix = np.zeros((len(ids), len(ids)))
+    for (id1, id2), count in count_pairs(frames).items():
+        matrix[ids.index(id1), ids.index(id2)] += count
+        matrix[ids.index(id2), ids.index(id1)] += count
+    return matrix
+
+
+def run_engine(frames, sweep_min_bboxes):
+    engine = CombatsEngine(sweep_min_bboxes=sweep_min_bboxes)
+    for frame_id, (ids, bboxes) in enumerate(frames, start=1):
+        engine.addFrame(frame_id, ids, bboxes)
+    return engine
+
+
+@pytest.fixture(scope='module')
+def frames():
+    return synthetic_crowd(60, 300)
+
+
+def test_pair_codes_are_unordered():
+    codes = pair_codes([3, 7, 2**31], [7, 3, 5])
+    assert codes[0] == codes[1]
+    first, second = code_pairs(codes)
+    assert first.tolist() == [3, 3, 5]
+    assert second.tolist() == [7, 7, 2**31]
+
+
+def test_all_pairs_match_per_pair_baseline(frames):
+    expected = count_pairs(frames)
+    assert sum(expected.values()) > 0
+    codes, counts = run_engine(frames, np.inf).counts()
+    first, second = code_pairs(codes)
+    assert dict(zip(zip(first.tolist(), second.tolist()), counts.tolist())) == dict(expected)
+
+
+def test_sort_and_sweep_matches_all_pairs(frames):
+    engine, reference = run_engine(frames, 0), run_engine(frames, np.inf)
+    for result, expected in zip(engine.counts(), reference.counts()):
+        assert np.array_equal(result, expected)
+    for result, expected in zip(engine.events(), reference.events()):
+        assert np.array_equal(result, expected)
+    assert np.array_equal(engine.active, reference.active)
+    assert engine.first_hits == reference.first_hits
+
+
+
+def test_sparse_counts_match_dense_matrix(frames):
+    ids = sorted({int(human_id) for frame_ids, _ in frames for human_id in frame_ids}, reverse=True)
+    codes, counts = run_engine(frames, 0).counts()
+    combats = dict(zip(zip(*[v.tolist() for v in code_pairs(codes)]), counts.tolist()))
+    assert np.array_equal(combats_matrix(combats, ids), dense_matrix(frames, ids))
+    assert np.array_equal(combats_matrix(combats, ids[:5]), dense_matrix(frames, ids)[:5, :5])
@@ -0,0 +1,91 @@
+'''
+Smoke tests of the detector on CPU with random weights. They need the files of Towards-Realtime-MOT
+copied into the folder of the player (models.py, utils and cfg), as for launch of the player
+'''
+
+import copy
+import os
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+models = pytest.importorskip('models')
+
+import constants
+import detector
+from videodataloader import frames_to_blob
+
+
+CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), constants.TRACKER_CONFIG)
+
+
+@pytest.fixture(scope='module')
+def model():
+    if not os.path.isfile(CONFIG):
+        pytest.skip('Config of the detector is not found: {}'.format(CONFIG))
+    torch.manual_seed(0)
+    return models.Darknet(CONFIG, nID=14455).eval()
+
+
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (192, 320, 3), dtype=np.uint8)] # detector accepts any size multiple of 32
+
+
+def test_traced_model_runs_on_cpu(model, frames, monkeypatch):
+    monkeypatch.setattr(detector, 'load_detector', lambda opt: copy.deepcopy(model))
+    opt = detector.tracker_options(cfg=CONFIG)
+    traced = detector.build_model(opt, device='cpu', variant='traced', frames=frames)
+    with torch.no_grad():
+        pred = traced(frames_to_blob(frames))
+        reference = model(frames_to_blob(frames))
+    assert pred.device.type == 'cpu'
+    assert pred.shape == reference.shape
+    assert torch.allclose(pred, reference, atol=1e-4)
+
+
+def legacy_forward(model, x):
+    '''
+    Forward pass of Darknet for detection as it was before the compiled plan (as benchmarks.legacy_forward)
+    '''
+    img_size = (x.shape[-1], x.shape[-2])
+    layer_outputs, output = [], []
+    for module_def, module in zip(model.module_defs, model.module_list):
+        mtype = module_def['type']
+        if mtype in ['convolutional', 'upsample', 'maxpool']:
+            x = module(x)
+        elif mtype == 'route':
+            layer_i = [int(v) for v in module_def['layers'].split(',')]
+            if len(layer_i) == 1:
+                x = layer_outputs[layer_i[0]]
+            else:
+                x = torch.cat([layer_outputs[i] for i in layer_i], 1)
+        elif mtype == 'shortcut':
+            x = layer_outputs[-1]+layer_outputs[int(module_def['from'])]
+        elif mtype == 'yolo':
+            x = module[0](x, img_size)
+            output.append(x)
+        layer_outputs.append(x)
+    return torch.cat(output, 1)
+
+
+def test_compiled_plan_matches_legacy_forward(model, frames):
+    with torch.no_grad():
+        assert torch.equal(model(frames_to_blob(frames)), legacy_forward(model, frames_to_blob(frames)))
+
+
+def test_lean_path_matches_full_predictions(model):
+    rng = np.random.default_rng(1)
+    frames = [rng.integers(0, 256, (192, 320, 3), dtype=np.uint8) for _ in range(2)] # images are padded in batch
+    lean = copy.deepcopy(model)
+    with torch.no_grad():
+        full = model(frames_to_blob(frames))
+        conf_thres = float(full[..., 4].median())
+        lean.set_conf_thres(conf_thres)
+        pred = lean(frames_to_blob(frames))
+    assert pred.shape[-1] == full.shape[-1]
+    for image_pred, image_full in zip(pred, full):
+        expected = image_full[image_full[:, 4] > conf_thres]
+        assert len(expected) > 0
+        assert torch.allclose(image_pred[image_pred[:, 4] > 0], expected, atol=1e-4)
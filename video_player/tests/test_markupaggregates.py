@@ -0,0 +1,89 @@
+'''
+Tests of statistics aggregated by chunks of markup against statistics of the whole markup
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+pytest.importorskip('PIL')
+pytest.importorskip('scipy')
+pytest.importorskip('matplotlib')
+
+import operations
+from binarymarkup import convert_markup
+from combatsengine import CombatsEngine, code_pairs
+from markupaggregates import CombatsAggregate, DensityAggregate, DistanceAggregate, aggregate_markup, \
+    iter_markup_chunks
+
+
+WIDTH, HEIGHT = 640, 360
+WHOLE = 10**9 # number of rows of chunk to read the whole markup at once
+
+
+@pytest.fixture(scope='module')
+def markup_file(tmp_path_factory):
+    '''
+    Markup of humans walking randomly over the background, tracks are lost for some frames and some humans
+    leave the background
+    '''
+    rng = np.random.default_rng(0)
+    n_humans = 12
+    position, velocity = rng.uniform(0, 1, (n_humans, 2))*[HEIGHT, WIDTH], np.zeros((n_humans, 2))
+    rows = []
+    for frame_id in range(1, 401):
+        velocity = 0.9*velocity+rng.normal(0, 2, (n_humans, 2))
+        position = np.clip(position+velocity, -50, [HEIGHT+50, WIDTH+50])
+        for human_id in np.flatnonzero(rng.random(n_humans) < 0.9)+1:
+            rows.append([frame_id, human_id, *position[human_id-1], 120, 60])
+    markup_file = str(tmp_path_factory.mktemp('markup')/'markup.txt')
+    np.savetxt(markup_file, rows, fmt='%d,%d,%.1f,%.1f,%.1f,%.1f')
+    return markup_file
+
+
+@pytest.fixture(scope='module', params=['text', 'binary'])
+def markup(request, markup_file, tmp_path_factory):
+    if request.param == 'text':
+        return markup_file
+    binary_file = str(tmp_path_factory.mktemp('binary')/'markup.txt')
+    with open(markup_file) as src, open(binary_file, 'w') as dst:
+        dst.write(src.read())
+    convert_markup(binary_file)
+    return binary_file
+
+
+def aggregate(markup, chunk_rows):
+    aggregates = [DensityAggregate(WIDTH, HEIGHT), DistanceAggregate(), CombatsAggregate()]
+    aggregate_markup(markup, aggregates, chunk_rows)
+    return aggregates
+
+
+def test_chunks_keep_frames_whole(markup):
+    chunks = list(iter_markup_chunks(markup, 7))
+    assert len(chunks) > 1
+    frames = np.concatenate([chunk.frames for chunk in chunks])
+    assert np.array_equal(frames, np.loadtxt(markup, delimiter=',', usecols=0))
+    for previous, chunk in zip(chunks[:-1], chunks[1:]):
+        assert previous.frames[-1] < chunk.frames[0]
+
+
+@pytest.mark.parametrize('chunk_rows', [1, 7, 500])
+def test_chunked_aggregates_match_whole_markup(markup, chunk_rows):
+    density, distances, combats = aggregate(markup, chunk_rows)
+    whole_density, whole_distances, whole_combats = aggregate(markup, WHOLE)
+    assert np.array_equal(density.density, whole_density.density)
+    assert distances.distances.keys() == whole_distances.distances.keys()
+    for human_id, distance in whole_distances.distances.items():
+        assert distances.distances[human_id] == pytest.approx(distance)
+    assert sum(whole_combats.counts.values()) > 0
+    assert dict(combats.counts) == dict(whole_combats.counts)
+
+
+def test_combats_aggregate_matches_engine(markup_file):
+    data = pd.read_csv(markup_file, names=operations.MARKUP_COLUMNS)
+    engine = CombatsEngine()
+    for frame_id, frame in data.groupby('frame'):
+        engine.addFrame(frame_id, frame['id'].values, frame[['bb_y', 'bb_x', 'bb_h', 'bb_w']].values)
+    codes, counts = engine.counts()
+    expected = dict(zip(zip(*[v.tolist() for v in code_pairs(codes)]), counts.tolist()))
+    assert dict(aggregate(markup_file, 7)[2].counts) == expected
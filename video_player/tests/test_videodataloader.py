@@ -0,0 +1,60 @@
+'''
+Tests of preprocessing of frames by one resize into padded frame against the former preprocessing
+'''
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+torch = pytest.importorskip('torch')
+
+import constants
+from videodataloader import VideoDataLoader, frames_to_blob
+
+
+def legacy_prepare_frame(img0, w, h):
+    '''
+    Preprocess frame for the detector as VideoDataLoader did before preprocessing by one resize
+    (as benchmarks.legacy_prepare_frame)
+    :return: normalized padded frame C x H x W and resized frame for drawing
+    '''
+    img0 = cv2.resize(img0, (w, h), interpolation=cv2.INTER_AREA)
+    width, height = constants.OUTPUT_FRAME_SIZE
+    ratio = min(float(height)/h, float(width)/w)
+    new_shape = (round(w*ratio), round(h*ratio))
+    dw, dh = (width-new_shape[0])/2, (height-new_shape[1])/2
+    img = cv2.resize(img0, new_shape, interpolation=cv2.INTER_AREA)
+    img = cv2.copyMakeBorder(img, round(dh-0.1), round(dh+0.1), round(dw-0.1), round(dw+0.1), cv2.BORDER_CONSTANT,
+                             value=(127.5, 127.5, 127.5))
+    img = img[:, :, ::-1].transpose(2, 0, 1)
+    img = np.ascontiguousarray(img, dtype=np.float32)
+    img /= 255.0
+    return img, img0
+
+
+@pytest.fixture(params=[(640, 360), (800, 400), (360, 640), (348, 526)])
+def video(request, tmp_path):
+    '''
+    Short video of noise, sizes give frames padded by height, by width and resized twice by rounding of size
+    '''
+    width, height = request.param
+    video = str(tmp_path/'video.avi')
+    writer = cv2.VideoWriter(video, cv2.VideoWriter_fourcc(*'MJPG'), 25, (width, height))
+    if not writer.isOpened():
+        pytest.skip('Video is not written by OpenCV')
+    rng = np.random.default_rng(0)
+    for _ in range(3):
+        writer.write(rng.integers(0, 256, (height, width, 3), dtype=np.uint8))
+    writer.release()
+    return video
+
+
+def test_prepared_frames_match_legacy_preprocessing(video):
+    dataloader = VideoDataLoader(video, constants.OUTPUT_FRAME_SIZE)
+    assert len(dataloader) == 3
+    for _ in range(len(dataloader)):
+        _, img0 = dataloader.readFrame()
+        img, drawn = dataloader.prepareFrame(img0)
+        expected, expected0 = legacy_prepare_frame(img0, dataloader.w, dataloader.h)
+        assert torch.equal(frames_to_blob([img])[0], torch.from_numpy(expected))
+        assert np.array_equal(drawn, expected0)
@@ -0,0 +1,215 @@
+import queue
+import threading
+import time
+
+import constants
+from profiler import StageProfiler
+
+from utils.log import logger
+
+
+class PipelineStage:
+    '''
+    Implement statistics of one stage of tracking pipeline
+    '''
+
+    def __init__(self, name):
+        '''
+        Constructor
+        :param name: name of stage
+        '''
+        self.name = name
+        self.frames = 0 # number of processed frames
+        self.busy_time = 0.0 # time spent on processing of frames (seconds)
+        self.depth_sum = 0 # sum of sizes of output queue to get its average size
+        self.depth_max = 0 # maximum size of output queue
+        self.batches = 0 # number of processed batches
+
+
+    def register(self, frames, elapsed, depth):
+        '''
+        Register processed batch of frames
+        :param frames: number of frames in batch
+        :param elapsed: time of processing the batch
+        :param depth: size of output queue after putting the batch
+        '''
+        self.frames += frames
+        self.busy_time += elapsed
+        self.depth_sum += depth
+        self.depth_max = max(self.depth_max, depth)
+        self.batches += 1
+
+
+    def throughput(self):
+        return self.frames/max(1e-5, self.busy_time)
+
+
+    def averageDepth(self):
+        return self.depth_sum/max(1, self.batches)
+
+
+    def __repr__(self):
+        return '{}: {} frames, {:.2f} fps, queue depth avg {:.1f} max {}'.format(
+            self.name, self.frames, self.throughput(), self.averageDepth(), self.depth_max)
+
+
+class TrackingPipeline:
+    '''
+    Implement staged pipeline of tracking, where decoding, preprocessing, tracking and rendering of frames
+    are run by separate worker threads connected with bounded queues.
+    Each stage has a single worker, so frames go through all stages in the order of video.
+    Frames are passed between stages in batches of fixed size (the last batch may be smaller)
+    '''
+
+    STAGES = ['decode', 'preprocess', 'track', 'render']
+    FINISHED = None # marker of the end of frames in queues
+
+
+    def __init__(self, dataloader, track_fn, render_fn, queue_size=constants.PIPELINE_QUEUE_SIZE, batch_size=1,
+                 start_frame=0, profiler=None):
+        '''
+        Constructor
+        :param dataloader: loader of video (VideoDataLoader)
+        :param track_fn: function (frame_id, frames) -> [result, ...] which tracks objects on the batch of frames
+        starting from frame_id, frames is a list of (position of frame in video, preprocessed frame, frame for drawing)
+        :param render_fn: function (frame_id, img0, result) which draws and saves tracked objects
+        :param queue_size: maximum number of batches waiting in the queue between two stages
+        :param batch_size: number of frames in batch
+        :param start_frame: number of the first frame
+        :param profiler: StageProfiler to register depths of queues (None - not registered)
+        '''
+        self.__dataloader = dataloader
+        self.__batchsize = batch_size
+        self.__startframe = start_frame
+        self.__track = track_fn
+        self.__render = render_fn
+        self.__queues = [queue.Queue(maxsize=queue_size) for _ in range(len(self.STAGES)-1)]
+        self.__stats = [PipelineStage(name) for name in self.STAGES]
+        self.__stop = threading.Event() # signal to stop all workers after a failure
+        self.__errors = []
+        self.__profiler = profiler or StageProfiler('pipeline', enabled=False)
+
+
+    def run(self):
+        '''
+        Launch all stages and wait for the end of processing
+        '''
+        workers = [threading.Thread(target=self.__runStage, args=(i, fn), name='pipeline-'+self.STAGES[i], daemon=True)
+                   for i, fn in enumerate([self.__decodeFrames, self.__preprocessFrames, self.__trackFrames,
+                                           self.__renderFrames])]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.report()
+        if self.__errors:
+            raise self.__errors[0]
+
+
+    def report(self):
+        '''
+        Log per-stage throughput and queue depth
+        '''
+        for stage in self.__stats:
+            logger.info(stage)
+
+
+    def queueDepths(self):
+        '''
+        :return: current number of frames waiting in each queue
+        '''
+        return [q.qsize() for q in self.__queues]
+
+
+    def __decodeFrames(self, frame_id, _):
+        frames = []
+        try:
+            while len(frames) < self.__batchsize:
+                frames.append(self.__dataloader.readFrame())
+        except StopIteration:
+            if not frames:
+                raise
+        return frames
+
+
+    def __preprocessFrames(self, frame_id, frames):
+        return [(position,)+self.__dataloader.prepareFrame(img0) for position, img0 in frames]
+
+
+    def __trackFrames(self, frame_id, frames):
+        results = self.__track(frame_id, frames)
+        return [(img0, result) for (_, _, img0), result in zip(frames, results)]
+
+
+    def __renderFrames(self, frame_id, items):
+        for i, (img0, result) in enumerate(items):
+            self.__render(frame_id+i, img0, result)
+        return items
+
+
+    def __runStage(self, idx, fn):
+        '''
+        Worker of stage: take batches of frames from input queue, process them and put to output queue
+        :param idx: number of stage
+        :param fn: function (frame_id, batch) -> batch of processing frames of stage,
+        where frame_id is a number of the first frame in batch
+        '''
+        inqueue = self.__queues[idx-1] if idx > 0 else None
+        outqueue = self.__queues[idx] if idx < len(self.__queues) else None
+        stats = self.__stats[idx]
+        frame_id, item = self.__startframe, None
+        logged_id = frame_id
+        try:
+            while not self.__stop.is_set():
+                if inqueue is not None:
+                    item = self.__get(inqueue)
+                    if item is self.FINISHED:
+                        break
+                    frame_id, item = item
+                start = time.perf_counter()
+                try:
+                    item = fn(frame_id, item)
+                except StopIteration: # video is over (only for decoding stage)
+                    break
+                elapsed = time.perf_counter()-start
+                if outqueue is not None:
+                    self.__put(outqueue, (frame_id, item))
+                depth = outqueue.qsize() if outqueue is not None else 0
+                stats.register(len(item), elapsed, depth)
+                if outqueue is not None:
+                    self.__profiler.gauge('queue_'+stats.name, depth)
+                frame_id += len(item)
+                if outqueue is None and frame_id-logged_id >= 100:
+                    logger.info('Pipeline frame {}, queue depths {}'.format(frame_id, self.queueDepths()))
+                    logged_id = frame_id
+        except Exception as e:
+            self.__errors.append(e)
+            self.__stop.set()
+        finally:
+            if outqueue is not None:
+                self.__put(outqueue, self.FINISHED, force=True)
+
+
+    def __get(self, q):
+        while True:
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                if self.__stop.is_set():
+                    return self.FINISHED
+
+
+    def __put(self, q, item, force=False):
+        while True:
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                if self.__stop.is_set() and not force:
+                    return
+                if self.__stop.is_set():
+                    # Downstream stage may have failed, so free place for the marker of the end
+                    try:
+                        q.get_nowait()
+                    except queue.Empty:
+                        pass
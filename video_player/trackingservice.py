@@ -0,0 +1,443 @@
+'''
+Local tracking service, which keeps the detector loaded and tracks submitted videos one by one.
+Jobs are submitted, watched and cancelled over HTTP on localhost by TrackingClient
+'''
+
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+import traceback
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib import error, request
+
+import constants
+
+
+# Parameters of MOTTracker, which can be set for a job (the rest are fixed by the service)
+JOB_OPTIONS = ['pipelined', 'queue_size', 'save_frames', 'video_backend', 'resume', 'checkpoint_interval',
+               'frame_range', 'output_name', 'render_video', 'detection_stride', 'adaptive_stride', 'background',
+               'online_statistics']
+
+
+class TrackingJob:
+    '''
+    Implement job of tracking of video
+    '''
+
+    def __init__(self, job_id, video, options):
+        '''
+        Constructor
+        :param job_id: number of job
+        :param video: video for tracking objects
+        :param options: dictionary of parameters of MOTTracker from JOB_OPTIONS
+        '''
+        self.id = job_id
+        self.video = video
+        self.options = options
+        self.status = 'queued' # queued, running, finished, failed or cancelled
+        self.frames, self.total = 0, 0
+        self.cancel_event = threading.Event()
+        self.submitted, self.started, self.finished = time.time(), None, None
+        basename = options.get('output_name') or os.path.splitext(os.path.basename(video))[0]
+        self.markup = os.path.abspath(os.path.join(constants.RESULTS_FOLDER, str(basename)+'.txt'))
+        self.marked_video = os.path.abspath(os.path.join(constants.RESULTS_FOLDER, str(basename)+'.avi'))
+
+
+    def updateProgress(self, frames, total):
+        self.frames, self.total = frames, total
+
+
+    def toDict(self):
+        return {'id': self.id, 'video': self.video, 'options': self.options, 'status': self.status,
+                'frames': self.frames, 'total': self.total, 'progress': self.frames/max(1, self.total),
+                'submitted': self.submitted, 'started': self.started, 'finished': self.finished,
+                'markup': self.markup, 'marked_video': self.marked_video}
+
+
+class TrackingService:
+    '''
+    Implement service of tracking with the detector loaded once for all jobs
+    '''
+
+    def __init__(self, gpu_number, device='cuda', model_variant='float', batch_size=1, calibration_video=None,
+                 tracker_params=None):
+        '''
+        Constructor
+        :param gpu_number: GPU number of videocard to launch algorithm of detection and tracking
+        :param device: device to launch the detector ('cuda' or 'cpu')
+        :param model_variant: variant of detector from constants.MODEL_VARIANTS
+        :param batch_size: number of frames passed through the detector by one forward pass
+        :param calibration_video: video to calibrate int8 model or to trace model
+        :param tracker_params: argparse object with parameters of JDE Tracker (None - default parameters)
+        '''
+        from detector import build_model, load_frames, tracker_options
+        from utils.log import logger
+        self.__logger = logger
+        self.__gpu = gpu_number
+        self.__device = device
+        self.__variant = model_variant
+        self.__batchsize = batch_size
+        self.__trackerparams = tracker_params or tracker_options()
+        if self.__device == 'cuda':
+            os.environ['CUDA_VISIBLE_DEVICES'] = str(self.__gpu)
+        frames = None
+        if self.__variant in ['int8', 'traced']:
+            if calibration_video is None:
+                raise ValueError('Model {} needs a video to calibrate or to trace it'.format(self.__variant))
+            frames = load_frames(calibration_video, constants.CALIBRATION_FRAMES)
+        self.__model = build_model(self.__trackerparams, self.__device, self.__variant, frames, self.__batchsize)
+        self.__logger.info('Model {} on {} is loaded'.format(self.__variant, self.__device))
+        self.__jobs = OrderedDict()
+        self.__queue = deque()
+        self.__condition = threading.Condition()
+        self.__ids = itertools.count(1)
+
+
+    def submit(self, video, options=None):
+        '''
+        Add job of tracking into queue
+        :param video: video for tracking objects
+        :param options: dictionary of parameters of MOTTracker from JOB_OPTIONS
+        :return: dictionary with state of job
+        '''
+        options = dict(options or {})
+        unknown = set(options)-set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError('Unknown options of job: {}'.format(', '.join(sorted(unknown))))
+        if not os.path.isfile(video):
+            raise ValueError('Cannot find video {}'.format(video))
+        name = options.get('output_name')
+        # Results of job are saved only into the folder of results
+        if name is not None and (not isinstance(name, str) or name in ['.', '..'] or
+                                 any(sep in name for sep in ['/', '\\'])):
+            raise ValueError('Name of results must be a file name without folders: {}'.format(name))
+        if options.get('frame_range') is not None:
+            options['frame_range'] = tuple(options['frame_range'])
+        with self.__condition:
+            job = TrackingJob(next(self.__ids), video, options)
+            self.__jobs[job.id] = job
+            self.__queue.append(job)
+            self.__condition.notify()
+        self.__logger.info('Job {} for {} is queued'.format(job.id, video))
+        return job.toDict()
+
+
+    def jobs(self):
+        with self.__condition:
+            return [job.toDict() for job in self.__jobs.values()]
+
+
+    def job(self, job_id):
+        '''
+        :return: dictionary with state of job (KeyError if there is no such job)
+        '''
+        with self.__condition:
+            return self.__jobs[job_id].toDict()
+
+
+    def cancel(self, job_id):
+        '''
+        Cancel job: queued job is removed from queue, running job is stopped after the current batch of frames
+        :return: dictionary with state of job (KeyError if there is no such job)
+        '''
+        with self.__condition:
+            job = self.__jobs[job_id]
+            if job.status == 'queued':
+                self.__queue.remove(job)
+                job.status, job.finished = 'cancelled', time.time()
+            elif job.status == 'running':
+                job.cancel_event.set()
+            return job.toDict()
+
+
+    def __runJob(self, job):
+        from mottracker import MOTTracker
+        tracker = MOTTracker(job.video, self.__gpu, batch_size=self.__batchsize, device=self.__device,
+                             model_variant=self.__variant, tracker_params=self.__trackerparams, model=self.__model,
+                             progress=job.updateProgress, cancel_event=job.cancel_event, **job.options)
+        return tracker.trackVideo()
+
+
+    def run(self):
+        '''
+        Process jobs from queue one by one
+        '''
+        while True:
+            with self.__condition:
+                while not self.__queue:
+                    self.__condition.wait()
+                job = self.__queue.popleft()
+                job.status, job.started = 'running', time.time()
+            self.__logger.info('Job {} is started'.format(job.id))
+            try:
+                finished = self.__runJob(job)
+            except Exception: # wrong options of job or failure of tracking
+                self.__logger.info('Job {} failed:\n{}'.format(job.id, traceback.format_exc()))
+                finished = False
+            with self.__condition:
+                if finished:
+                    job.status = 'finished'
+                else:
+                    job.status = 'cancelled' if job.cancel_event.is_set() else 'failed'
+                job.finished = time.time()
+            self.__logger.info('Job {} is {}'.format(job.id, job.status))
+
+
+    def serve(self, host=constants.SERVICE_HOST, port=constants.SERVICE_PORT):
+        '''
+        Launch processing of jobs and HTTP server
+        '''
+        threading.Thread(target=self.run, name='tracking', daemon=True).start()
+        handler = type('Handler', (TrackingRequestHandler,), {'service': self})
+        server = ThreadingHTTPServer((host, port), handler)
+        self.__logger.info('Tracking service is listening on http://{}:{}'.format(host, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+class TrackingRequestHandler(BaseHTTPRequestHandler):
+    '''
+    Implement HTTP interface of tracking service:
+    GET /jobs - list of jobs, GET /jobs/<id> - state of job,
+    POST /jobs with {"video": ..., "options": {...}} - submit job, DELETE /jobs/<id> - cancel job
+    '''
+
+    service = None
+
+
+    def __reply(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+    def __jobId(self):
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'jobs' or not parts[1].isdigit():
+            return None
+        return int(parts[1])
+
+
+    def do_GET(self):
+        if self.path.strip('/') == 'jobs':
+            self.__reply(200, self.service.jobs())
+            return
+        job_id = self.__jobId()
+        try:
+            self.__reply(200, self.service.job(job_id))
+        except KeyError:
+            self.__reply(404, {'error': 'Unknown job {}'.format(self.path)})
+
+
+    def do_POST(self):
+        if self.path.strip('/') != 'jobs':
+            self.__reply(404, {'error': 'Unknown path {}'.format(self.path)})
+            return
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            self.__reply(201, self.service.submit(data['video'], data.get('options')))
+        except (ValueError, KeyError, TypeError) as e:
+            self.__reply(400, {'error': str(e)})
+
+
+    def do_DELETE(self):
+        try:
+            self.__reply(200, self.service.cancel(self.__jobId()))
+        except KeyError:
+            self.__reply(404, {'error': 'Unknown job {}'.format(self.path)})
+
+
+    def log_message(self, format, *args):
+        pass # requests of progress are too frequent for log
+
+
+class TrackingClient:
+    '''
+    Implement client of tracking service
+    '''
+
+    def __init__(self, host=constants.SERVICE_HOST, port=constants.SERVICE_PORT):
+        self.__url = 'http://{}:{}'.format(host, port)
+
+
+    def __request(self, method, path, data=None):
+        '''
+        Send request to the service
+        :return: decoded answer (ValueError with message of the service, if request was rejected;
+        OSError, if the service is not available)
+        '''
+        body = json.dumps(data).encode('utf-8') if data is not None else None
+        req = request.Request(self.__url+path, data=body, method=method, headers={'Content-Type': 'application/json'})
+        try:
+            with request.urlopen(req, timeout=constants.SERVICE_TIMEOUT) as answer:
+                return json.loads(answer.read().decode('utf-8'))
+        except error.HTTPError as e:
+            raise ValueError(json.loads(e.read().decode('utf-8')).get('error', str(e)))
+
+
+    def submit(self, video, **options):
+        '''
+        Submit video for tracking
+        :param video: video for tracking objects
+        :param options: parameters of MOTTracker from JOB_OPTIONS
+        :return: dictionary with state of job
+        '''
+        return self.__request('POST', '/jobs', {'video': os.path.abspath(video), 'options': options})
+
+
+    def jobs(self):
+        return self.__request('GET', '/jobs')
+
+
+    def status(self, job_id):
+        return self.__request('GET', '/jobs/{}'.format(job_id))
+
+
+    def cancel(self, job_id):
+        return self.__request('DELETE', '/jobs/{}'.format(job_id))
+
+
+    def wait(self, job_id, interval=constants.SERVICE_POLL_SECONDS, callback=None):
+        '''
+        Wait for the end of job
+        :param callback: function callback(job) called by each check of state of job
+        :return: dictionary with the final state of job
+        '''
+        while True:
+            job = self.status(job_id)
+            if callback is not None:
+                callback(job)
+            if job['status'] not in ['queued', 'running']:
+                return job
+            time.sleep(interval)
+
+
+def init_argparse():
+    '''
+    Initialize argparse
+    '''
+    parser = argparse.ArgumentParser(description='Local service of Multiple Object Tracking')
+    parser.add_argument(
+        '--command',
+        nargs='?',
+        help='Launch the service, submit videos, show jobs or cancel job',
+        choices=['serve', 'submit', 'status', 'cancel'],
+        default='serve',
+        type=str)
+    parser.add_argument(
+        '--host',
+        nargs='?',
+        help='Host of the service',
+        default=constants.SERVICE_HOST,
+        type=str)
+    parser.add_argument(
+        '--port',
+        nargs='?',
+        help='Port of the service',
+        default=constants.SERVICE_PORT,
+        type=int)
+    # Parameters of the service
+    parser.add_argument(
+        '--gpu',
+        nargs='?',
+        help='Number of GPU to implement tracking',
+        default=constants.GPU_NUMBER,
+        type=int)
+    parser.add_argument(
+        '--device',
+        nargs='?',
+        help='Device to launch the detector',
+        choices=constants.DEVICES,
+        default='cuda',
+        type=str)
+    parser.add_argument(
+        '--model_variant',
+        nargs='?',
+        help='Variant of the detector',
+        choices=constants.MODEL_VARIANTS,
+        default='float',
+        type=str)
+    parser.add_argument(
+        '--batch_size',
+        nargs='?',
+        help='Number of frames passed through the detector by one forward pass',
+        default=1,
+        type=int)
+    parser.add_argument(
+        '--calibration_video',
+        nargs='?',
+        help='Video to calibrate int8 model or to trace model',
+        default=None,
+        type=str)
+    # Parameters of jobs
+    parser.add_argument(
+        '--input_video',
+        nargs='+',
+        help='Videos to track objects',
+        default=[],
+        type=str)
+    parser.add_argument(
+        '--job',
+        nargs='?',
+        help='Number of job to show or to cancel (all jobs are shown by default)',
+        default=None,
+        type=int)
+    parser.add_argument(
+        '--wait',
+        help='Wait for the end of submitted jobs',
+        action='store_true')
+    parser.add_argument(
+        '--no_video',
+        help='Do not save the marked video',
+        action='store_true')
+    parser.add_argument(
+        '--detection_stride',
+        nargs='?',
+        help='Run the detector every detection_stride frames',
+        default=1,
+        type=int)
+    return parser
+
+
+def main():
+    parser = init_argparse()
+    # Extract arguments of script
+    args = parser.parse_args()
+    if args.command == 'serve':
+        service = TrackingService(args.gpu, device=args.device, model_variant=args.model_variant,
+                                  batch_size=args.batch_size, calibration_video=args.calibration_video)
+        service.serve(args.host, args.port)
+        return
+    client = TrackingClient(args.host, args.port)
+    if args.command == 'submit':
+        jobs = [client.submit(video, render_video=not args.no_video, detection_stride=args.detection_stride)
+                for video in args.input_video]
+        for job in jobs:
+            print('Job {id} for {video} is {status}'.format(**job))
+        if args.wait:
+            for job in jobs:
+                job = client.wait(job['id'])
+                print('Job {id} for {video} is {status}: {markup}'.format(**job))
+    elif args.command == 'status':
+        for job in ([client.status(args.job)] if args.job is not None else client.jobs()):
+            print('Job {id} for {video}: {status}, {progress:.0%}'.format(**job))
+    elif args.command == 'cancel':
+        if args.job is None:
+            parser.error('--job is required to cancel job')
+        job = client.cancel(args.job)
+        print('Job {id} for {video}: {status}'.format(**job))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,8 +4,24 @@ Based on utils.datasets.py from project Towards-Realtime-MOT (https://github.com
 
 import numpy as np
 import cv2
+import torch
 
 import constants
+from profiler import StageProfiler
+from videoindex import VideoIndex
+
+
+def frames_to_blob(frames, device='cpu'):
+    '''
+    Convert preprocessed frames into the input of the detector by one fused step on device:
+    uint8 BGR frames are reordered into RGB channels first and normalized into range 0-1
+    :param frames: list of preprocessed frames H x W x C
+    :param device: device of the detector
+    :return: tensor N x C x H x W
+    '''
+    blob = torch.from_numpy(np.stack(frames)).to(device) # uint8 frames are 4 times smaller to transfer
+    blob = blob.permute(0, 3, 1, 2).flip(1)
+    return blob.to(torch.float32, memory_format=torch.contiguous_format).div_(255.0)
 
 
 class VideoDataLoader:
@@ -13,68 +29,146 @@ class VideoDataLoader:
     Implement class of loading video as a set of frames
     '''
 
-    def __init__(self, path, img_size=(1088, 608)):
+    def __init__(self, path, img_size=(1088, 608), profiler=None):
         '''
         Constructor
         :param path: video
         :param img_size: size of extracted frames
+        :param profiler: StageProfiler to measure decoding and preprocessing of frames (None - not measured)
         '''
+        self.profiler = profiler or StageProfiler(path, enabled=False)
         self.cap = cv2.VideoCapture(path)
+        self.index = VideoIndex(path) # number of frames by CAP_PROP_FRAME_COUNT is unreliable
         self.frame_rate = int(round(self.cap.get(cv2.CAP_PROP_FPS)))
-        self.count = 0
+        self.count = -1 # position of the last read frame
+        self.end = None # position of frame to stop reading at (None - read till the end of video)
         self.w, self.h = self.__getFrameSize(int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
                                              int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
                                              img_size[0], img_size[1])
+        self.__adjustLetterbox()
 
 
     def __iter__(self):
-        self.count = -1
         return self
 
 
     def __next__(self):
-        self.count += 1
-        if self.count >= len(self):
-            raise StopIteration
-        res, img0 = self.cap.read() # BGR format
-        while img0 is None:
-            print('Failed to load frame {:d}'.format(self.count))
+        count, img0 = self.readFrame()
+        img, img0 = self.prepareFrame(img0)
+        return count, img, img0
+
+
+    def seek(self, position, end=None):
+        '''
+        Set the position of video to continue reading from the frame.
+        Video is set to the previous keyframe and frames till the position are skipped without decoding into images
+        :param position: number of frame in video
+        :param end: number of frame to stop reading at (None - read till the end of video)
+        '''
+        keyframe = self.index.keyframeBefore(position)
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        self.count = keyframe-1
+        while self.count < position-1 and self.cap.grab():
             self.count += 1
-            if self.count >= len(self):
-                raise StopIteration
-            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.count)
-            res, img0 = self.cap.read()  # BGR format
-        img0 = cv2.resize(img0, (self.w, self.h), interpolation=cv2.INTER_AREA) # resize extracted frame
-        # Padded resize
-        img = self.__getPaddedRectangularFrame(img0)
-        # Normalize RGB
-        img = img[:, :, ::-1].transpose(2, 0, 1)
-        img = np.ascontiguousarray(img, dtype=np.float32)
-        img /= 255.0
-        return self.count, img, img0
+        if end is not None:
+            self.end = end
+
+
+    def readFrame(self):
+        '''
+        Decode the next frame of video strictly sequentially, broken frames are skipped without seeking
+        :return: number of frame and decoded frame in BGR format
+        '''
+        with self.profiler.stage('decode', frames=1):
+            return self.__readFrame()
+
+
+    def __readFrame(self):
+        n_frames = len(self) if self.end is None else min(len(self), self.end)
+        failures = 0
+        while self.count+1 < n_frames:
+            if not self.cap.grab():
+                failures += 1
+                if failures > constants.READER_MAX_FAILURES:
+                    break
+                continue
+            # Number of frame is found by timestamp, so frames lost by decoder do not shift numbering
+            position = self.index.position(self.cap.get(cv2.CAP_PROP_POS_MSEC), self.count+1)
+            res, img0 = self.cap.retrieve() # BGR format
+            self.count = position
+            if position >= n_frames:
+                break
+            if res and img0 is not None:
+                return self.count, img0
+            print('Failed to load frame {:d}'.format(position))
+            failures += 1
+            if failures > constants.READER_MAX_FAILURES:
+                break
+        raise StopIteration
+
+
+    def timestamp(self, position):
+        '''
+        :param position: number of frame in video
+        :return: timestamp of frame in milliseconds from the start of video
+        '''
+        return self.index.timestamp(position)
+
+
+    def __adjustLetterbox(self):
+        '''
+        Calculate geometry of padded frame for the detector once for all frames of video
+        '''
+        width, height = constants.OUTPUT_FRAME_SIZE
+        ratio = min(float(height)/self.h, float(width)/self.w)
+        self.__innersize = (round(self.w*ratio), round(self.h*ratio)) # size of frame inside padded frame
+        dw = (width-self.__innersize[0])/2 # width padding
+        dh = (height-self.__innersize[1])/2 # height padding
+        self.__top, self.__left = round(dh-0.1), round(dw-0.1)
+        # Color of padding as it is rounded by OpenCV
+        self.__padcolor = cv2.copyMakeBorder(np.zeros((1, 1, 3), dtype=np.uint8), 1, 0, 0, 0, cv2.BORDER_CONSTANT,
+                                             value=(127.5, 127.5, 127.5))[0, 0]
+
+
+    def prepareFrame(self, img0):
+        '''
+        Preprocess decoded frame for the detector. The frame is resized once right inside the padded frame,
+        conversion into the input of the detector is made by frames_to_blob
+        :param img0: decoded frame in BGR format
+        :return: padded frame for the detector (uint8 BGR H x W x C) and resized frame for drawing
+        '''
+        with self.profiler.stage('preprocess', frames=1):
+            return self.__prepareFrame(img0)
+
+
+    def __prepareFrame(self, img0):
+        width, height = constants.OUTPUT_FRAME_SIZE
+        (w, h), top, left = self.__innersize, self.__top, self.__left
+        img = np.empty((height, width, 3), dtype=np.uint8)
+        img[:top], img[top+h:] = self.__padcolor, self.__padcolor
+        img[top:top+h, :left], img[top:top+h, left+w:] = self.__padcolor, self.__padcolor
+        inner = img[top:top+h, left:left+w]
+        if self.__innersize == (self.w, self.h):
+            cv2.resize(img0, (w, h), dst=inner, interpolation=cv2.INTER_AREA)
+            return img, inner
+        # Rounded size inside padded frame differs from the size of drawing, so the frame is resized twice
+        img0 = self.resizeFrame(img0)
+        cv2.resize(img0, (w, h), dst=inner, interpolation=cv2.INTER_AREA)
+        return img, img0
+
+
+    def resizeFrame(self, img0):
+        '''
+        Resize decoded frame to the size of drawing
+        '''
+        return cv2.resize(img0, (self.w, self.h), interpolation=cv2.INTER_AREA) # resize extracted frame
 
 
     def __len__(self):
-        n_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))  # number of files
-        return n_frames
+        return len(self.index)
 
 
     def __getFrameSize(self, vw, vh, dw, dh):
         wa, ha = float(dw)/vw, float(dh)/vh
         a = min(wa, ha)
-        return int(vw*a), int(vh*a)
-
-
-    def __getPaddedRectangularFrame(self, img):
-        shape = img.shape[:2]  # shape = [height, width]
-        width, height = constants.OUTPUT_FRAME_SIZE
-        ratio = min(float(height)/shape[0], float(width)/shape[1])
-        new_shape = (round(shape[1]*ratio), round(shape[0]*ratio))  # new_shape = [width, height]
-        dw = (width-new_shape[0])/2  # width padding
-        dh = (height-new_shape[1])/2  # height padding
-        top, bottom = round(dh-0.1), round(dh+0.1) # top and bottom borders
-        left, right = round(dw-0.1), round(dw+0.1) # left and right borders
-        img = cv2.resize(img, new_shape, interpolation=cv2.INTER_AREA)  # resized image, no border
-        # Padded rectangular image
-        img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(127.5, 127.5, 127.5))
-        return img
\ No newline at end of file
+        return int(vw*a), int(vh*a)
\ No newline at end of file
@@ -0,0 +1,125 @@
+import os
+import subprocess
+import cv2
+import numpy as np
+
+import constants
+
+
+class VideoIndex:
+    '''
+    Implement index of frames of video: timestamps of all frames and keyframes.
+    The index is built once by ffprobe (or by decoding of video if ffprobe is not available)
+    and is cached next to the video
+    '''
+
+    def __init__(self, video):
+        '''
+        Constructor
+        :param video: path to the video
+        '''
+        self.__video = video
+        self.__cachefile = video+constants.VIDEO_INDEX_SUFFIX
+        self.timestamps, self.keyframes = self.__load()
+        # Frames are matched by timestamps within a half of frame duration
+        self.__tolerance = float(np.median(np.diff(self.timestamps)))/2 if len(self.timestamps) > 1 else 0.0
+
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+    def __load(self):
+        '''
+        Load index from cache or build it
+        :return: timestamps of frames in milliseconds from the start of video and flags of keyframes
+        '''
+        stat = os.stat(self.__video)
+        signature = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64) # cache is rebuilt for changed video
+        if os.path.isfile(self.__cachefile):
+            try:
+                cache = np.load(self.__cachefile)
+                if np.array_equal(cache['signature'], signature):
+                    return cache['timestamps'], cache['keyframes']
+            except (OSError, ValueError, KeyError):
+                pass # broken cache is rebuilt
+        try:
+            timestamps, keyframes = self.__probePackets()
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            timestamps, keyframes = self.__grabFrames()
+        try:
+            tmp_file = self.__cachefile+'.tmp.npz'
+            np.savez(tmp_file, signature=signature, timestamps=timestamps, keyframes=keyframes)
+            os.replace(tmp_file, self.__cachefile)
+        except OSError:
+            pass # index is kept only in memory, if folder of video is not writable
+        return timestamps, keyframes
+
+
+    def __probePackets(self):
+        '''
+        Build index by packets of video stream (without decoding)
+        '''
+        output = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries',
+                                 'packet=pts_time,flags', '-of', 'csv=p=0', self.__video],
+                                stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+        packets = [line.split(',') for line in output.splitlines() if line.strip()]
+        if not packets:
+            raise ValueError('No packets of video stream')
+        timestamps = np.array([float(pts) if pts != 'N/A' else np.nan for pts, *_ in packets])
+        keyframes = np.array(['K' in ''.join(flags) for _, *flags in packets])
+        missing = np.isnan(timestamps)
+        if missing.all():
+            raise ValueError('No timestamps of packets')
+        if missing.any(): # timestamps of packets without them are interpolated
+            positions = np.arange(len(timestamps))
+            timestamps[missing] = np.interp(positions[missing], positions[~missing], timestamps[~missing])
+        order = np.argsort(timestamps, kind='stable') # packets are stored in order of decoding
+        timestamps, keyframes = timestamps[order], keyframes[order]
+        return 1000.0*(timestamps-timestamps[0]), keyframes
+
+
+    def __grabFrames(self):
+        '''
+        Build index by sequential decoding of all frames of video
+        '''
+        cap = cv2.VideoCapture(self.__video)
+        timestamps = []
+        while cap.grab():
+            timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+        cap.release()
+        keyframes = np.zeros(len(timestamps), dtype=bool) # keyframes are unknown without ffprobe
+        keyframes[:1] = True
+        return np.array(timestamps, dtype=np.float64), keyframes
+
+
+    def timestamp(self, position):
+        '''
+        :param position: number of frame in video
+        :return: timestamp of frame in milliseconds from the start of video
+        '''
+        return float(self.timestamps[min(position, len(self.timestamps)-1)])
+
+
+    def keyframeBefore(self, position):
+        '''
+        :param position: number of frame in video
+        :return: number of the last keyframe not after the frame (the frame itself, if keyframes are unknown)
+        '''
+        if np.count_nonzero(self.keyframes) <= 1:
+            return position
+        keyframes = np.flatnonzero(self.keyframes[:position+1])
+        return int(keyframes[-1]) if len(keyframes) else 0
+
+
+    def position(self, msec, expected):
+        '''
+        Find number of frame by its timestamp
+        :param msec: timestamp of decoded frame in milliseconds
+        :param expected: number of frame expected by sequential decoding
+        :return: number of frame, frames lost by decoder are skipped in numbering
+        '''
+        i = int(np.searchsorted(self.timestamps, msec-self.__tolerance))
+        if i < len(self.timestamps) and i > expected and abs(self.timestamps[i]-msec) <= self.__tolerance:
+            return i
+        return expected
@@ -1,4 +1,4 @@
-from PyQt5.QtCore import Qt, QUrl
+from PyQt5.QtCore import Qt, QUrl, QTimer
 from PyQt5.QtMultimedia import QMediaContent, QMediaPlayer
 from PyQt5.QtMultimediaWidgets import QVideoWidget
 from PyQt5.QtWidgets import QFileDialog, QHBoxLayout, QLabel, QSizePolicy, QSlider, QStyle, QVBoxLayout, QMessageBox
@@ -8,11 +8,30 @@ from PyQt5 import QtWidgets, QtCore
 from PyQt5.QtWidgets import QApplication
 import sys
 import os
+import threading
+from concurrent.futures import Future
 
 import constants
 import operations
 from statdialog import StatDialog
-#from mottracker import MOTTracker
+from trackingservice import TrackingClient
+from videoindex import VideoIndex
+
+
+def start_index(filename):
+    '''
+    Build index of frames of video in background thread (it does not keep the application from exit)
+    :param filename: video
+    :return: future of VideoIndex
+    '''
+    future = Future()
+    def build():
+        try:
+            future.set_result(VideoIndex(filename))
+        except Exception as e: # statistics are shown without timestamps
+            future.set_exception(e)
+    threading.Thread(target=build, daemon=True).start()
+    return future
 
 
 class VideoPlayer(QMainWindow):
@@ -25,6 +44,14 @@ class VideoPlayer(QMainWindow):
         self.setWindowTitle('SportAISystem 1.0')
 
         self.__filename = '' # name of videofile
+        self.__client = TrackingClient() # videos are tracked by the local tracking service
+        self.__job = None # job of tracking of the opened video
+        self.__trackingTimer = QTimer(self) # timer to check progress of tracking
+        self.__trackingTimer.timeout.connect(self.checkTracking)
+        # Index of frames of the opened video is built in background, on a cold cache it takes the whole decoding
+        self.__index = None # future of VideoIndex of the opened video
+        self.__indexTimer = QTimer(self) # timer to wait for the index to show statistics
+        self.__indexTimer.timeout.connect(self.checkIndex)
 
         self.mediaPlayer = QMediaPlayer(None, QMediaPlayer.VideoSurface) # surface for showing videos
 
@@ -144,21 +171,64 @@ class VideoPlayer(QMainWindow):
         self.__filename, _ = QFileDialog.getOpenFileName(self, 'Open videos', os.getcwd(),
                                                          'Videos (*.avi *mp4 *.wmv)')
         if self.__filename:
+            self.__cancelTracking()
+            self.__indexTimer.stop()
+            self.__index = start_index(self.__filename) # timestamps for statistics
             if self.trackButton.isChecked(): # JDE Tracker was turned ON
-                QApplication.setOverrideCursor(Qt.WaitCursor)
+                try:
+                    self.__job = self.__client.submit(self.__filename)
+                except (OSError, ValueError) as e:
+                    self.errorLabel.setText('Cannot track the video: {}! Please launch the tracking service: '
+                                            'python trackingservice.py'.format(e))
+                    return
                 self.errorLabel.setText('Waiting for tracking the video')
-                #jde = MOTTracker(self.__filename, constants.GPU_NUMBER)
-                #jde.trackVideo()
-                QApplication.restoreOverrideCursor()
-                self.errorLabel.setText('')
-                tracked_video = os.path.join(constants.RESULTS_FOLDER, self.__filename)
-                self.mediaPlayer.setMedia(QMediaContent(QUrl.fromLocalFile(tracked_video)))
+                self.__trackingTimer.start(int(1000*constants.SERVICE_POLL_SECONDS)) # marked video is shown later
             else: # JDE Tracker was turned OFF
                 self.errorLabel.setText('')
-                self.mediaPlayer.setMedia(QMediaContent(QUrl.fromLocalFile(self.__filename)))
-            self.playButton.setEnabled(True)
-            self.stopButton.setEnabled(True)
-            self.mediaPlayer.pause()
+                self.__showVideo(self.__filename)
+
+
+    def __showVideo(self, filename):
+        self.mediaPlayer.setMedia(QMediaContent(QUrl.fromLocalFile(filename)))
+        self.playButton.setEnabled(True)
+        self.stopButton.setEnabled(True)
+        self.mediaPlayer.pause()
+
+
+    def __cancelTracking(self):
+        '''
+        Cancel tracking of the previous video
+        '''
+        self.__trackingTimer.stop()
+        if self.__job is not None:
+            try:
+                self.__client.cancel(self.__job['id'])
+            except (OSError, ValueError):
+                pass
+            self.__job = None
+
+
+    def checkTracking(self):
+        '''
+        Show progress of tracking of the video by the service and the marked video, when it is ready
+        '''
+        try:
+            job = self.__client.status(self.__job['id'])
+        except (OSError, ValueError) as e:
+            self.__trackingTimer.stop()
+            self.errorLabel.setText('Tracking service is not available: {}'.format(e))
+            return
+        if job['status'] in ['queued', 'running']:
+            self.errorLabel.setText('Waiting for tracking the video: {:.0%}'.format(job['progress']))
+            return
+        self.__trackingTimer.stop()
+        self.__job = None
+        if job['status'] == 'finished':
+            self.errorLabel.setText('')
+            self.__showVideo(job['marked_video'])
+        else:
+            self.errorLabel.setText('Tracking of the video is {}! Please see log of the tracking service'.format(
+                job['status']))
 
 
     def exitCall(self):
@@ -176,16 +246,47 @@ class VideoPlayer(QMainWindow):
         self.mediaPlayer.stop()
 
 
+    def __markupFile(self):
+        '''
+        :return: markup file with saved information about bboxes, ids of humans on each frame of video
+        '''
+        return os.path.join(constants.RESULTS_FOLDER, os.path.splitext(os.path.basename(self.__filename))[0]+'.txt')
+
+
     def pressStatistics(self):
-        # Set markup file with saved information about bboxes, ids of humans on each frame of video
-        markup = os.path.join(constants.RESULTS_FOLDER, os.path.splitext(os.path.basename(self.__filename))[0]+'.txt')
-        if os.path.exists(markup):
-            st = StatDialog(markup=markup)
-            st.exec()
+        if os.path.exists(self.__markupFile()):
+            if self.__index is None:
+                self.__index = start_index(self.__filename)
+            if self.__index.done():
+                self.__showStatistics()
+            else: # dialog is opened, when the index of video is built
+                self.errorLabel.setText('Preparing timestamps of the video for statistics...')
+                self.__indexTimer.start(int(1000*constants.INDEX_POLL_SECONDS))
         else:
             self.errorLabel.setText('Cannot find markup file! Please load marked video or mark it using Tracker before')
 
 
+    def checkIndex(self):
+        '''
+        Show statistics, when the index of the video is built
+        '''
+        if self.__index is not None and self.__index.done():
+            self.__indexTimer.stop()
+            self.errorLabel.setText('')
+            self.__showStatistics()
+
+
+    def __showStatistics(self):
+        '''
+        Open dialog of statistics of the video (time window of combats is not available without timestamps)
+        '''
+        timestamps = None
+        if self.__index.exception() is None:
+            timestamps = self.__index.result().timestamps
+        st = StatDialog(markup=self.__markupFile(), timestamps=timestamps)
+        st.exec()
+
+
     def trackHumans(self):
         if self.trackButton.isChecked():
             self.trackButton.setText('ON') # Turn ON tracker
@@ -0,0 +1,91 @@
+import os
+import subprocess
+import cv2
+
+import constants
+
+
+class MarkedVideoWriter:
+    '''
+    Implement class of writing marked frames into video incrementally, as soon as they are produced
+    '''
+
+    def __init__(self, filename, frame_rate, backend=constants.VIDEO_WRITER_BACKEND):
+        '''
+        Constructor
+        :param filename: output video
+        :param frame_rate: FPS of output video
+        :param backend: 'ffmpeg' - frames are piped into encoder subprocess, 'opencv' - cv2.VideoWriter is used
+        '''
+        if backend not in constants.VIDEO_WRITER_BACKENDS:
+            raise ValueError('Not available backend of video writer! Please choose the right one: {}'.format(
+                constants.VIDEO_WRITER_BACKENDS))
+        self.__filename = filename
+        self.__framerate = frame_rate
+        self.__backend = backend
+        self.__writer = None # encoder is started by the first frame, when the size of frames is known
+        self.frames = 0 # number of written frames
+
+
+    def __open(self, width, height):
+        if self.__backend == 'ffmpeg':
+            cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', '{}x{}'.format(width, height),
+                   '-r', str(self.__framerate), '-i', '-',
+                   '-c:v', constants.VIDEO_CODEC, '-q:v', str(constants.VIDEO_QUALITY), self.__filename]
+            self.__writer = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+        else:
+            fourcc = cv2.VideoWriter_fourcc(*constants.VIDEO_FOURCC)
+            self.__writer = cv2.VideoWriter(self.__filename, fourcc, self.__framerate, (width, height))
+
+
+    def write(self, img):
+        '''
+        Encode the frame into video
+        :param img: frame in BGR format
+        '''
+        if self.__writer is None:
+            self.__open(img.shape[1], img.shape[0])
+        if self.__backend == 'ffmpeg':
+            self.__writer.stdin.write(img.tobytes())
+        else:
+            self.__writer.write(img)
+        self.frames += 1
+
+
+    def close(self):
+        '''
+        Finish encoding of video
+        '''
+        if self.__writer is None:
+            return
+        if self.__backend == 'ffmpeg':
+            self.__writer.stdin.close()
+            self.__writer.wait()
+        else:
+            self.__writer.release()
+        self.__writer = None
+
+
+def join_videos(parts, frame_rate, output):
+    '''
+    Join parts of marked video into one video without reencoding
+    :param parts: list of (video, number of its first frame) sorted by frames, each part is cut by the first frame
+    of the next part
+    :param frame_rate: FPS of video
+    :param output: joined video
+    '''
+    list_filename = output+'.parts.txt'
+    with open(list_filename, 'w') as f:
+        for i, (filename, start_frame) in enumerate(parts):
+            f.write("file '{}'\n".format(os.path.abspath(filename)))
+            if i+1 < len(parts):
+                f.write('outpoint {:.6f}\n'.format((parts[i+1][1]-start_frame)/float(frame_rate)))
+    tmp_output = os.path.splitext(output)[0]+'.joined'+os.path.splitext(output)[1]
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-f', 'concat', '-safe', '0', '-i', list_filename,
+                    '-c', 'copy', tmp_output], check=True)
+    os.remove(list_filename)
+    for filename, _ in parts:
+        if os.path.exists(filename):
+            os.remove(filename)
+    os.replace(tmp_output, output)